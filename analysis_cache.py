@@ -0,0 +1,106 @@
+"""
+TEMU 智能出图系统 V8.0
+产品分析结果缓存 (内容寻址, 磁盘持久化)
+核心作者: 企鹅
+
+键 = sha256(归一化参考图字节 + 分析模型 + 提示词版本)
+存储在数据目录下的 SQLite 中, 跨会话共享, 容器重启后仍有效。
+按 TTL 过期, 超过容量时淘汰最久未使用的条目 (LRU)。
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import asdict
+from pathlib import Path
+from typing import Iterator, Optional
+
+from config import Config
+from gemini_client import ProductAnalysis
+
+
+class AnalysisCache:
+    """ProductAnalysis 的磁盘 LRU 缓存"""
+
+    def __init__(self, path: Optional[Path] = None, max_entries: Optional[int] = None,
+                 ttl_seconds: Optional[int] = None):
+        Config.ensure_data_dir()
+        self.path = Path(path) if path else Config._data_dir / "analysis_cache.db"
+        self.max_entries = max_entries if max_entries is not None else Config.ANALYSIS_CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else Config.ANALYSIS_CACHE_TTL
+        self._init_db()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(str(self.path), timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis ("
+                " key TEXT PRIMARY KEY,"
+                " payload TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_accessed ON analysis (accessed_at)")
+
+    @staticmethod
+    def make_key(image_bytes: bytes, model: str, prompt_version: str) -> str:
+        h = hashlib.sha256()
+        h.update(image_bytes)
+        h.update(b"\0" + model.encode() + b"\0" + prompt_version.encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[ProductAnalysis]:
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT payload, created_at FROM analysis WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                payload, created_at = row
+                if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                    conn.execute("DELETE FROM analysis WHERE key = ?", (key,))
+                    return None
+                conn.execute("UPDATE analysis SET accessed_at = ? WHERE key = ?", (now, key))
+            return ProductAnalysis(**json.loads(payload))
+        except Exception:
+            return None
+
+    def put(self, key: str, analysis: ProductAnalysis):
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO analysis (key, payload, created_at, accessed_at) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT(key) DO UPDATE SET payload = excluded.payload,"
+                    " created_at = excluded.created_at, accessed_at = excluded.accessed_at",
+                    (key, json.dumps(asdict(analysis), ensure_ascii=False), now, now),
+                )
+                self._evict(conn, now)
+        except Exception:
+            pass
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        if self.ttl_seconds:
+            conn.execute("DELETE FROM analysis WHERE created_at < ?", (now - self.ttl_seconds,))
+        if self.max_entries:
+            conn.execute(
+                "DELETE FROM analysis WHERE key IN ("
+                " SELECT key FROM analysis ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM analysis")
@@ -0,0 +1,210 @@
+"""
+TEMU 智能出图系统 V8.0
+运行数据分析 - 逐张生成记录 + 按小时/按天汇总
+核心作者: 企鹅
+
+每张图生成完成后记录一条明细 (模型、分辨率、宽高比、模板、耗时、重试次数、
+字节数、成败), 同时累加到按小时和按天的汇总行。汇总行保存延迟直方图,
+可合并计算任意时间段的 p50/p95。明细、小时汇总、天汇总分别按保留期清理,
+存储量有上限。
+"""
+import bisect
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from config import Config
+
+# 延迟直方图上界 (秒), 最后一格为溢出
+LATENCY_BUCKETS = (1, 2, 3, 5, 8, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300)
+
+HOUR = "hour"
+DAY = "day"
+
+PRUNE_INTERVAL = 600  # 清理过期数据的最小间隔 (秒)
+
+
+@dataclass
+class GenerationRecord:
+    """单张图片的生成记录"""
+    model: str
+    resolution: str
+    aspect_ratio: str
+    template: str
+    latency: float          # 秒, 含重试
+    retries: int            # 重试次数 (尝试次数 - 1)
+    bytes: int              # 输出大小
+    success: bool
+    ts: float = field(default_factory=time.time)
+
+
+def _bucket_start(ts: float, period: str) -> int:
+    if period == HOUR:
+        return int(ts // 3600 * 3600)
+    return int(datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+
+def _merge(hist: List[int], other: List[int]) -> List[int]:
+    return [a + b for a, b in zip(hist, other)]
+
+
+def hist_percentile(hist: List[int], q: float) -> Optional[float]:
+    """从直方图估算分位数 (桶内线性插值)"""
+    total = sum(hist)
+    if not total:
+        return None
+    target = q * total
+    seen = 0
+    for i, n in enumerate(hist):
+        if n and seen + n >= target:
+            lo = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+            hi = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1] * 2
+            return lo + (hi - lo) * (target - seen) / n
+        seen += n
+    return float(LATENCY_BUCKETS[-1])
+
+
+class UsageAnalytics:
+    """生成明细与时间序列汇总 (SQLite, 多进程共享)"""
+
+    def __init__(self, path: Optional[Path] = None):
+        Config.ensure_data_dir()
+        self.path = Path(path) if path else Config._data_dir / "analytics.db"
+        self._last_prune = 0.0
+        self._init_db()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                " ts REAL NOT NULL, model TEXT NOT NULL, resolution TEXT NOT NULL,"
+                " aspect_ratio TEXT NOT NULL, template TEXT NOT NULL, latency REAL NOT NULL,"
+                " retries INTEGER NOT NULL, bytes INTEGER NOT NULL, success INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_ts ON generations (ts)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rollups ("
+                " period TEXT NOT NULL, bucket INTEGER NOT NULL, model TEXT NOT NULL, resolution TEXT NOT NULL,"
+                " count INTEGER NOT NULL, errors INTEGER NOT NULL, retries INTEGER NOT NULL,"
+                " bytes INTEGER NOT NULL, hist TEXT NOT NULL,"
+                " PRIMARY KEY (period, bucket, model, resolution)) WITHOUT ROWID"
+            )
+
+    # ==================== 写入 ====================
+    def record(self, rec: GenerationRecord):
+        """写入一条明细并累加到小时/天汇总"""
+        hist_slot = bisect.bisect_left(LATENCY_BUCKETS, rec.latency) if rec.success else None
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = asdict(rec)
+                conn.execute(
+                    "INSERT INTO generations (ts, model, resolution, aspect_ratio, template, latency,"
+                    " retries, bytes, success) VALUES (:ts, :model, :resolution, :aspect_ratio, :template,"
+                    " :latency, :retries, :bytes, :success)",
+                    row,
+                )
+                for period in (HOUR, DAY):
+                    key = (period, _bucket_start(rec.ts, period), rec.model, rec.resolution)
+                    existing = conn.execute(
+                        "SELECT hist FROM rollups WHERE period = ? AND bucket = ? AND model = ? AND resolution = ?",
+                        key,
+                    ).fetchone()
+                    hist = json.loads(existing[0]) if existing else [0] * (len(LATENCY_BUCKETS) + 1)
+                    if hist_slot is not None:
+                        hist[hist_slot] += 1
+                    conn.execute(
+                        "INSERT INTO rollups (period, bucket, model, resolution, count, errors, retries, bytes, hist)"
+                        " VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)"
+                        " ON CONFLICT(period, bucket, model, resolution) DO UPDATE SET"
+                        " count = count + 1, errors = errors + excluded.errors,"
+                        " retries = retries + excluded.retries, bytes = bytes + excluded.bytes,"
+                        " hist = excluded.hist",
+                        (*key, 0 if rec.success else 1, rec.retries, rec.bytes, json.dumps(hist)),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self.prune()
+
+    def prune(self, force: bool = False):
+        """按保留期清理明细和汇总"""
+        now = time.time()
+        if not force and now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        with self._connect() as conn:
+            conn.execute("DELETE FROM generations WHERE ts < ?", (now - Config.ANALYTICS_RAW_DAYS * 86400,))
+            conn.execute("DELETE FROM rollups WHERE period = ? AND bucket < ?",
+                         (HOUR, now - Config.ANALYTICS_HOURLY_DAYS * 86400))
+            conn.execute("DELETE FROM rollups WHERE period = ? AND bucket < ?",
+                         (DAY, now - Config.ANALYTICS_DAILY_DAYS * 86400))
+
+    # ==================== 查询 ====================
+    def _rollups(self, period: str, since: float, model: Optional[str] = None) -> List[sqlite3.Row]:
+        sql = ("SELECT bucket, model, resolution, count, errors, retries, bytes, hist FROM rollups"
+               " WHERE period = ? AND bucket >= ?")
+        args: list = [period, _bucket_start(since, period)]
+        if model:
+            sql += " AND model = ?"
+            args.append(model)
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            return conn.execute(sql + " ORDER BY bucket", args).fetchall()
+
+    @staticmethod
+    def _summarize(rows) -> Dict:
+        count = sum(r["count"] for r in rows)
+        errors = sum(r["errors"] for r in rows)
+        hist = [0] * (len(LATENCY_BUCKETS) + 1)
+        for r in rows:
+            hist = _merge(hist, json.loads(r["hist"]))
+        return {
+            "count": count,
+            "success": count - errors,
+            "errors": errors,
+            "error_rate": errors / count if count else 0.0,
+            "retries": sum(r["retries"] for r in rows),
+            "bytes": sum(r["bytes"] for r in rows),
+            "p50": hist_percentile(hist, 0.5),
+            "p95": hist_percentile(hist, 0.95),
+        }
+
+    def series(self, period: str = HOUR, since: Optional[float] = None, model: Optional[str] = None) -> List[Dict]:
+        """
+        按时间桶汇总 (合并所有模型/分辨率, 或只看一个模型)
+
+        Returns:
+            [{"bucket": datetime, "count", "success", "errors", "error_rate", "retries", "bytes", "p50", "p95"}]
+        """
+        if since is None:
+            since = time.time() - (2 * 86400 if period == HOUR else 30 * 86400)
+        grouped: Dict[int, list] = {}
+        for r in self._rollups(period, since, model):
+            grouped.setdefault(r["bucket"], []).append(r)
+        return [{"bucket": datetime.fromtimestamp(b), **self._summarize(rows)} for b, rows in grouped.items()]
+
+    def by_model(self, since: Optional[float] = None) -> List[Dict]:
+        """按模型 + 分辨率汇总 (默认最近 7 天)"""
+        since = since if since is not None else time.time() - 7 * 86400
+        grouped: Dict[tuple, list] = {}
+        for r in self._rollups(DAY, since):
+            grouped.setdefault((r["model"], r["resolution"]), []).append(r)
+        return [{"model": m, "resolution": res, **self._summarize(rows)}
+                for (m, res), rows in sorted(grouped.items())]
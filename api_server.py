@@ -0,0 +1,261 @@
+"""
+TEMU 智能出图系统 V8.0
+HTTP 任务接口 (供 ERP 等系统调用)
+核心作者: 企鹅
+
+与网页端相同的流程 (规则清洗 → 分析 → 提示词 → 生成), 提交后在后台执行,
+调用方轮询状态并下载结果, 不经过 Streamlit 页面。
+
+启动:
+    python api_server.py [--port 8502]
+
+认证 (与网页端登录相同):
+    Authorization: Bearer <ACCESS_PASSWORD 或 ADMIN_PASSWORD>
+    X-Api-Key: <个人 API Key>      可选, 提供则不计入每日额度
+    X-User-Id: <调用方标识>         可选, 团队 Key 按该标识计算每日额度
+
+接口:
+    POST /api/jobs                     提交任务, 返回 202 + job_id
+    GET  /api/jobs/<job_id>            任务状态与每张图的进度
+    GET  /api/jobs/<job_id>/result     下载 ZIP (任务完成后)
+    GET  /api/jobs/<job_id>/files/<文件名>  下载单张图片
+    GET  /healthz                      健康检查
+
+提交请求体 (JSON), 字段与命令行清单相同:
+    {"image_base64": "...", "product_name": "不锈钢保温杯", "product_type": "厨具",
+     "material": "304不锈钢", "templates": {"C1": 2, "C2": 1},
+     "aspect_ratio": "1:1", "resolution": "2K", "model": "...", "style": "产品摄影"}
+"""
+import argparse
+import base64
+import binascii
+import hmac
+import io
+import json
+import mimetypes
+import os
+import re
+import shutil
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from PIL import Image
+
+import metrics
+from analysis_cache import AnalysisCache
+from analytics import UsageAnalytics
+from config import Config
+from hedging import Hedger
+from job_queue import Job, JobManager
+from model_router import ModelRouter
+from pipeline import build_params, clean_inputs
+from rate_limiter import RateLimiter
+from result_store import ResultStore
+from usage_tracker import QuotaExceeded, UsageTracker
+
+JOB_PATH = re.compile(r"^/api/jobs/([0-9a-f]{16})(?:/(result|files/(.+)))?$")
+
+
+class ApiError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def build_job_manager() -> JobManager:
+    Config.ensure_data_dir()
+    return JobManager(
+        UsageTracker(),
+        ResultStore(),
+        AnalysisCache(),
+        RateLimiter() if Config.RATE_LIMIT_ENABLED else None,
+        Hedger() if Config.HEDGE_ENABLED else None,
+        ModelRouter() if Config.FALLBACK_ENABLED else None,
+        analytics=UsageAnalytics(),
+        jobs_dir=Config._data_dir / "api_jobs",
+    )
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "TEMU-API/8.0"
+    job_manager: JobManager  # 由 make_server 注入
+
+    # ==================== 通用 ====================
+    def _send(self, status: HTTPStatus, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, path: Path, content_type: str, headers: Optional[Dict[str, str]] = None):
+        """按块发送磁盘文件, 不整体读入内存"""
+        with path.open("rb") as f:
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, 256 * 1024)
+
+    def _json(self, status: HTTPStatus, payload: Dict[str, Any]):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode(), "application/json; charset=utf-8")
+
+    def _auth(self) -> Tuple[str, Optional[str], bool]:
+        """
+        Returns:
+            (用户 ID, 个人 API Key 或 None, 是否管理员)
+        """
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        is_admin = bool(token) and hmac.compare_digest(token.encode(), Config.ADMIN_PASSWORD.encode())
+        if not is_admin and not (token and hmac.compare_digest(token.encode(), Config.ACCESS_PASSWORD.encode())):
+            raise ApiError(HTTPStatus.UNAUTHORIZED, "访问密码错误")
+        own_key = self.headers.get("X-Api-Key", "").strip() or None
+        user = re.sub(r"[^\w.-]", "_", self.headers.get("X-User-Id", "").strip())[:64] or "default"
+        return f"api:{user}", own_key, is_admin
+
+    def _dispatch(self, method: str):
+        try:
+            if method == "GET" and self.path == "/healthz":
+                return self._json(HTTPStatus.OK, {"status": "ok"})
+            user_id, own_key, is_admin = self._auth()
+            if method == "POST" and self.path == "/api/jobs":
+                return self._submit(user_id, own_key)
+            m = JOB_PATH.match(self.path.split("?", 1)[0])
+            if method != "GET" or not m:
+                raise ApiError(HTTPStatus.NOT_FOUND, "接口不存在")
+            job = self.job_manager.get(m.group(1))
+            if job is None or (job.user_id != user_id and not is_admin):
+                raise ApiError(HTTPStatus.NOT_FOUND, "任务不存在")
+            if m.group(2) is None:
+                return self._json(HTTPStatus.OK, self._status(job))
+            if m.group(2) == "result":
+                return self._result(job)
+            return self._file(job, unquote(m.group(3)))
+        except ApiError as e:
+            self._json(e.status, {"error": str(e)})
+        except Exception as e:
+            self._json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)[:200]})
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def log_message(self, fmt, *args):
+        pass  # 不记录每个请求 (轮询很频繁)
+
+    # ==================== 接口 ====================
+    def _submit(self, user_id: str, own_key: Optional[str]):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "请求体为空")
+        if length > Config.API_MAX_BODY_MB * 1024 * 1024:
+            raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"请求体超过 {Config.API_MAX_BODY_MB}MB")
+        try:
+            body = json.loads(self.rfile.read(length))
+            if not isinstance(body, dict):
+                raise TypeError("请求体不是 JSON 对象")
+            image = base64.b64decode(body.pop("image_base64"), validate=True)
+        except (ValueError, KeyError, TypeError, binascii.Error):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "请求体须为 JSON 对象, 且包含 base64 编码的 image_base64")
+        try:
+            # 提交前校验图片, 避免无效图片占用额度后才在后台失败
+            with Image.open(io.BytesIO(image)) as probe:
+                probe.verify()
+        except Exception:
+            raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, "image_base64 不是可识别的图片")
+
+        api_key = own_key or Config.get_api_key()
+        if not api_key:
+            raise ApiError(HTTPStatus.SERVICE_UNAVAILABLE, "未配置团队 API Key, 请在 X-Api-Key 中提供个人 Key")
+        try:
+            params = build_params(body)
+            clean_inputs(params)
+        except ValueError as e:
+            raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, str(e))
+        params["upload_keys"] = [self.job_manager.store.put_upload(image)]
+
+        try:
+            job_id = self.job_manager.submit(user_id, api_key, params, own_key=bool(own_key))
+        except QuotaExceeded as e:
+            raise ApiError(HTTPStatus.TOO_MANY_REQUESTS, str(e))
+        self._send(HTTPStatus.ACCEPTED,
+                   json.dumps({"job_id": job_id, "status_url": f"/api/jobs/{job_id}"}).encode(),
+                   "application/json; charset=utf-8", {"Location": f"/api/jobs/{job_id}"})
+
+    @staticmethod
+    def _status(job: Job) -> Dict[str, Any]:
+        base = f"/api/jobs/{job.job_id}"
+        return {
+            "job_id": job.job_id,
+            "status": job.status,
+            "message": job.message,
+            "finished": job.finished,
+            "total": job.total,
+            "done": job.done_count,
+            "success": job.success_count,
+            "items": [
+                {**{k: it.get(k, "") for k in ("label", "filename", "status", "error", "model")},
+                 "size": it.get("size", 0),
+                 "url": f"{base}/files/{quote(it['filename'])}" if it["status"] == "done" else None}
+                for it in job.items
+            ],
+            "result_url": f"{base}/result" if job.finished and job.success_count else None,
+        }
+
+    def _result(self, job: Job):
+        if not job.finished:
+            raise ApiError(HTTPStatus.CONFLICT, "任务尚未完成")
+        if not job.success_count:
+            raise ApiError(HTTPStatus.NOT_FOUND, "没有可下载的结果")
+        path = self.job_manager.export_path(job.job_id)
+        if path is None:
+            raise ApiError(HTTPStatus.GONE, "结果已过期")
+        self._send_file(path, "application/zip",
+                        {"Content-Disposition": f'attachment; filename="TEMU_{job.job_id}.zip"'})
+
+    def _file(self, job: Job, filename: str):
+        item = next((it for it in job.items if it["filename"] == filename and it["status"] == "done"), None)
+        if item is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, "文件不存在")
+        handle = job.handle(item)
+        if not self.job_manager.store.exists(handle):
+            raise ApiError(HTTPStatus.GONE, "结果已过期")
+        self._send_file(self.job_manager.store.path(handle),
+                        mimetypes.guess_type(filename)[0] or "application/octet-stream")
+
+
+def make_server(port: int, job_manager: Optional[JobManager] = None, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    handler = type("Handler", (ApiHandler,), {"job_manager": job_manager or build_job_manager()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=Config.API_PORT)
+    args = parser.parse_args()
+    server = make_server(args.port, host=args.host)
+    print(f"TEMU 任务接口已启动: http://{args.host}:{args.port}")
+    if Config.METRICS_ENABLED and metrics.start_server(host=args.host):
+        print(f"指标: http://{args.host}:{Config.METRICS_PORT}/metrics")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,17 +10,23 @@ TEMU 智能出图系统 V8.0
 - 重新生成按钮
 - 分辨率选择
 """
-import io
-import zipfile
 from datetime import date
 from PIL import Image
 import streamlit as st
 
+import metrics
 from config import Config
-from prompts import PROMPT_TEMPLATES, TEMPLATE_INFO, get_template_names, get_template_prompt
-from rules import apply_replacements, check_absolute_bans, build_negative_prompt
-from gemini_client import GeminiClient
-from usage_tracker import UsageTracker
+from prompts import PROMPT_TEMPLATES, TEMPLATE_INFO, get_template_names
+from analysis_cache import AnalysisCache
+from analytics import DAY, HOUR, UsageAnalytics
+from hedging import Hedger
+from job_queue import JobManager
+from model_router import ModelRouter
+from pipeline import clean_inputs
+from rate_limiter import RateLimiter
+from result_store import ResultStore
+from tracing import profile_text, summarize
+from usage_tracker import QuotaExceeded, UsageTracker
 
 
 # ==================== 页面配置 ====================
@@ -112,6 +118,67 @@ def get_tracker():
 tracker = get_tracker()
 
 
+@st.cache_resource
+def get_analysis_cache():
+    return AnalysisCache()
+
+
+@st.cache_resource
+def get_result_store():
+    return ResultStore()
+
+result_store = get_result_store()
+
+
+@st.cache_resource
+def get_rate_limiter():
+    return RateLimiter() if Config.RATE_LIMIT_ENABLED else None
+
+
+@st.cache_resource
+def get_hedger():
+    return Hedger() if Config.HEDGE_ENABLED else None
+
+
+@st.cache_resource
+def get_model_router():
+    return ModelRouter() if Config.FALLBACK_ENABLED else None
+
+
+@st.cache_resource
+def get_analytics():
+    return UsageAnalytics()
+
+analytics = get_analytics()
+
+
+@st.cache_resource
+def start_metrics_server():
+    return metrics.start_server() if Config.METRICS_ENABLED else None
+
+start_metrics_server()
+
+
+@st.cache_resource
+def get_job_manager():
+    return JobManager(tracker, result_store, get_analysis_cache(), get_rate_limiter(), get_hedger(),
+                      get_model_router(), analytics=analytics)
+
+job_manager = get_job_manager()
+
+
+def show_results(handles):
+    """从磁盘按需展示结果 (会话中只保存句柄)"""
+    handles = [h for h in handles if result_store.exists(h)]
+    if not handles:
+        st.info("结果已过期，请重新生成")
+        return
+    cols = st.columns(min(len(handles), 4))
+    for i, h in enumerate(handles):
+        with cols[i % 4]:
+            st.image(str(result_store.path(h)), caption=h.filename, use_container_width=True)
+
+
 # ==================== 认证 ====================
 def check_auth() -> bool:
     return st.session_state.get("authenticated", False)
@@ -197,6 +264,78 @@ def admin_panel():
         st.rerun()
 
 
+def analytics_panel():
+    """管理员: 吞吐 / 延迟分位数 / 错误率趋势"""
+    import pandas as pd
+    
+    with st.expander("📈 运行数据", expanded=True):
+        span = st.radio("时间范围", ["最近 48 小时", "最近 30 天"], horizontal=True, label_visibility="collapsed")
+        period = HOUR if span.startswith("最近 48") else DAY
+        series = analytics.series(period)
+        if not series:
+            st.info("暂无生成记录")
+            return
+        df = pd.DataFrame(series).set_index("bucket")
+        unit = "小时" if period == HOUR else "天"
+        
+        c1, c2, c3 = st.columns(3)
+        c1.metric("生成总数", int(df["count"].sum()))
+        c2.metric("成功率", f"{1 - df['errors'].sum() / max(1, df['count'].sum()):.1%}")
+        c3.metric("重试次数", int(df["retries"].sum()))
+        
+        st.caption(f"吞吐 (张/{unit})")
+        st.bar_chart(df[["success", "errors"]].rename(columns={"success": "成功", "errors": "失败"}))
+        st.caption("延迟 (秒)")
+        st.line_chart(df[["p50", "p95"]])
+        st.caption("错误率")
+        st.line_chart(df[["error_rate"]].rename(columns={"error_rate": "错误率"}))
+        
+        st.caption("按模型 / 分辨率 (最近 7 天)")
+        st.dataframe(pd.DataFrame(analytics.by_model()), hide_index=True, use_container_width=True)
+
+
+def trace_panel():
+    """管理员: 单个任务各阶段耗时 (追踪) 与按需 cProfile"""
+    import json
+    import altair as alt
+    import pandas as pd
+    
+    with st.expander("🔍 任务追踪"):
+        job_id = st.text_input("任务 ID", value=st.session_state.get("active_job", "")).strip()
+        if st.button("🧪 下一个任务采集 cProfile"):
+            job_manager.profile_next()
+            st.success("已开启, 下一个开始执行的任务将采集 cProfile")
+        trace = job_manager.trace(job_id) if job_id else None
+        if trace is None:
+            st.info("暂无追踪记录 (任务完成后生成)")
+            return
+        
+        st.metric("任务总耗时", f"{trace['duration']:.1f}s")
+        st.caption("各阶段汇总 (并发阶段的合计耗时可能超过总耗时)")
+        st.dataframe(pd.DataFrame(summarize(trace)), hide_index=True, use_container_width=True)
+        
+        spans = pd.DataFrame([{"阶段": s["name"], "线程": s["thread"], "开始": s["start"],
+                               "结束": s["start"] + s["duration"], "耗时": s["duration"]}
+                              for s in trace["spans"] if s["name"] != "job"])
+        if not spans.empty:
+            st.caption("时间线 (秒)")
+            st.altair_chart(alt.Chart(spans).mark_bar().encode(
+                x="开始", x2="结束", y="线程", color="阶段", tooltip=["阶段", "耗时"],
+            ), use_container_width=True)
+        st.download_button("⬇️ 导出追踪 (JSON)", json.dumps(trace, ensure_ascii=False, indent=1),
+                          f"trace_{job_id}.json", "application/json")
+        
+        prof = job_manager.profile_path(job_id)
+        if prof is not None:
+            if trace.get("profile_scope") == "process":
+                st.caption("cProfile (按累计耗时前 30 项) · Python 3.12+ 为全进程采集, "
+                           "包含同一时段其他并发任务, 仅在单任务运行时准确")
+            else:
+                st.caption("cProfile (按累计耗时前 30 项, 仅本任务的线程)")
+            st.code(profile_text(prof), language="text")
+            st.download_button("⬇️ 下载 .prof", prof.read_bytes(), f"{job_id}.prof")
+
+
 # ==================== 主应用 ====================
 def main_app():
     load_css()
@@ -237,11 +376,14 @@ def main_app():
     # ===== 主界面 =====
     st.markdown("<h1>🍌 TEMU 智能出图系统</h1>", unsafe_allow_html=True)
     st.markdown(f"<p style='text-align:center;color:#666;'>💡 {Config.get_random_tip('welcome')}</p>", unsafe_allow_html=True)
+    if st.session_state.get("is_admin") and st.session_state.get("show_stats"):
+        analytics_panel()
+        trace_panel()
     
     # 初始化
-    for key in ["selected", "counts", "custom_prompts", "generated_results", "last_params"]:
+    for key in ["selected", "counts", "custom_prompts", "last_params"]:
         if key not in st.session_state:
-            st.session_state[key] = [] if key in ["selected", "generated_results"] else {}
+            st.session_state[key] = [] if key == "selected" else {}
     
     # ===== 第1步: 上传 =====
     st.markdown("### 📤 第1步: 上传商品图片")
@@ -310,6 +452,9 @@ def main_app():
         model_id = Config.AVAILABLE_MODELS[model_name]
         caps = Config.MODEL_CAPABILITIES.get(model_id, {})
         st.caption(Config.MODEL_DESCRIPTIONS.get(model_id, ""))
+        router = get_model_router()
+        if router is not None and router.is_degraded(model_id):
+            st.caption("⚡ 当前繁忙, 将自动降级到快速模型 (1K)")
     
     with c2:
         st.markdown("**📐 宽高比**")
@@ -359,13 +504,17 @@ def main_app():
     c2.metric("📐 比例", aspect_ratio)
     c3.metric("📺 分辨率", resolution)
     
+    # 同一会话同时只跑一个任务, 避免重复提交
+    active_job = job_manager.get(st.session_state.get("active_job", ""))
+    job_running = active_job is not None and not active_job.finished
+    
     col1, col2 = st.columns([3, 1])
     with col1:
         generate_btn = st.button("🚀 开始生成", type="primary", use_container_width=True,
-                                disabled=(not can_use and not using_own_key) or not st.session_state.selected)
+                                disabled=(not can_use and not using_own_key) or not st.session_state.selected or job_running)
     with col2:
         regenerate_btn = st.button("🔄 重新生成", use_container_width=True, 
-                                  disabled=not st.session_state.get("last_params"))
+                                  disabled=not st.session_state.get("last_params") or job_running)
     
     # ===== 生成逻辑 =====
     should_generate = generate_btn or regenerate_btn
@@ -389,8 +538,9 @@ def main_app():
                 st.stop()
             
             # 保存参数
+            # 原图写盘, 会话中只保存内容哈希
             st.session_state.last_params = {
-                "files": files,
+                "upload_keys": [result_store.put_upload(f.getvalue()) for f in files],
                 "product_name": product_name,
                 "product_type": product_type,
                 "material": material,
@@ -403,162 +553,108 @@ def main_app():
                 "extra": extra,
                 "selected": list(st.session_state.selected),
                 "counts": dict(st.session_state.counts),
+                "custom_prompts": dict(st.session_state.custom_prompts),
             }
         
         # 使用保存的参数 (重新生成时)
         params = st.session_state.last_params
         
-        # 清洗
-        clean_name, _ = apply_replacements(params["product_name"])
-        clean_material, _ = apply_replacements(params["material"])
-        
-        if check_absolute_bans(f"{clean_name} {clean_material}"):
-            st.error("❌ 检测到禁用内容")
+        try:
+            clean_inputs(params)
+        except ValueError as e:
+            st.error(f"❌ {e}")
+            st.stop()
+        if not result_store.upload_path(params["upload_keys"][0]).exists():
+            st.error("❌ 原图已过期，请重新上传后生成")
             st.stop()
         
-        final_excludes = list(params["excludes"])
-        if params["extra"].strip():
-            final_excludes.extend([x.strip() for x in params["extra"].split(",") if x.strip()])
-        negative = build_negative_prompt(final_excludes)
-        
-        st.divider()
-        
-        # AI 分析
-        st.markdown("### 🤖 AI 分析中...")
-        tip = st.empty()
-        tip.info(Config.get_random_tip("loading"))
-        
-        client = GeminiClient(api_key, params["model_id"])
-        first_img = Image.open(params["files"][0]).convert("RGB")
-        
-        with st.spinner("分析产品特征..."):
-            try:
-                analysis = client.analyze_image(first_img)
-                tip.success("✅ 分析完成")
-                
-                with st.expander("📊 AI 分析结果", expanded=True):
-                    c1, c2 = st.columns(2)
-                    c1.markdown(f"**产品**: {analysis.product_description}")
-                    c1.markdown(f"**材质**: {analysis.material_guess or '未识别'}")
-                    c2.markdown("**卖点**:")
-                    for f in analysis.key_features[:3]:
-                        c2.write(f"• {f}")
-                
-                final_material = clean_material or analysis.material_guess
-                selling_points = "\n".join([f"- {p}" for p in analysis.key_features])
-                scene = analysis.suggested_scene or "home setting"
-            except Exception:
-                tip.warning("⚠️ 分析失败，使用默认参数")
-                final_material = clean_material
-                selling_points = "- Premium quality"
-                scene = "home setting"
-        
-        vars = {
-            "product_name": clean_name,
-            "product_type": params["product_type"].split()[-1],
-            "material": final_material or "high-quality material",
-            "selling_points": selling_points,
-            "scene": scene,
-            "detail_focus": "texture and craftsmanship",
-            "dimensions": "standard size",
-            "title": clean_name.upper()[:30],
-            "style_prompt": params["style_prompt"],
-        }
-        
-        st.divider()
-        
-        # 生成
-        st.markdown("### 🎨 生成图片中...")
-        
-        total_gen = sum(params["counts"].get(t, 1) for t in params["selected"])
-        progress = st.progress(0)
-        status = st.empty()
-        
-        results = []
-        done = 0
-        gen_count = 0
-        
-        for tid in params["selected"]:
-            count = params["counts"].get(tid, 1)
-            prompt_tpl = st.session_state.custom_prompts.get(tid) or get_template_prompt(tid)
-            _, name, _ = TEMPLATE_INFO.get(tid, ("", tid, ""))
-            
-            for k in range(count):
-                status.info(f"⏳ {name} ({k+1}/{count}) - {Config.get_random_tip('loading')}")
-                
-                try:
-                    prompt = prompt_tpl.format(**vars)
-                    result = client.generate_image(
-                        reference=first_img,
-                        prompt=prompt,
-                        negative_prompt=negative,
-                        aspect_ratio=params["aspect_ratio"],
-                        resolution=params["resolution"],
-                        style_strength=params["strength"],
-                    )
-                    
-                    img = result.image.convert("RGB")
-                    buf = io.BytesIO()
-                    img.save(buf, format="PNG")
-                    fname = f"{tid}_{name}_{k+1}.png"
-                    results.append((fname, buf.getvalue(), img))
-                    gen_count += 1
-                    
-                except Exception as e:
-                    st.error(f"❌ {name}-{k+1}: {str(e)[:60]}")
-                
-                done += 1
-                progress.progress(done / total_gen)
-        
-        if gen_count > 0 and not using_own_key:
-            tracker.add_usage(user_id, gen_count)
-        
-        status.success(Config.get_random_tip("success"))
-        st.session_state.generated_results = results
-        
-        # 显示结果
-        if results:
-            st.divider()
-            st.markdown("### 🖼️ 生成结果")
-            
-            cols = st.columns(min(len(results), 4))
-            for i, (fname, _, img) in enumerate(results):
-                with cols[i % 4]:
-                    st.image(img, caption=fname, use_container_width=True)
-            
-            st.divider()
-            
-            # 下载和重新生成
-            st.markdown("### 📥 下载 & 操作")
-            
-            zip_buf = io.BytesIO()
-            with zipfile.ZipFile(zip_buf, "w", zipfile.ZIP_DEFLATED) as z:
-                for fname, data, _ in results:
-                    z.writestr(fname, data)
-                z.writestr("README.txt", f"TEMU智能出图 V8.0\n作者:{Config.APP_AUTHOR}\n日期:{date.today()}\n商品:{clean_name}\n数量:{len(results)}张\n模型:{params['model_id']}\n分辨率:{params['resolution']}".encode())
-            
-            c1, c2, c3 = st.columns([2, 1, 1])
-            with c1:
-                st.download_button("⬇️ 下载全部 (ZIP)", zip_buf.getvalue(),
-                                  f"temu_{clean_name}_{date.today()}.zip", "application/zip",
-                                  use_container_width=True, type="primary")
-            with c2:
-                st.success(f"✅ {len(results)}张")
-            with c3:
-                new_rem = remaining - gen_count if not using_own_key else "∞"
-                st.info(f"剩余 {new_rem}")
-            
-            st.balloons()
+        # 提交到后台任务队列, 页面刷新/重跑不会中断
+        try:
+            st.session_state.active_job = job_manager.submit(user_id, api_key, params, own_key=using_own_key)
+        except QuotaExceeded as e:
+            st.error(f"❌ 额度不足（剩余 {e.remaining} 张）")
+            st.stop()
+        st.rerun()
     
-    # 显示之前的结果
-    elif st.session_state.get("generated_results"):
-        st.divider()
-        st.markdown("### 🖼️ 上次生成结果")
-        results = st.session_state.generated_results
-        cols = st.columns(min(len(results), 4))
-        for i, (fname, _, img) in enumerate(results):
-            with cols[i % 4]:
-                st.image(img, caption=fname, use_container_width=True)
+    if st.session_state.get("active_job"):
+        if job_running:
+            job_panel_live(st.session_state.active_job)
+        else:
+            job_panel(st.session_state.active_job)
+
+
+def job_panel(job_id: str):
+    """渲染任务进度与已完成的结果 (任务运行中时按间隔轮询)"""
+    job = job_manager.get(job_id)
+    if job is None:
+        st.info("任务记录已过期")
+        return
+    
+    st.divider()
+    if job.analysis:
+        with st.expander("📊 AI 分析结果", expanded=not job.finished):
+            c1, c2 = st.columns(2)
+            c1.markdown(f"**产品**: {job.analysis['product_description']}")
+            c1.markdown(f"**材质**: {job.analysis['material_guess'] or '未识别'}")
+            c2.markdown("**卖点**:")
+            for f in job.analysis["key_features"][:3]:
+                c2.write(f"• {f}")
+    
+    if not job.finished:
+        if job.status in ("queued", "analyzing"):
+            st.markdown("### 🤖 AI 分析中...")
+        else:
+            st.markdown("### 🎨 生成图片中...")
+        st.progress(job.done_count / max(job.total, 1))
+        st.info(f"⏳ {job.done_count}/{job.total} - {Config.get_random_tip('loading')}")
+        if job.message:
+            st.warning(f"⚠️ {job.message}")
+        if job.handles():
+            show_results(job.handles())
+        return
+    
+    # 任务完成后切回整页渲染 (刷新额度等), 之后不再轮询
+    if st.session_state.get("job_rendered") != job_id:
+        st.session_state.job_rendered = job_id
+        st.rerun()
+    
+    for err in job.errors():
+        st.error(f"❌ {err[:80]}")
+    if job.status == "failed" and job.message:
+        st.error(f"❌ {job.message}")
+    
+    handles = job.handles()
+    if not handles:
+        return
+    
+    st.markdown("### 🖼️ 生成结果")
+    fallback = job.fallback_items()
+    if fallback:
+        st.warning(f"⚡ Pro 模型繁忙，{len(fallback)} 张由 {fallback[0]['model']} (1K) 生成: "
+                   + ", ".join(it["filename"] for it in fallback))
+    show_results(handles)
+    
+    st.divider()
+    
+    # 下载和重新生成
+    st.markdown("### 📥 下载 & 操作")
+    c1, c2 = st.columns([2, 1])
+    with c1:
+        # ZIP 已在磁盘上, 点击时才打开文件
+        st.download_button("⬇️ 下载全部 (ZIP)", lambda: job_manager.export_path(job_id).open("rb"),
+                          f"temu_{job.params['product_name']}_{date.fromtimestamp(job.created_at)}.zip",
+                          "application/zip", use_container_width=True, type="primary")
+    with c2:
+        st.success(f"✅ {len(handles)}张")
+    
+    if st.session_state.get("job_celebrated") != job_id:
+        st.session_state.job_celebrated = job_id
+        st.success(Config.get_random_tip("success"))
+        st.balloons()
+
+
+# 任务运行中时局部轮询刷新, 不重跑整个页面
+job_panel_live = st.fragment(job_panel, run_every=Config.JOB_POLL_INTERVAL)
 
 
 # ==================== 入口 ====================
@@ -0,0 +1,298 @@
+"""
+TEMU 智能出图系统 V8.0
+离线批量生成 (Batch 模式)
+核心作者: 企鹅
+
+不急用的任务 (如夜间整批刷新商品目录) 不再逐个同步调用 generate_content,
+而是把大量生成请求打包成一个 JSONL 批量文件一次提交, 轮询完成后按 key
+把结果映射回 (商品, 模板, 序号)。批量任务不占用交互式请求的限流额度。
+
+提交/查询/取回通过可替换的传输层完成:
+- GeminiBatchTransport: Gemini Batch API (Files API 上传 JSONL + batches.create)
+- LocalBatchTransport:  进程内模拟服务, 用于测试和本地演练, 不消耗额度
+"""
+import abc
+import base64
+import io
+import json
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+from google import genai
+from google.genai import types
+from PIL import Image
+
+from config import Config
+from gemini_client import GeminiClient, ImageResult
+
+# 任务状态 (与 Gemini JobState 一致)
+PENDING = "JOB_STATE_PENDING"
+RUNNING = "JOB_STATE_RUNNING"
+SUCCEEDED = "JOB_STATE_SUCCEEDED"
+FAILED = "JOB_STATE_FAILED"
+CANCELLED = "JOB_STATE_CANCELLED"
+EXPIRED = "JOB_STATE_EXPIRED"
+PARTIALLY_SUCCEEDED = "JOB_STATE_PARTIALLY_SUCCEEDED"
+
+FINAL_STATES = (SUCCEEDED, FAILED, CANCELLED, EXPIRED, PARTIALLY_SUCCEEDED)
+
+
+class BatchError(RuntimeError):
+    """批量任务失败 / 超时, 或单条请求没有返回图片"""
+
+
+# ==================== 传输层 ====================
+class BatchTransport(abc.ABC):
+    """
+    批量任务传输层接口
+
+    请求行: {"key": str, "request": GenerateContentRequest (REST JSON)}
+    结果行: {"key": str, "response": GenerateContentResponse (REST JSON)} 或 {"key": str, "error": {...}}
+    """
+
+    persistent = True  # 任务名在进程重启后仍有效 (可写入 batch_jobs.json 续等)
+
+    @abc.abstractmethod
+    def submit(self, model: str, lines: List[Dict[str, Any]], display_name: str = "") -> str:
+        """提交批量任务, 返回任务名"""
+
+    @abc.abstractmethod
+    def state(self, job_name: str) -> str:
+        """任务当前状态 (JOB_STATE_*)"""
+
+    @abc.abstractmethod
+    def results(self, job_name: str) -> Iterator[Dict[str, Any]]:
+        """逐行返回结果"""
+
+    @abc.abstractmethod
+    def cancel(self, job_name: str):
+        """取消任务"""
+
+
+class GeminiBatchTransport(BatchTransport):
+    """Gemini Batch API"""
+
+    def __init__(self, api_key: str):
+        self.client = genai.Client(api_key=api_key)
+
+    def submit(self, model: str, lines: List[Dict[str, Any]], display_name: str = "") -> str:
+        payload = "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode()
+        uploaded = self.client.files.upload(
+            file=io.BytesIO(payload),
+            config=types.UploadFileConfig(display_name=display_name or "temu-batch", mime_type="jsonl"),
+        )
+        job = self.client.batches.create(model=model, src=uploaded.name,
+                                         config=types.CreateBatchJobConfig(display_name=display_name or None))
+        return job.name
+
+    def state(self, job_name: str) -> str:
+        job = self.client.batches.get(name=job_name)
+        return str(getattr(job.state, "value", job.state))
+
+    def results(self, job_name: str) -> Iterator[Dict[str, Any]]:
+        job = self.client.batches.get(name=job_name)
+        dest = job.dest
+        if dest is not None and dest.file_name:
+            content = self.client.files.download(file=dest.file_name)
+            for line in content.decode("utf-8").splitlines():
+                if line.strip():
+                    yield json.loads(line)
+        elif dest is not None and dest.inlined_responses:
+            # 内联提交时没有 key, 按提交顺序返回
+            for i, item in enumerate(dest.inlined_responses):
+                if item.error is not None:
+                    yield {"key": str(i), "error": item.error.model_dump(mode="json", exclude_none=True)}
+                else:
+                    yield {"key": str(i), "response": item.response.model_dump(mode="json", by_alias=True,
+                                                                               exclude_none=True)}
+
+    def cancel(self, job_name: str):
+        self.client.batches.cancel(name=job_name)
+
+
+def synthetic_response(model: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    """模拟服务的默认响应: 按请求的宽高比返回一张纯色 PNG"""
+    image_config = request.get("generationConfig", {}).get("imageConfig", {})
+    w, h = (int(x) for x in image_config.get("aspectRatio", "1:1").split(":"))
+    side = {"2K": 2048, "4K": 4096}.get(image_config.get("imageSize", ""), 1024) // 8  # 缩小, 只用于演练
+    buf = io.BytesIO()
+    Image.new("RGB", (side * w // max(w, h), side * h // max(w, h)), (200, 200, 200)).save(buf, format="PNG")
+    return {"candidates": [{"content": {"role": "model", "parts": [
+        {"inlineData": {"mimeType": "image/png", "data": base64.b64encode(buf.getvalue()).decode()}},
+    ]}}]}
+
+
+class LocalBatchTransport(BatchTransport):
+    """
+    进程内模拟批量服务
+
+    respond(model, request) 返回 REST 格式的响应 dict, 抛出异常则该行记为错误。
+    任务在后台线程中处理, 状态依次为 PENDING → RUNNING → SUCCEEDED。
+    任务只存在于当前进程, 中断后重新运行需重新提交。
+    """
+
+    persistent = False
+
+    def __init__(self, respond: Optional[Callable[[str, Dict[str, Any]], Dict[str, Any]]] = None,
+                 delay: float = 0.0):
+        self.respond = respond or synthetic_response
+        self.delay = delay  # 开始处理前的排队时间 (秒)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, model: str, lines: List[Dict[str, Any]], display_name: str = "") -> str:
+        name = f"batches/local-{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            self._jobs[name] = {"state": PENDING, "results": [], "cancelled": False}
+        threading.Thread(target=self._process, args=(name, model, lines), daemon=True).start()
+        return name
+
+    def _process(self, name: str, model: str, lines: List[Dict[str, Any]]):
+        time.sleep(self.delay)
+        job = self._jobs[name]
+        job["state"] = RUNNING
+        results = []
+        for line in lines:
+            if job["cancelled"]:
+                job["state"] = CANCELLED
+                return
+            try:
+                results.append({"key": line["key"], "response": self.respond(model, line["request"])})
+            except Exception as e:
+                results.append({"key": line["key"], "error": {"code": getattr(e, "code", 500), "message": str(e)}})
+        job["results"] = results
+        job["state"] = SUCCEEDED
+
+    def state(self, job_name: str) -> str:
+        job = self._jobs.get(job_name)
+        return job["state"] if job else FAILED
+
+    def results(self, job_name: str) -> Iterator[Dict[str, Any]]:
+        yield from self._jobs.get(job_name, {}).get("results", [])
+
+    def cancel(self, job_name: str):
+        if job_name in self._jobs:
+            self._jobs[job_name]["cancelled"] = True
+
+
+def make_transport(api_key: str, name: Optional[str] = None) -> BatchTransport:
+    name = (name or Config.BATCH_TRANSPORT).lower()
+    if name == "local":
+        return LocalBatchTransport()
+    return GeminiBatchTransport(api_key)
+
+
+# ==================== 客户端 ====================
+@dataclass
+class BatchRequest:
+    """一条待批量生成的请求 (key 用于把结果映射回来源)"""
+    key: str
+    reference: Any
+    prompt: str
+    negative_prompt: str = ""
+    aspect_ratio: str = "1:1"
+    resolution: str = "1K"
+    style_strength: float = 0.3
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+def _to_rest(request: Dict[str, Any]) -> Dict[str, Any]:
+    """_edit_request 生成的 SDK 参数 -> REST GenerateContentRequest"""
+    parts = []
+    for item in request["contents"]:
+        if isinstance(item, str):
+            parts.append({"text": item})
+        else:
+            blob = item.inline_data
+            parts.append({"inlineData": {"mimeType": blob.mime_type, "data": base64.b64encode(blob.data).decode()}})
+    config = request["config"]
+    image_config = config.image_config
+    generation_config: Dict[str, Any] = {"responseModalities": list(config.response_modalities or [])}
+    if image_config is not None:
+        generation_config["imageConfig"] = {k: v for k, v in (("aspectRatio", image_config.aspect_ratio),
+                                                             ("imageSize", image_config.image_size)) if v}
+    return {"contents": [{"role": "user", "parts": parts}], "generationConfig": generation_config}
+
+
+class BatchGeminiClient(GeminiClient):
+    """
+    批量生成客户端
+
+    生成请求走 Batch 传输层; analyze_image 等其他调用仍为同步请求。
+    """
+
+    def __init__(self, api_key: str, model: str = "gemini-3-pro-image-preview",
+                 transport: Optional[BatchTransport] = None, **kwargs):
+        super().__init__(api_key, model, **kwargs)
+        self.transport = transport or make_transport(api_key)
+
+    def build_lines(self, requests: List[BatchRequest]) -> List[Dict[str, Any]]:
+        return [
+            {"key": r.key, "request": _to_rest(self._edit_request(
+                reference=r.reference, prompt=r.prompt, negative_prompt=r.negative_prompt,
+                aspect_ratio=r.aspect_ratio, resolution=r.resolution, style_strength=r.style_strength,
+            ))}
+            for r in requests
+        ]
+
+    def submit(self, requests: List[BatchRequest], display_name: str = "") -> List[str]:
+        """
+        分块提交 (每个批量任务最多 Config.BATCH_MAX_REQUESTS 条)
+
+        Returns:
+            批量任务名列表 (可持久化, 进程重启后继续 wait/collect)
+        """
+        lines = self.build_lines(requests)
+        size = max(1, Config.BATCH_MAX_REQUESTS)
+        return [self.transport.submit(self.model, lines[i:i + size], display_name)
+                for i in range(0, len(lines), size)]
+
+    def wait(self, job_name: str, timeout: Optional[float] = None, poll_interval: Optional[float] = None,
+             on_poll: Optional[Callable[[str], None]] = None) -> str:
+        """轮询直到任务结束, 返回最终状态"""
+        interval = poll_interval if poll_interval is not None else Config.BATCH_POLL_INTERVAL
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            state = self.transport.state(job_name)
+            if on_poll is not None:
+                on_poll(state)
+            if state in FINAL_STATES:
+                return state
+            if deadline is not None and time.monotonic() >= deadline:
+                raise BatchError(f"批量任务等待超时: {job_name}")
+            time.sleep(interval)
+
+    def collect(self, job_name: str) -> Iterator[tuple]:
+        """
+        逐条取回结果
+
+        Yields:
+            (key, ImageResult 或 Exception)
+        """
+        for line in self.transport.results(job_name):
+            key = str(line.get("key", ""))
+            if "error" in line:
+                err = line["error"]
+                yield key, BatchError(err.get("message", str(err)) if isinstance(err, dict) else str(err))
+                continue
+            try:
+                resp = types.GenerateContentResponse.model_validate_json(json.dumps(line["response"]))
+                yield key, self._to_result(resp, "批量结果中没有图片")
+            except Exception as e:
+                yield key, e
+
+    def run(self, requests: List[BatchRequest], display_name: str = "",
+            timeout: Optional[float] = None) -> Dict[str, Union[ImageResult, Exception]]:
+        """提交 → 等待 → 取回 (结果按 key 返回, 缺失的 key 记为错误)"""
+        results: Dict[str, Union[ImageResult, Exception]] = {}
+        size = max(1, Config.BATCH_MAX_REQUESTS)
+        for i, job_name in enumerate(self.submit(requests, display_name)):
+            state = self.wait(job_name, timeout)
+            if state in (SUCCEEDED, PARTIALLY_SUCCEEDED):
+                results.update(self.collect(job_name))
+            for r in requests[i * size:(i + 1) * size]:
+                results.setdefault(r.key, BatchError(f"批量任务未返回该请求的结果 ({state})"))
+        return results
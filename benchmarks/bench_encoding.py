@@ -0,0 +1,64 @@
+"""
+TEMU 智能出图系统 V8.0
+基准: 参考图请求编码 - 编码耗时 vs 上传体积
+核心作者: 企鹅
+
+用法:
+    python benchmarks/bench_encoding.py [图片路径 ...] [--repeat 3]
+
+不传图片时使用合成的商品照片。所有图片先缩放到 1024 再编码, 与实际请求一致。
+"""
+import argparse
+import io
+
+from common import cpu_time, synthetic_product_photo
+
+from PIL import Image
+
+from reference import MAX_REFERENCE_SIDE, _downscale, encode_reference
+
+CASES = [
+    ("png (旧: optimize)", None, None),
+    ("png", "png", None),
+    ("jpeg q85", "jpeg", 85),
+    ("jpeg q90", "jpeg", 90),
+    ("jpeg q95", "jpeg", 95),
+    ("webp q80", "webp", 80),
+    ("webp q90", "webp", 90),
+    ("webp_lossless", "webp_lossless", 80),
+]
+
+
+def legacy_png(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="商品照片路径")
+    parser.add_argument("--repeat", type=int, default=3, help="每种编码重复次数")
+    args = parser.parse_args()
+
+    if args.images:
+        samples = [(p, _downscale(Image.open(p), MAX_REFERENCE_SIDE)) for p in args.images]
+    else:
+        samples = [("synthetic", _downscale(synthetic_product_photo(3000, 3000), MAX_REFERENCE_SIDE))]
+
+    for name, img in samples:
+        print(f"\n== {name} ({img.width}x{img.height}) ==")
+        print(f"{'编码':<20}{'ms/次':>10}{'KB':>10}{'相对旧PNG':>12}")
+        base_size = None
+        for label, fmt, quality in CASES:
+            if fmt is None:
+                cpu, data = cpu_time(lambda: legacy_png(img), args.repeat)
+            else:
+                cpu, (data, _) = cpu_time(lambda: encode_reference(img, fmt, quality), args.repeat)
+            base_size = base_size or len(data)
+            print(f"{label:<20}{cpu / args.repeat * 1000:>10.1f}{len(data) / 1024:>10.1f}"
+                  f"{len(data) / base_size:>11.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+TEMU 智能出图系统 V8.0
+基准: 参考图每次调用重新编码 vs PreparedReference 一次编码
+核心作者: 企鹅
+
+用法:
+    python benchmarks/bench_reference.py [--megapixels 24] [--batch 25]
+"""
+import argparse
+import io
+
+from common import cpu_time, synthetic_product_photo
+
+from PIL import Image
+
+from reference import PreparedReference
+
+
+def legacy_batch(upload: bytes, batch: int) -> int:
+    """旧流程: 完整解码一次, 分析 + 每张生成各 copy/缩放/PNG optimize 一次"""
+    first_img = Image.open(io.BytesIO(upload)).convert("RGB")
+    total = 0
+    for _ in range(batch + 1):
+        buf = io.BytesIO()
+        img = first_img.copy()
+        if img.width > 1024 or img.height > 1024:
+            img.thumbnail((1024, 1024), Image.Resampling.LANCZOS)
+        img.save(buf, format="PNG", optimize=True)
+        total += len(buf.getvalue())
+    return total
+
+
+def prepared_batch(upload: bytes, batch: int) -> int:
+    """新流程: draft 解码 + 一次缩放编码, 批次内共享"""
+    ref = PreparedReference.from_bytes(upload)
+    return len(ref.data) * (batch + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", type=float, default=24, help="上传图片像素数 (百万)")
+    parser.add_argument("--batch", type=int, default=25, help="每批生成张数")
+    args = parser.parse_args()
+
+    w = int((args.megapixels * 1e6 * 4 / 3) ** 0.5)
+    h = int(w * 3 / 4)
+    buf = io.BytesIO()
+    synthetic_product_photo(w, h).save(buf, format="JPEG", quality=92)
+    upload = buf.getvalue()
+    print(f"上传: {w}x{h} JPEG, {len(upload) / 1e6:.1f} MB, 批次 {args.batch} 张 (+1 次分析)")
+
+    legacy_cpu, legacy_bytes = cpu_time(lambda: legacy_batch(upload, args.batch))
+    prepared_cpu, prepared_bytes = cpu_time(lambda: prepared_batch(upload, args.batch))
+
+    print(f"{'流程':<12}{'CPU 秒':>10}{'上传总字节':>14}")
+    print(f"{'旧 (逐次编码)':<12}{legacy_cpu:>10.2f}{legacy_bytes:>14,}")
+    print(f"{'PreparedRef':<12}{prepared_cpu:>10.2f}{prepared_bytes:>14,}")
+    print(f"每批节省 CPU: {legacy_cpu - prepared_cpu:.2f} s ({legacy_cpu / max(prepared_cpu, 1e-6):.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+TEMU 智能出图系统 V8.0
+基准: 规则引擎 - 逐条 re.sub/re.search vs 预编译单遍扫描
+核心作者: 企鹅
+
+用法:
+    python benchmarks/bench_rules.py [--n 20000] [--repeat 3]
+
+生成 n 条商品名称 + 材质 (约 5% 命中替换规则, 1% 命中禁用规则),
+分别用旧版函数和 RuleSet.screen_batch 处理, 并校验两者结果一致。
+"""
+import argparse
+import random
+import re
+from typing import List, Tuple
+
+from common import cpu_time
+
+from rules import BAN_PATTERNS, DEFAULT_RULES, REPLACE_RULES
+
+WORDS = ["Stainless", "Steel", "Water", "Bottle", "Ceramic", "Mug", "Bamboo", "Cutting", "Board",
+         "Cotton", "Tote", "Bag", "Silicone", "Spatula", "Glass", "Vase", "Wooden", "Frame", "LED", "Lamp"]
+SPICE = ["Gold", "silver", "Diamond", "PLATINUM"]
+BANNED = ["www.shop", "best.com deal", "scan QR here", "temu exclusive", "http://x",
+          "www.com", "https://www.temu.com"]  # 后两条为重叠命中多条禁用规则
+
+
+# ==================== 旧版实现 (对照) ====================
+def legacy_apply_replacements(text: str) -> Tuple[str, List[Tuple[str, str]]]:
+    if not text:
+        return text, []
+    result, logs = text, []
+    for pattern, repl in REPLACE_RULES.items():
+        new = re.sub(pattern, repl, result, flags=re.IGNORECASE)
+        if new != result:
+            logs.append((pattern, repl))
+            result = new
+    return result, logs
+
+
+def legacy_check_absolute_bans(text: str) -> List[str]:
+    if not text:
+        return []
+    return [p for p in BAN_PATTERNS if re.search(p, text, flags=re.IGNORECASE)]
+
+
+def legacy_screen(texts):
+    out = []
+    for t in texts:
+        cleaned, logs = legacy_apply_replacements(t)
+        out.append((cleaned, logs, legacy_check_absolute_bans(cleaned)))
+    return out
+
+
+def synthetic_texts(n: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        words = rng.sample(WORDS, rng.randint(2, 6))
+        if rng.random() < 0.05:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(SPICE))
+        if rng.random() < 0.01:
+            words.append(rng.choice(BANNED))
+        texts.append(" ".join(words))
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=20000, help="文本条数")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数")
+    args = parser.parse_args()
+
+    texts = synthetic_texts(args.n)
+    legacy_cpu, legacy = cpu_time(lambda: legacy_screen(texts), args.repeat)
+    new_cpu, new = cpu_time(lambda: DEFAULT_RULES.screen_batch(texts), args.repeat)
+
+    mismatches = sum(1 for a, b in zip(legacy, new) if a != (b.cleaned, b.replacements, b.bans))
+    print(f"{args.n} 条文本, 重复 {args.repeat} 次")
+    print(f"{'实现':<24}{'µs/条':>10}{'总计 s':>10}")
+    for label, cpu in (("逐条正则 (旧)", legacy_cpu), ("预编译单遍 screen_batch", new_cpu)):
+        print(f"{label:<24}{cpu / args.repeat / args.n * 1e6:>10.2f}{cpu:>10.2f}")
+    print(f"加速: {legacy_cpu / new_cpu:.1f}x   结果不一致: {mismatches} 条")
+
+
+if __name__ == "__main__":
+    main()
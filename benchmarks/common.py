@@ -0,0 +1,39 @@
+"""
+TEMU 智能出图系统 V8.0
+基准测试公共工具
+核心作者: 企鹅
+"""
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Tuple
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+# 允许直接以 `python benchmarks/xxx.py` 运行
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def synthetic_product_photo(width: int, height: int) -> Image.Image:
+    """生成近似商品照片的测试图: 渐变背景 + 主体 + 传感器噪点"""
+    bg = Image.linear_gradient("L").resize((width, height))
+    glow = Image.radial_gradient("L").resize((width, height))
+    img = Image.merge("RGB", (bg, ImageChops.invert(glow), ImageChops.multiply(bg, glow)))
+    draw = ImageDraw.Draw(img)
+    cx, cy, r = width // 2, height // 2, min(width, height) // 3
+    draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=(200, 60, 40))
+    draw.rectangle((cx - r // 2, cy - r // 4, cx + r // 2, cy + r // 4), fill=(240, 240, 230))
+    img = img.filter(ImageFilter.GaussianBlur(2))
+    noise = Image.effect_noise((width, height), 18).convert("RGB")
+    return Image.blend(img, noise, 0.08)
+
+
+def cpu_time(func: Callable, repeat: int = 1) -> Tuple[float, object]:
+    """返回 (进程 CPU 秒数, 最后一次返回值)"""
+    result = None
+    start = time.process_time()
+    for _ in range(repeat):
+        result = func()
+    return time.process_time() - start, result
@@ -0,0 +1,238 @@
+"""
+TEMU 智能出图系统 V8.0
+压测: 模拟多个会话同时出图 (使用模拟 Gemini 服务, 不消耗额度)
+核心作者: 企鹅
+
+用法:
+    python benchmarks/load_test.py [--ramp 1,2,4,8,16] [--jobs-per-session 2] [--templates C1:2,C2:1]
+                                   [--fake "latency=lognormal:20:0.35;rate_429=0.05"] [--time-scale 0.1]
+
+每个会话走与网页端 main_app() 相同的服务端流程: 上传原图 → 规则清洗 → 提交后台任务
+(预留额度 → 分析 → 生成 → 写结果 → 结算) → 轮询完成 → 下载 ZIP。
+限流、对冲、降级等组件按当前环境变量配置启用, 与线上一致。
+
+逐级增加并发会话数, 每级输出吞吐、任务/单张延迟分位数、峰值内存和失败数;
+失败率或 P95 任务延迟超出阈值的第一级即为当前配置的容量上限。
+"""
+import argparse
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+# 在导入项目模块前设置 (Config 在导入时读取环境变量)
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="temu_load_"))
+os.environ.setdefault("GEMINI_API_KEY", "load-test")
+os.environ.setdefault("DAILY_LIMIT", "1000000")
+
+from common import synthetic_product_photo
+
+from config import Config
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def current_rss() -> int:
+    """当前常驻内存 (字节)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler:
+    """后台线程采样峰值内存"""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class RecordCollector:
+    """代替 UsageAnalytics 接收每张图的 GenerationRecord"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = []
+
+    def record(self, rec):
+        with self._lock:
+            self.records.append(rec)
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+
+
+def run_session(job_manager, session: int, args, image_bytes: bytes, results: Dict[str, Any]):
+    """模拟一个网页会话依次提交 jobs_per_session 个任务"""
+    from pipeline import build_params, clean_inputs
+    from usage_tracker import QuotaExceeded
+
+    row = {"product_name": f"Insulated Bottle {session}", "product_type": "厨具", "material": "Stainless steel",
+           "templates": args.templates, "aspect_ratio": args.aspect_ratio, "resolution": args.resolution,
+           "model": args.model}
+    for _ in range(args.jobs_per_session):
+        start = time.monotonic()
+        try:
+            params = build_params(row)
+            clean_inputs(params)
+            params["upload_keys"] = [job_manager.store.put_upload(image_bytes)]
+            job_id = job_manager.submit(f"load-{session}", Config.get_api_key(), params)
+        except QuotaExceeded:
+            results["errors"]["QuotaExceeded"] += 1
+            continue
+        while True:
+            job = job_manager.get(job_id)
+            if job.finished:
+                break
+            time.sleep(args.poll)
+        if job.success_count:
+            results["zip_bytes"] += job_manager.export_path(job_id).stat().st_size
+        with results["lock"]:
+            results["job_latency"].append(time.monotonic() - start)
+            results["jobs"] += 1
+            for err in job.errors():
+                results["errors"][err.split(": ", 1)[-1][:60]] += 1
+        time.sleep(args.think_time)
+
+
+def run_level(job_manager, backend, collector: RecordCollector, sessions: int, args,
+              image_bytes: bytes) -> Dict[str, Any]:
+    backend.reset_stats()
+    collector.reset()
+    results: Dict[str, Any] = {"lock": threading.Lock(), "job_latency": [], "jobs": 0, "zip_bytes": 0,
+                               "errors": Counter()}
+    threads = [threading.Thread(target=run_session, args=(job_manager, i, args, image_bytes, results))
+               for i in range(sessions)]
+    start = time.monotonic()
+    with RssSampler() as rss:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    elapsed = time.monotonic() - start
+
+    records = list(collector.records)
+    ok = [r for r in records if r.success]
+    return {
+        "sessions": sessions,
+        "elapsed": elapsed,
+        "jobs": results["jobs"],
+        "images_ok": len(ok),
+        "images_failed": len(records) - len(ok),
+        "throughput": len(ok) / elapsed if elapsed else 0.0,
+        "job_p50": percentile(results["job_latency"], 0.50),
+        "job_p95": percentile(results["job_latency"], 0.95),
+        "job_p99": percentile(results["job_latency"], 0.99),
+        "img_p50": percentile([r.latency for r in ok], 0.50),
+        "img_p95": percentile([r.latency for r in ok], 0.95),
+        "retries": sum(r.retries for r in records),
+        "fallback": sum(1 for r in ok if r.model != args.model),
+        "peak_rss": rss.peak,
+        "backend": backend.stats(),
+        "errors": results["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ramp", default="1,2,4,8", help="逐级并发会话数, 逗号分隔")
+    parser.add_argument("--jobs-per-session", type=int, default=2, help="每个会话提交的任务数")
+    parser.add_argument("--templates", default="C1:2,C2:1,C3:1", help="每个任务的模板及数量")
+    parser.add_argument("--model", default=Config.DEFAULT_MODEL)
+    parser.add_argument("--resolution", default="1K")
+    parser.add_argument("--aspect-ratio", default="1:1")
+    parser.add_argument("--fake", default=os.getenv("FAKE_GEMINI") or "latency=lognormal:20:0.35;rate_429=0.03;"
+                        "rate_503=0.01", help="模拟服务配置串 (见 fake_gemini.py)")
+    parser.add_argument("--time-scale", type=float, default=None, help="模拟延迟缩放系数 (覆盖配置串)")
+    parser.add_argument("--think-time", type=float, default=1.0, help="会话两次提交之间的间隔 (秒)")
+    parser.add_argument("--poll", type=float, default=0.5, help="会话轮询任务状态的间隔 (秒)")
+    parser.add_argument("--max-failure-rate", type=float, default=0.05, help="判定为超出容量的失败率")
+    parser.add_argument("--max-job-p95", type=float, default=180.0, help="判定为超出容量的 P95 任务延迟 (秒)")
+    args = parser.parse_args()
+
+    spec = args.fake + (f";time_scale={args.time_scale}" if args.time_scale is not None else "")
+    Config.FAKE_GEMINI = spec
+
+    from analysis_cache import AnalysisCache
+    from fake_gemini import default_backend
+    from hedging import Hedger
+    from job_queue import JobManager
+    from model_router import ModelRouter
+    from rate_limiter import RateLimiter
+    from result_store import ResultStore
+    from usage_tracker import UsageTracker
+
+    backend = default_backend(spec)
+    collector = RecordCollector()
+    Config.ensure_data_dir()
+    job_manager = JobManager(
+        UsageTracker(),
+        ResultStore(),
+        AnalysisCache(),
+        RateLimiter() if Config.RATE_LIMIT_ENABLED else None,
+        Hedger() if Config.HEDGE_ENABLED else None,
+        ModelRouter() if Config.FALLBACK_ENABLED else None,
+        analytics=collector,
+    )
+
+    buf = io.BytesIO()
+    synthetic_product_photo(1600, 1600).save(buf, format="JPEG", quality=90)
+    image_bytes = buf.getvalue()
+
+    print(f"模拟服务: {spec}")
+    print(f"模型 {args.model} / {args.resolution} / {args.aspect_ratio}, 模板 {args.templates}, "
+          f"JOB_WORKERS={Config.JOB_WORKERS}, MAX_CONCURRENCY={Config.MAX_CONCURRENCY}, 数据目录 {Config._data_dir}")
+    if Config.RATE_LIMIT_ENABLED:
+        caps = Config.MODEL_CAPABILITIES.get(args.model, {})
+        print(f"限流已启用: {caps.get('rpm')} RPM / 并发 {caps.get('max_concurrent')} (RATE_LIMIT_ENABLED=0 可测服务端本身)")
+    header = (f"{'会话':>4}{'任务':>6}{'成功':>6}{'失败':>6}{'张/s':>8}{'任务P50':>9}{'任务P95':>9}{'任务P99':>9}"
+              f"{'单张P50':>9}{'单张P95':>9}{'重试':>6}{'降级':>6}{'在途峰值':>9}{'峰值RSS':>10}")
+    print(header)
+    limit: Optional[int] = None
+    for sessions in (int(x) for x in args.ramp.split(",") if x.strip()):
+        r = run_level(job_manager, backend, collector, sessions, args, image_bytes)
+        print(f"{r['sessions']:>4}{r['jobs']:>6}{r['images_ok']:>6}{r['images_failed']:>6}{r['throughput']:>8.2f}"
+              f"{r['job_p50']:>9.1f}{r['job_p95']:>9.1f}{r['job_p99']:>9.1f}{r['img_p50']:>9.1f}{r['img_p95']:>9.1f}"
+              f"{r['retries']:>6}{r['fallback']:>6}{r['backend']['peak_in_flight']:>9}"
+              f"{r['peak_rss'] / 1024 / 1024:>8.0f}MB")
+        for err, n in r["errors"].most_common(3):
+            print(f"      失败 {n} 次: {err}")
+        total = r["images_ok"] + r["images_failed"]
+        failure_rate = r["images_failed"] / total if total else 1.0
+        if limit is None and (failure_rate > args.max_failure_rate or r["job_p95"] > args.max_job_p95):
+            limit = sessions
+    if limit is None:
+        print("所有级别均在阈值内, 可继续加大 --ramp")
+    else:
+        print(f"容量上限: {limit} 个并发会话时失败率或 P95 任务延迟超出阈值")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+"""
+TEMU 智能出图系统 V8.0
+命令行批量出图 (无界面)
+核心作者: 企鹅
+
+用法:
+    python bulk_generate.py manifest.csv -o output/ [--jobs 4] [--concurrency 4] [--restart]
+    python bulk_generate.py manifest.csv -o output/ --batch      # 离线批量提交 (Batch API)
+
+清单为 CSV 或 JSONL, 每行一个商品:
+    sku            商品编号 (输出子目录名, 缺省为行号)
+    image          商品图片路径 (相对路径以清单所在目录为准)
+    product_name   商品名称
+    product_type   商品类型 (缺省 "其他")
+    material       材质
+    templates      模板及数量, 如 "C1:2,C3:1"; 或 "C1,C3" 配合 counts 列 "2,1"
+    counts         各模板数量 (可选)
+    aspect_ratio   宽高比 (缺省 1:1)
+    resolution     分辨率 (缺省 1K)
+    model          模型 ID (缺省 DEFAULT_MODEL)
+    style          风格预设名称或自定义风格描述 (缺省 产品摄影)
+    strength       风格强度 (缺省 0.3)
+    excludes       额外禁用词, 逗号分隔
+
+输出:
+    <output>/<sku>/<模板>_<名称>_<序号>.png   模型返回的原始图片 (扩展名随返回格式, 如 .jpg)
+    <output>/checkpoint.jsonl   每完成一张追加一行, 中断后重新运行同一命令即从断点继续
+    <output>/results.csv        结果清单 (每张图一行)
+    <output>/batch_jobs.json    Batch 模式已提交的任务, 中断后重新运行即继续等待, 不重复提交 (--transport local 不写入)
+
+规则清洗、提示词模板和生成流程与网页端相同; 不计入网页端每日额度。
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from analysis_cache import AnalysisCache
+from batch_backend import (PARTIALLY_SUCCEEDED, SUCCEEDED, BatchError, BatchGeminiClient, BatchRequest,
+                           make_transport)
+from config import Config
+from gemini_client import GeminiClient
+from pipeline import (IMAGE_EXTENSIONS, BatchSpec, build_params, build_tasks, build_variables, clean_inputs,
+                      image_extension, run_tasks)
+from rate_limiter import RateLimiter
+from reference import PreparedReference
+
+RESULT_FIELDS = ["sku", "template", "seq", "file", "status", "error", "model", "attempts", "latency", "bytes"]
+
+
+# ==================== 清单 ====================
+def load_manifest(path: Path) -> List[Dict[str, Any]]:
+    if path.suffix.lower() in (".jsonl", ".ndjson"):
+        with path.open(encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with path.open(encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+    for i, row in enumerate(rows, 1):
+        row["sku"] = re.sub(r'[\\/:*?"<>|]', "_", str(row.get("sku") or i))  # 用作目录名
+    return rows
+
+
+# ==================== 断点 ====================
+class Checkpoint:
+    """追加写入的完成记录 (线程安全)"""
+
+    def __init__(self, path: Path, restart: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        self.records: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        if restart and path.exists():
+            path.unlink()
+        if path.exists():
+            with path.open(encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # 中断时写了一半的行
+                    self.records[self._key(rec)] = rec
+        if path.exists() and path.stat().st_size:
+            with path.open("rb") as f:
+                f.seek(-1, os.SEEK_END)
+                truncated = f.read(1) != b"\n"
+        else:
+            truncated = False
+        self._file = path.open("a", encoding="utf-8")
+        if truncated:
+            self._file.write("\n")  # 写了一半的行单独成行, 否则会和下一条记录拼在一起
+
+    @staticmethod
+    def _key(rec: Dict[str, Any]) -> Tuple[str, str]:
+        """(sku, 不含扩展名的文件名); 生成前不知道模型返回的格式, 按文件名主干对应任务"""
+        return rec["sku"], Path(rec["file"]).stem
+
+    def done(self, out_dir: Path) -> Set[Tuple[str, str]]:
+        return {key for key, rec in self.records.items()
+                if rec["status"] == "done" and (out_dir / rec["sku"] / rec["file"]).exists()}
+
+    def add(self, rec: Dict[str, Any]):
+        with self._lock:
+            if rec["file"]:
+                self.records.pop((rec["sku"], ""), None)  # 之前整行失败的记录
+            self.records[self._key(rec)] = rec
+            self._file.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+# ==================== 执行 ====================
+def _failed_record(sku: str, task, error: Any) -> Dict[str, Any]:
+    return {"sku": sku, "template": task.template_id if task else "", "seq": task.seq if task else 0,
+            "file": task.filename if task else "", "status": "failed", "error": str(error)[:200],
+            "model": "", "attempts": 0, "latency": 0, "bytes": 0}
+
+
+def prepare_row(client_for, row: Dict[str, Any], manifest_dir: Path, checkpoint: Checkpoint,
+                done: Set[Tuple[str, str]]) -> Tuple[int, int, Optional[str], list, Optional[BatchSpec]]:
+    """
+    清洗输入、读取参考图并分析商品 (同步模式与 Batch 模式共用)
+
+    Returns:
+        (已完成张数, 失败张数, 模型 ID, 待生成任务, BatchSpec); 没有待生成任务或准备失败时 spec 为 None
+    """
+    sku = row["sku"]
+    try:
+        params = build_params(row)
+        tasks = build_tasks(params["selected"], params["counts"])
+        inputs = clean_inputs(params)
+    except Exception as e:
+        checkpoint.add(_failed_record(sku, None, e))
+        return 0, 1, None, [], None
+
+    pending = [t for t in tasks if (sku, t.stem) not in done]
+    ok = len(tasks) - len(pending)
+    if not pending:
+        return ok, 0, params["model_id"], [], None
+
+    try:
+        image_path = Path(row.get("image") or "")
+        if not image_path.is_absolute():
+            image_path = manifest_dir / image_path
+        reference = PreparedReference.from_file(image_path)
+        try:
+            analysis = client_for(params["model_id"]).analyze_image(reference)
+        except Exception:
+            analysis = None
+        spec = BatchSpec(
+            reference=reference,
+            negative_prompt=inputs.negative_prompt,
+            aspect_ratio=params["aspect_ratio"],
+            resolution=params["resolution"],
+            style_strength=params["strength"],
+            variables=build_variables(params, inputs, analysis),
+        )
+    except Exception as e:
+        for t in pending:
+            checkpoint.add(_failed_record(sku, t, e))
+        return ok, len(pending), params["model_id"], [], None
+    return ok, 0, params["model_id"], pending, spec
+
+
+def process_row(client_for, row: Dict[str, Any], manifest_dir: Path, out_dir: Path,
+                checkpoint: Checkpoint, done: Set[Tuple[str, str]], concurrency: int) -> Tuple[int, int]:
+    """
+    生成一个商品的全部图片
+
+    Returns:
+        (成功张数, 失败张数), 含之前已完成的
+    """
+    sku = row["sku"]
+    ok, failed, model_id, pending, spec = prepare_row(client_for, row, manifest_dir, checkpoint, done)
+    if spec is None:
+        return ok, failed
+
+    sku_dir = out_dir / sku
+    sku_dir.mkdir(parents=True, exist_ok=True)
+
+    def on_done(outcome, _done, _total):
+        nonlocal ok, failed
+        if outcome.ok:
+            _write_atomic(sku_dir / outcome.filename, outcome.data)
+            ok += 1
+        else:
+            failed += 1
+        checkpoint.add({
+            "sku": sku, "template": outcome.task.template_id, "seq": outcome.task.seq,
+            "file": outcome.filename, "status": "done" if outcome.ok else "failed",
+            "error": "" if outcome.ok else str(outcome.error)[:200], "model": outcome.model,
+            "attempts": outcome.attempts, "latency": round(outcome.latency, 2), "bytes": outcome.size,
+        })
+        outcome.data = None  # 已落盘, 释放内存
+
+    run_tasks(client_for(model_id), pending, spec, max_workers=concurrency, on_done=on_done)
+    return ok, failed
+
+
+# ==================== Batch 模式 ====================
+class BatchState:
+    """
+    已提交的批量任务 (<output>/batch_jobs.json), 重新运行时继续等待而不重复提交
+
+    persistent=False (传输层任务不能跨进程, 如本地模拟) 时只记在内存, 不读写文件,
+    重新运行时未完成的图片重新提交。
+    """
+
+    def __init__(self, path: Path, restart: bool = False, persistent: bool = True):
+        self.path = path
+        self.persistent = persistent
+        self._lock = threading.Lock()
+        self.jobs: List[Dict[str, Any]] = []
+        if restart and path.exists():
+            path.unlink()
+        if persistent and path.exists():
+            self.jobs = json.loads(path.read_text(encoding="utf-8"))
+            for job in self.jobs:
+                job["items"] = {self._strip_extension(k): v for k, v in job["items"].items()}
+
+    @staticmethod
+    def _strip_extension(key: str) -> str:
+        """旧版本记录的 key 为 sku/文件名.png, 现为 sku/文件名主干 (扩展名随返回格式)"""
+        root, ext = os.path.splitext(key)
+        return root if ext.lower() in IMAGE_EXTENSIONS.values() else key
+
+    def outstanding(self) -> List[Dict[str, Any]]:
+        return [job for job in self.jobs if not job.get("collected")]
+
+    def outstanding_keys(self) -> Set[str]:
+        return {key for job in self.outstanding() for key in job["items"]}
+
+    def add(self, name: str, model: str, items: Dict[str, Dict[str, Any]]):
+        with self._lock:
+            self.jobs.append({"name": name, "model": model, "items": items, "collected": False})
+            self.save()
+
+    def mark_collected(self, job: Dict[str, Any]):
+        with self._lock:
+            job["collected"] = True
+            self.save()
+
+    def save(self):
+        if not self.persistent:
+            return
+        _write_atomic(self.path, json.dumps(self.jobs, ensure_ascii=False, indent=1).encode("utf-8"))
+
+
+def run_batch_mode(batch_client_for, rows: List[Dict[str, Any]], manifest_dir: Path, out_dir: Path,
+                   checkpoint: Checkpoint, done: Set[Tuple[str, str]], state: BatchState,
+                   jobs: int) -> Tuple[int, int]:
+    """
+    Batch 模式: 准备全部请求 → 按模型打包提交 → 轮询 → 取回落盘
+
+    参考图按 jobs * 4 个商品一组准备, 请求凑满 BATCH_MAX_REQUESTS 条即提交, 不把整个清单的图片同时留在内存。
+
+    Returns:
+        (成功张数, 失败张数), 含之前已完成的
+    """
+    ok = failed = 0
+    submitted = state.outstanding_keys()
+    buffers: Dict[str, List[BatchRequest]] = {}
+    size = max(1, Config.BATCH_MAX_REQUESTS)
+
+    def flush(model: str, force: bool = False):
+        buf = buffers.get(model, [])
+        while buf and (force or len(buf) >= size):
+            chunk, buf[:] = buf[:size], buf[size:]
+            client = batch_client_for(model)
+            for name in client.submit(chunk, display_name=f"temu-bulk-{out_dir.name}"):
+                state.add(name, model, {r.key: r.metadata for r in chunk})
+                print(f"已提交批量任务 {name}: {len(chunk)} 张 ({model})")
+
+    step = max(1, jobs) * 4
+    with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="sku") as pool:
+        for start in range(0, len(rows), step):
+            chunk = rows[start:start + step]
+            prepared = pool.map(lambda r: prepare_row(batch_client_for, r, manifest_dir, checkpoint, done), chunk)
+            for row, (row_ok, row_failed, model_id, pending, spec) in zip(chunk, prepared):
+                ok += row_ok
+                failed += row_failed
+                for t in pending:
+                    key = f"{row['sku']}/{t.stem}"
+                    if key in submitted:
+                        continue  # 上次运行已提交, 等待结果即可
+                    buffers.setdefault(model_id, []).append(BatchRequest(
+                        key=key,
+                        reference=spec.reference,
+                        prompt=t.prompt_template.format(**spec.variables),
+                        negative_prompt=spec.negative_prompt,
+                        aspect_ratio=spec.aspect_ratio,
+                        resolution=spec.resolution,
+                        style_strength=spec.style_strength,
+                        metadata={"template": t.template_id, "seq": t.seq},
+                    ))
+                if model_id:
+                    flush(model_id)
+        for model in list(buffers):
+            flush(model, force=True)
+
+    for job in state.outstanding():
+        client = batch_client_for(job["model"])
+        final = client.wait(job["name"], on_poll=lambda s, n=job["name"]: print(f"{n}: {s}"))
+        results = {}
+        if final in (SUCCEEDED, PARTIALLY_SUCCEEDED):
+            # 旧版本提交的请求 key 带 .png, 取回时同样去掉
+            results = {BatchState._strip_extension(k): r for k, r in client.collect(job["name"])}
+        for key, meta in job["items"].items():
+            sku, stem = key.split("/", 1)
+            result = results.get(key, BatchError(f"批量任务未返回该请求的结果 ({final})"))
+            rec = {"sku": sku, "template": meta["template"], "seq": meta["seq"], "file": f"{stem}.png",
+                   "model": job["model"], "attempts": 1, "latency": 0}
+            if isinstance(result, Exception):
+                failed += 1
+                checkpoint.add({**rec, "status": "failed", "error": str(result)[:200], "bytes": 0})
+                continue
+            (out_dir / sku).mkdir(parents=True, exist_ok=True)
+            filename = stem + image_extension(result.mime_type)
+            _write_atomic(out_dir / sku / filename, result.data)  # 原样落盘, 不重新编码
+            ok += 1
+            checkpoint.add({**rec, "file": filename, "status": "done", "error": "", "bytes": len(result.data)})
+        state.mark_collected(job)
+    return ok, failed
+
+
+def write_results(path: Path, rows: List[Dict[str, Any]], checkpoint: Checkpoint):
+    """按清单顺序输出结果清单"""
+    order = {row["sku"]: i for i, row in enumerate(rows)}
+    records = sorted(checkpoint.records.values(),
+                     key=lambda r: (order.get(r["sku"], len(order)), r["template"], r["seq"]))
+    tmp = path.with_name(f".{path.name}.tmp")
+    with tmp.open("w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for rec in records:
+            writer.writerow({**rec, "file": f"{rec['sku']}/{rec['file']}" if rec["file"] else ""})
+    os.replace(tmp, path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", type=Path, help="CSV / JSONL 清单")
+    parser.add_argument("-o", "--output", type=Path, default=Path("output"), help="输出目录")
+    parser.add_argument("--jobs", type=int, default=Config.JOB_WORKERS, help="同时处理的商品数")
+    parser.add_argument("--concurrency", type=int, default=Config.MAX_CONCURRENCY, help="每个商品的并发请求数")
+    parser.add_argument("--api-key", default=None, help="API Key (缺省读取 GEMINI_API_KEY)")
+    parser.add_argument("--restart", action="store_true", help="忽略断点, 全部重新生成")
+    parser.add_argument("--batch", action="store_true", help="Batch 模式: 打包离线提交, 适合不急用的整批任务")
+    parser.add_argument("--transport", choices=["gemini", "local"], default=None,
+                        help="Batch 传输层 (缺省 BATCH_TRANSPORT; local 为本地模拟, 不消耗额度)")
+    args = parser.parse_args(argv)
+
+    api_key = args.api_key or Config.get_api_key()
+    if not api_key:
+        parser.error("未设置 API Key (GEMINI_API_KEY 或 --api-key)")
+
+    rows = load_manifest(args.manifest)
+    args.output.mkdir(parents=True, exist_ok=True)
+    checkpoint = Checkpoint(args.output / "checkpoint.jsonl", restart=args.restart)
+    done = checkpoint.done(args.output)
+    if done:
+        print(f"从断点继续: 已完成 {len(done)} 张")
+
+    analysis_cache = AnalysisCache()
+    rate_limiter = RateLimiter() if Config.RATE_LIMIT_ENABLED else None
+    clients: Dict[str, GeminiClient] = {}
+    clients_lock = threading.Lock()
+
+    def client_for(model: str) -> GeminiClient:
+        with clients_lock:
+            if model not in clients:
+                clients[model] = GeminiClient(api_key, model, analysis_cache=analysis_cache,
+                                              rate_limiter=rate_limiter)
+            return clients[model]
+
+    start = time.monotonic()
+    if args.batch:
+        transport = make_transport(api_key, args.transport)
+        batch_clients: Dict[str, BatchGeminiClient] = {}
+
+        def batch_client_for(model: str) -> BatchGeminiClient:
+            with clients_lock:
+                if model not in batch_clients:
+                    batch_clients[model] = BatchGeminiClient(api_key, model, transport=transport,
+                                                             analysis_cache=analysis_cache)
+                return batch_clients[model]
+
+        state = BatchState(args.output / "batch_jobs.json", restart=args.restart, persistent=transport.persistent)
+        if state.outstanding():
+            print(f"继续等待 {len(state.outstanding())} 个已提交的批量任务")
+        try:
+            total_ok, total_failed = run_batch_mode(batch_client_for, rows, args.manifest.parent, args.output,
+                                                    checkpoint, done, state, args.jobs)
+        except KeyboardInterrupt:
+            if transport.persistent:
+                print("已中断, 已提交的批量任务会继续在服务端执行, 重新运行同一命令可继续等待并取回结果",
+                      file=sys.stderr)
+            else:
+                print("已中断, 重新运行同一命令会重新提交未完成的图片", file=sys.stderr)
+            return 130
+        finally:
+            checkpoint.close()
+            write_results(args.output / "results.csv", rows, checkpoint)
+        print(f"完成: 成功 {total_ok} 张, 失败 {total_failed} 张, 用时 {time.monotonic() - start:.0f}s")
+        print(f"结果清单: {args.output / 'results.csv'}")
+        return 0 if total_failed == 0 else 1
+
+    total_ok = total_failed = 0
+    pool = ThreadPoolExecutor(max_workers=max(1, args.jobs), thread_name_prefix="sku")
+    try:
+        futures = {
+            pool.submit(process_row, client_for, row, args.manifest.parent, args.output,
+                        checkpoint, done, max(1, args.concurrency)): row["sku"]
+            for row in rows
+        }
+        for i, fut in enumerate(as_completed(futures), 1):
+            ok, failed = fut.result()
+            total_ok += ok
+            total_failed += failed
+            print(f"[{i}/{len(rows)}] {futures[fut]}: 成功 {ok}" + (f", 失败 {failed}" if failed else ""))
+    except KeyboardInterrupt:
+        print("已中断, 等待进行中的请求完成... 重新运行同一命令可从断点继续", file=sys.stderr)
+        pool.shutdown(wait=False, cancel_futures=True)
+        return 130
+    finally:
+        pool.shutdown(wait=True)
+        checkpoint.close()
+        write_results(args.output / "results.csv", rows, checkpoint)
+
+    print(f"完成: 成功 {total_ok} 张, 失败 {total_failed} 张, 用时 {time.monotonic() - start:.0f}s")
+    print(f"结果清单: {args.output / 'results.csv'}")
+    return 0 if total_failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -50,7 +50,7 @@ class Config:
         "gemini-2.5-flash-image": "高速生成, 低延迟, 适合批量任务",
     }
     
-    # 模型能力
+    # 模型能力 (rpm / max_concurrent: 同一 API Key 下的全局限流)
     MODEL_CAPABILITIES = {
         "gemini-3-pro-image-preview": {
             "max_resolution": "4K",
@@ -58,6 +58,17 @@ class Config:
             "max_input_images": 14,
             "thinking": True,
             "grounding": True,
+            "rpm": int(os.getenv("PRO_RPM", "20")),
+            "max_concurrent": int(os.getenv("PRO_MAX_CONCURRENT", "8")),
+            "retry": {"max_attempts": 4, "base_delay": 2.0, "max_delay": 60.0, "total_budget": 600.0},
+            "hedge": True,
+            # 超出 SLO 时新请求降级到备用模型 (1K), 恢复后自动切回
+            "slo": {
+                "p95_latency": float(os.getenv("PRO_SLO_P95", "120")),
+                "max_error_rate": float(os.getenv("PRO_SLO_ERROR_RATE", "0.3")),
+                "fallback": "gemini-2.5-flash-image",
+                "fallback_resolution": "1K",
+            },
         },
         "gemini-2.5-flash-image": {
             "max_resolution": "1K",
@@ -65,11 +76,77 @@ class Config:
             "max_input_images": 3,
             "thinking": False,
             "grounding": False,
+            "rpm": int(os.getenv("FLASH_RPM", "60")),
+            "max_concurrent": int(os.getenv("FLASH_MAX_CONCURRENT", "16")),
+            "retry": {"max_attempts": 5, "base_delay": 1.0, "max_delay": 20.0, "total_budget": 180.0},
+            "hedge": False,
         },
     }
     
     API_TIMEOUT = int(os.getenv("API_TIMEOUT", "180"))
     
+    # 全局限流 (未在 MODEL_CAPABILITIES 中配置的模型使用默认值)
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+    DEFAULT_RPM = int(os.getenv("DEFAULT_RPM", "60"))
+    DEFAULT_MAX_CONCURRENT = int(os.getenv("DEFAULT_MAX_CONCURRENT", "16"))
+    RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "10"))
+    
+    # 对冲请求: 超过近期延迟分位数仍未返回时再发一份 (仅 hedge=True 的模型)
+    HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+    HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+    HEDGE_MAX_INFLIGHT = int(os.getenv("HEDGE_MAX_INFLIGHT", "2"))  # 每个 API Key
+    HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    HEDGE_WINDOW = 200
+    HEDGE_POOL_SIZE = 64
+    
+    # SLO 自动降级
+    FALLBACK_ENABLED = os.getenv("FALLBACK_ENABLED", "1") != "0"
+    SLO_WINDOW_SECONDS = float(os.getenv("SLO_WINDOW_SECONDS", "300"))
+    SLO_MIN_SAMPLES = int(os.getenv("SLO_MIN_SAMPLES", "5"))
+    SLO_PROBE_INTERVAL = float(os.getenv("SLO_PROBE_INTERVAL", "60"))
+    SLO_RECOVERY_PROBES = int(os.getenv("SLO_RECOVERY_PROBES", "2"))
+    
+    # 重试策略默认值 (可在 MODEL_CAPABILITIES[model]["retry"] 中按模型覆盖)
+    RETRY_DEFAULTS = {
+        "max_attempts": 4,
+        "base_delay": 1.0,
+        "max_delay": 30.0,
+        "total_budget": 300.0,
+    }
+    # 显式设置的环境变量优先于按模型配置, 对所有模型生效
+    RETRY_OVERRIDES = {
+        **({"max_attempts": int(os.environ["RETRY_MAX_ATTEMPTS"])} if os.getenv("RETRY_MAX_ATTEMPTS") else {}),
+        **({"total_budget": float(os.environ["RETRY_TOTAL_BUDGET"])} if os.getenv("RETRY_TOTAL_BUDGET") else {}),
+    }
+    
+    # 批量生成并发数 (同时在途的图片请求)
+    MAX_CONCURRENCY = max(1, int(os.getenv("MAX_CONCURRENCY", "4")))
+    # 后台同时执行的生成任务数 (每个任务内部再按 MAX_CONCURRENCY 并发)
+    JOB_WORKERS = max(1, int(os.getenv("JOB_WORKERS", "4")))
+    JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+    
+    # 参考图请求编码: jpeg / webp / webp_lossless / png
+    REFERENCE_FORMAT = os.getenv("REFERENCE_FORMAT", "jpeg").lower()
+    REFERENCE_QUALITY = int(os.getenv("REFERENCE_QUALITY", "90"))
+    
+    # 产品分析缓存 (按参考图内容寻址, 持久化到数据目录)
+    ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "2000"))
+    ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(30 * 24 * 3600)))
+    
+    # 生成结果与上传原图在磁盘上的保留时间
+    RESULT_TTL_HOURS = int(os.getenv("RESULT_TTL_HOURS", "24"))
+    
+    # 使用量计数先记在内存, 按间隔/条数批量写入 usage.db (崩溃最多丢失一个间隔的计数)
+    USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))
+    USAGE_FLUSH_MAX_PENDING = int(os.getenv("USAGE_FLUSH_MAX_PENDING", "100"))
+    # 批量生成预留额度的最长保留时间 (秒), 超时未结算自动释放
+    QUOTA_RESERVATION_TTL = float(os.getenv("QUOTA_RESERVATION_TTL", str(6 * 3600)))
+    
+    # 运行数据保留期 (天): 逐张明细 / 小时汇总 / 天汇总
+    ANALYTICS_RAW_DAYS = int(os.getenv("ANALYTICS_RAW_DAYS", "7"))
+    ANALYTICS_HOURLY_DAYS = int(os.getenv("ANALYTICS_HOURLY_DAYS", "30"))
+    ANALYTICS_DAILY_DAYS = int(os.getenv("ANALYTICS_DAILY_DAYS", "365"))
+    
     # ==================== 图片宽高比 ====================
     ASPECT_RATIOS = {
         "1:1 正方形": "1:1",
@@ -117,8 +194,32 @@ class Config:
         "human faces", "children", "hands", "models", "text overlays",
     ]
     
+    # ==================== HTTP 任务接口 ====================
+    API_PORT = int(os.getenv("API_PORT", "8502"))
+    API_MAX_BODY_MB = int(os.getenv("API_MAX_BODY_MB", "30"))
+    
+    # ==================== 离线批量 (Batch API) ====================
+    BATCH_TRANSPORT = os.getenv("BATCH_TRANSPORT", "gemini")  # gemini / local (模拟)
+    BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "200"))  # 每个批量任务的请求数
+    BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "30"))
+    
+    # ==================== 指标 ====================
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # Prometheus 抓取 /metrics
+    
+    # ==================== 追踪 ====================
+    TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") != "0"  # 每个任务记录各阶段耗时
+    
+    # ==================== 压测 ====================
+    # 非空时所有 GeminiClient 使用进程内模拟服务, 不调用真实 API (配置串见 fake_gemini.py)
+    FAKE_GEMINI = os.getenv("FAKE_GEMINI", "")
+    
     # ==================== 数据目录 ====================
     BASE_DIR = Path(__file__).parent
+    
+    # 替换/禁用规则文件 (JSON), 修改后自动生效
+    RULES_FILE = os.getenv("RULES_FILE", str(BASE_DIR / "rules.json"))
+    RULES_RELOAD_INTERVAL = float(os.getenv("RULES_RELOAD_INTERVAL", "2"))
     _data_dir: Optional[Path] = None
     _usage_file: Optional[Path] = None
     
@@ -177,4 +278,6 @@ class Config:
         errors = []
         if not cls.get_api_key():
             errors.append("未配置 GEMINI_API_KEY")
+        if cls.REFERENCE_FORMAT not in ("jpeg", "webp", "webp_lossless", "png"):
+            errors.append(f"REFERENCE_FORMAT 无效: {cls.REFERENCE_FORMAT}")
         return errors
@@ -0,0 +1,265 @@
+"""
+TEMU 智能出图系统 V8.0
+模拟 Gemini 服务 (压测 / 演练用, 不消耗额度)
+核心作者: 企鹅
+
+接口与 genai.Client 的 models.generate_content / aio.models.generate_content 一致,
+可直接替换 GeminiClient.client:
+    GeminiClient(api_key, model, backend=FakeGeminiBackend.from_spec("latency=lognormal:20:0.35"))
+或设置环境变量 FAKE_GEMINI=<配置> 让整个服务 (网页端 / 任务接口 / 命令行) 都使用模拟服务。
+
+- 按请求的宽高比和分辨率返回合成图片 (按尺寸缓存, 体积接近真实 PNG 输出)
+- 延迟分布可配置, 2K / 4K 按 RESOLUTION_LATENCY_FACTOR 放大
+- 按比例注入 429 (带 RetryInfo) / 503 / 无图片响应, 错误与真实 SDK 异常类型相同
+- Pro 模型在最终图片前返回若干张 thinking 草图
+
+配置串 (分号分隔, 均可省略):
+    latency=lognormal:20:0.35    生成延迟: fixed:秒 / uniform:下限:上限 / normal:均值:标准差 / lognormal:中位数:sigma
+    analysis_latency=fixed:2     分析请求延迟
+    rate_429=0.05                429 比例
+    rate_503=0.02                503 比例
+    rate_empty=0                 不返回图片的比例
+    retry_after=2                429 建议等待秒数
+    thinking=2                   Pro 模型 thinking 草图张数
+    time_scale=1                 所有延迟乘以该系数 (压测时可缩短)
+    seed=0                       随机种子 (同一配置的错误/延迟序列可复现)
+"""
+import asyncio
+import io
+import json
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from google.genai import errors as genai_errors
+from google.genai import types
+from PIL import Image, ImageDraw
+
+RESOLUTION_SIDE = {"1K": 1024, "2K": 2048, "4K": 4096}
+RESOLUTION_LATENCY_FACTOR = {"1K": 1.0, "2K": 1.4, "4K": 2.0}
+
+
+@dataclass
+class FakeBackendConfig:
+    """模拟服务配置"""
+    latency: str = "lognormal:20:0.35"
+    analysis_latency: str = "fixed:2"
+    rate_429: float = 0.0
+    rate_503: float = 0.0
+    rate_empty: float = 0.0
+    retry_after: float = 2.0
+    thinking: int = 2
+    time_scale: float = 1.0
+    seed: int = 0
+
+    @classmethod
+    def parse(cls, spec: str) -> "FakeBackendConfig":
+        """解析 "key=value;key=value" 配置串 ("1" / "on" 表示全部使用默认值)"""
+        cfg = cls()
+        types_ = {f.name: f.type for f in fields(cls)}
+        for item in (spec or "").replace(",", ";").split(";"):
+            if "=" not in item:
+                continue
+            key, value = (s.strip() for s in item.split("=", 1))
+            if key not in types_:
+                raise ValueError(f"未知的模拟服务配置项: {key}")
+            setattr(cfg, key, types_[key](value))
+        sample_latency(cfg.latency, random.Random())  # 提前校验格式
+        sample_latency(cfg.analysis_latency, random.Random())
+        return cfg
+
+
+def sample_latency(spec: str, rng: random.Random) -> float:
+    """按分布描述采样延迟 (秒)"""
+    kind, *args = spec.split(":")
+    try:
+        values = [float(a) for a in args]
+        if kind == "fixed":
+            return values[0]
+        if kind == "uniform":
+            return rng.uniform(values[0], values[1])
+        if kind == "normal":
+            return max(0.0, rng.gauss(values[0], values[1]))
+        if kind == "lognormal":
+            return rng.lognormvariate(math.log(values[0]), values[1])
+    except (IndexError, ValueError):
+        pass
+    raise ValueError(f"无效的延迟分布: {spec}")
+
+
+def image_size(aspect_ratio: str, resolution: str) -> Tuple[int, int]:
+    """宽高比 + 分辨率 -> 像素尺寸 (长边为 1024 / 2048 / 4096)"""
+    w, h = (int(x) for x in (aspect_ratio or "1:1").split(":"))
+    side = RESOLUTION_SIDE.get(resolution, 1024)
+    if w >= h:
+        return side, max(8, round(side * h / w))
+    return max(8, round(side * w / h)), side
+
+
+@lru_cache(maxsize=32)
+def synthetic_png(width: int, height: int) -> bytes:
+    """合成图片 (带噪点, PNG 体积与真实输出同一量级)"""
+    img = Image.merge("RGB", (
+        Image.linear_gradient("L").resize((width, height)),
+        Image.radial_gradient("L").resize((width, height)),
+        Image.effect_noise((width, height), 24),
+    ))
+    draw = ImageDraw.Draw(img)
+    r = min(width, height) // 4
+    draw.ellipse((width // 2 - r, height // 2 - r, width // 2 + r, height // 2 + r), fill=(200, 60, 40))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+ANALYSIS_RESPONSE = json.dumps({
+    "product_description": "Stainless steel insulated bottle",
+    "key_features": ["Double-wall vacuum", "Leak-proof lid", "Keeps drinks cold 24h"],
+    "material_guess": "Stainless steel",
+    "color_scheme": "Silver, black",
+    "suggested_scene": "outdoor hiking",
+})
+
+
+def _api_error(code: int, status: str, message: str, details: Optional[list] = None) -> genai_errors.APIError:
+    body = {"error": {"code": code, "status": status, "message": message, "details": details or []}}
+    cls = genai_errors.ClientError if code < 500 else genai_errors.ServerError
+    return cls(code, body)
+
+
+class _Models:
+    def __init__(self, backend: "FakeGeminiBackend"):
+        self._backend = backend
+
+    def generate_content(self, model: str, contents: Any, config: Any = None) -> types.GenerateContentResponse:
+        delay, outcome = self._backend._plan(model, config)
+        self._backend._enter()
+        try:
+            time.sleep(delay)
+            return self._backend._respond(model, config, outcome)
+        finally:
+            self._backend._exit()
+
+
+class _AsyncModels(_Models):
+    async def generate_content(self, model: str, contents: Any, config: Any = None) -> types.GenerateContentResponse:
+        delay, outcome = self._backend._plan(model, config)
+        self._backend._enter()
+        try:
+            await asyncio.sleep(delay)
+            return await asyncio.to_thread(self._backend._respond, model, config, outcome)
+        finally:
+            self._backend._exit()
+
+
+class _Aio:
+    def __init__(self, backend: "FakeGeminiBackend"):
+        self.models = _AsyncModels(backend)
+
+
+class FakeGeminiBackend:
+    """模拟 genai.Client (线程安全, 可被多个 GeminiClient 共用)"""
+
+    def __init__(self, config: Optional[FakeBackendConfig] = None):
+        self.config = config or FakeBackendConfig()
+        self.models = _Models(self)
+        self.aio = _Aio(self)
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "FakeGeminiBackend":
+        return cls(FakeBackendConfig.parse(spec))
+
+    # ==================== 统计 ====================
+    def reset_stats(self):
+        with self._lock:
+            self._stats: Dict[str, int] = {"calls": 0, "images": 0, "analysis": 0, "error_429": 0,
+                                           "error_503": 0, "empty": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _enter(self):
+        with self._lock:
+            self._stats["in_flight"] += 1
+            self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._stats["in_flight"])
+
+    def _exit(self):
+        with self._lock:
+            self._stats["in_flight"] -= 1
+
+    # ==================== 响应 ====================
+    def _plan(self, model: str, config: Any) -> Tuple[float, str]:
+        """决定本次请求的延迟和结果 (在锁内取随机数, 保证同一种子序列可复现)"""
+        cfg = self.config
+        is_analysis = "IMAGE" not in (getattr(config, "response_modalities", None) or [])
+        image_config = getattr(config, "image_config", None)
+        resolution = getattr(image_config, "image_size", None) or "1K"
+        with self._lock:
+            self._stats["calls"] += 1
+            roll = self._rng.random()
+            if is_analysis:
+                delay = sample_latency(cfg.analysis_latency, self._rng)
+            else:
+                delay = sample_latency(cfg.latency, self._rng) * RESOLUTION_LATENCY_FACTOR.get(resolution, 1.0)
+        if roll < cfg.rate_429:
+            outcome, delay = "error_429", min(delay, 0.2)  # 限流立即返回
+        elif roll < cfg.rate_429 + cfg.rate_503:
+            outcome = "error_503"
+        elif not is_analysis and roll < cfg.rate_429 + cfg.rate_503 + cfg.rate_empty:
+            outcome = "empty"
+        else:
+            outcome = "analysis" if is_analysis else "images"
+        with self._lock:
+            self._stats[outcome] += 1
+        return delay * cfg.time_scale, outcome
+
+    def _respond(self, model: str, config: Any, outcome: str) -> types.GenerateContentResponse:
+        if outcome == "error_429":
+            retry_delay = f"{self.config.retry_after * self.config.time_scale:g}s"
+            raise _api_error(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (fake)",
+                             [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": retry_delay}])
+        if outcome == "error_503":
+            raise _api_error(503, "UNAVAILABLE", "The model is overloaded (fake)")
+        if outcome == "analysis":
+            return self._response([types.Part(text=ANALYSIS_RESPONSE)])
+        if outcome == "empty":
+            return self._response([types.Part(text="I can't generate that image.")])
+
+        image_config = getattr(config, "image_config", None)
+        aspect_ratio = getattr(image_config, "aspect_ratio", None) or "1:1"
+        resolution = getattr(image_config, "image_size", None) or "1K"
+        width, height = image_size(aspect_ratio, resolution)
+        parts = []
+        if "pro" in model.lower():
+            draft = synthetic_png(max(8, width // 4), max(8, height // 4))
+            parts = [types.Part(inline_data=types.Blob(data=draft, mime_type="image/png"), thought=True)
+                     for _ in range(self.config.thinking)]
+        parts.append(types.Part(inline_data=types.Blob(data=synthetic_png(width, height), mime_type="image/png")))
+        return self._response(parts)
+
+    @staticmethod
+    def _response(parts: list) -> types.GenerateContentResponse:
+        return types.GenerateContentResponse(candidates=[types.Candidate(
+            content=types.Content(role="model", parts=parts), finish_reason=types.FinishReason.STOP,
+        )])
+
+
+_default: Optional[FakeGeminiBackend] = None
+_default_lock = threading.Lock()
+
+
+def default_backend(spec: str) -> FakeGeminiBackend:
+    """FAKE_GEMINI 对应的进程内共享实例 (统计数据全局汇总)"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = FakeGeminiBackend.from_spec(spec)
+        return _default
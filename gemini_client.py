@@ -6,12 +6,16 @@ Gemini AI 客户端 - 支持 Nano Banana Pro
 支持功能:
 - Nano Banana Pro (gemini-3-pro-image-preview): 4K, Thinking, 14张参考图
 - Nano Banana (gemini-2.5-flash-image): 快速生成
+- AsyncGeminiClient: 基于 asyncio 的异步客户端, 接口与 GeminiClient 一致
 """
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Optional, Any, List
+from contextlib import AsyncExitStack, ExitStack, contextmanager
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Optional, Any, List, Union
 from PIL import Image
+import asyncio
 import io
 import json
 import time
@@ -19,13 +23,71 @@ import time
 from google import genai
 from google.genai import types
 
+import metrics
+import tracing
+from config import Config
+from reference import PreparedReference, as_reference
+from retry_policy import RetryPolicy, acall_with_retry, call_with_retry, error_label
+
+
+@dataclass
+class EncodedImage:
+    """模型返回的编码图片 (原始字节 + MIME 类型)"""
+    data: bytes
+    mime_type: str = "image/png"
+
+    def decode(self) -> Image.Image:
+        return Image.open(io.BytesIO(self.data)).convert("RGB")
+
 
 @dataclass
 class ImageResult:
-    """图片生成结果"""
-    image: Image.Image
-    raw_response: Any
-    thinking_images: List[Image.Image] = None  # Thinking 过程中的草图
+    """
+    图片生成结果
+    
+    保存模型返回的原始编码字节, 访问 image / thinking_images 时才解码。
+    raw_response 与 Thinking 草图默认不保留 (客户端 keep_raw_response / include_thinking 开启)。
+    """
+    data: bytes
+    mime_type: str = "image/png"
+    raw_response: Any = None
+    thinking: List[EncodedImage] = field(default_factory=list)  # Thinking 过程中的草图 (未解码)
+    attempts: int = 1  # 本次生成实际请求次数 (含重试)
+    hedged: bool = False  # 是否发出过对冲请求
+    model: str = ""  # 实际生成该图片的模型
+    resolution: str = ""  # 实际生成的分辨率 (降级到备用模型时与请求不同; 空表示与请求相同)
+
+    @cached_property
+    def image(self) -> Image.Image:
+        """最终图片 (首次访问时解码为 RGB)"""
+        return Image.open(io.BytesIO(self.data)).convert("RGB")
+
+    @property
+    def thinking_images(self) -> List[Image.Image]:
+        """解码 Thinking 草图 (每次访问都重新解码)"""
+        return [t.decode() for t in self.thinking]
+
+
+def _part_image(part: Any) -> Optional[EncodedImage]:
+    """取出 part 中的图片字节; 只读取文件头确认格式, 不解码像素"""
+    data, mime_type = None, None
+    inline = getattr(part, "inline_data", None)
+    if inline and getattr(inline, "data", None):
+        data, mime_type = inline.data, getattr(inline, "mime_type", None)
+    elif hasattr(part, "as_image"):
+        try:
+            img = part.as_image()
+            data, mime_type = getattr(img, "image_bytes", None), getattr(img, "mime_type", None)
+        except Exception:
+            return None
+    if not data:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            fmt = probe.format
+    except Exception:
+        return None
+    return EncodedImage(data=data, mime_type=Image.MIME.get(fmt) or mime_type or "image/png")
 
 
 @dataclass
@@ -38,45 +100,11 @@ class ProductAnalysis:
     suggested_scene: str
 
 
-class GeminiClient:
-    """Gemini AI 客户端 - Nano Banana 系列"""
-
-    def __init__(self, api_key: str, model: str = "gemini-3-pro-image-preview", max_retries: int = 3):
-        self.api_key = api_key
-        self.model = model
-        self.max_retries = max_retries
-        self.client = genai.Client(api_key=api_key)
-        
-        # 模型能力
-        self.is_pro = "pro" in model.lower()
-        self.supports_4k = self.is_pro
-        self.supports_thinking = self.is_pro
-
-    def _retry(self, func, *args, **kwargs):
-        """带重试的调用"""
-        last_error = None
-        for attempt in range(self.max_retries):
-            try:
-                return func(*args, **kwargs)
-            except Exception as e:
-                last_error = e
-                err = str(e).lower()
-                if any(x in err for x in ["timeout", "rate", "503", "429", "retry"]):
-                    time.sleep((2 ** attempt) + 1)
-                    continue
-                break
-        raise last_error
+ANALYSIS_MODEL = "gemini-2.0-flash-exp"
+# 修改 ANALYSIS_PROMPT 时递增, 使旧的分析缓存失效
+ANALYSIS_PROMPT_VERSION = "v1"
 
-    def analyze_image(self, image: Image.Image) -> ProductAnalysis:
-        """分析产品图片"""
-        buf = io.BytesIO()
-        img = image.copy()
-        if img.width > 1024 or img.height > 1024:
-            img.thumbnail((1024, 1024), Image.Resampling.LANCZOS)
-        img.save(buf, format="PNG", optimize=True)
-        img_data = buf.getvalue()
-        
-        prompt = """Analyze this product image and return JSON only:
+ANALYSIS_PROMPT = """Analyze this product image and return JSON only:
 {
     "product_description": "Brief description",
     "key_features": ["Feature 1", "Feature 2", "Feature 3"],
@@ -85,67 +113,34 @@ class GeminiClient:
     "suggested_scene": "Usage scenario"
 }
 Return ONLY valid JSON."""
-        
-        def call_api():
-            cfg = types.GenerateContentConfig(response_modalities=["TEXT"])
-            return self.client.models.generate_content(
-                model="gemini-2.0-flash-exp",
-                contents=[types.Part.from_bytes(data=img_data, mime_type="image/png"), prompt],
-                config=cfg,
-            )
-        
-        try:
-            resp = self._retry(call_api)
-            text = resp.text.strip() if resp.text else ""
-            for mark in ["```json", "```"]:
-                text = text.replace(mark, "")
-            data = json.loads(text.strip())
-            return ProductAnalysis(
-                product_description=data.get("product_description", "Product"),
-                key_features=data.get("key_features", ["High Quality"])[:5],
-                material_guess=data.get("material_guess", ""),
-                color_scheme=data.get("color_scheme", ""),
-                suggested_scene=data.get("suggested_scene", "home setting"),
-            )
-        except Exception:
-            return ProductAnalysis(
-                product_description="Product",
-                key_features=["High Quality", "Practical Design", "Great Value"],
-                material_guess="",
-                color_scheme="",
-                suggested_scene="home setting",
-            )
 
-    def generate_image(
-        self,
-        reference: Image.Image,
-        prompt: str,
-        negative_prompt: str = "",
-        aspect_ratio: str = "1:1",
-        resolution: str = "1K",
-        style_strength: float = 0.3,
-    ) -> ImageResult:
-        """
-        生成图片
-        
-        Args:
-            reference: 参考图片
-            prompt: 生成提示词
-            negative_prompt: 负向提示词
-            aspect_ratio: 宽高比 (1:1, 4:3, 16:9 等)
-            resolution: 分辨率 (1K, 2K, 4K) - 仅 Pro 支持 2K/4K
-            style_strength: 风格强度
-        """
-        # 压缩参考图
-        buf = io.BytesIO()
-        img = reference.copy()
-        if img.width > 1024 or img.height > 1024:
-            img.thumbnail((1024, 1024), Image.Resampling.LANCZOS)
-        img.save(buf, format="PNG", optimize=True)
-        img_data = buf.getvalue()
-        
-        # 构建完整提示词
-        full_prompt = f"""
+
+def _parse_analysis(resp: Any) -> ProductAnalysis:
+    text = resp.text.strip() if resp.text else ""
+    for mark in ["```json", "```"]:
+        text = text.replace(mark, "")
+    data = json.loads(text.strip())
+    return ProductAnalysis(
+        product_description=data.get("product_description", "Product"),
+        key_features=data.get("key_features", ["High Quality"])[:5],
+        material_guess=data.get("material_guess", ""),
+        color_scheme=data.get("color_scheme", ""),
+        suggested_scene=data.get("suggested_scene", "home setting"),
+    )
+
+
+def _default_analysis() -> ProductAnalysis:
+    return ProductAnalysis(
+        product_description="Product",
+        key_features=["High Quality", "Practical Design", "Great Value"],
+        material_guess="",
+        color_scheme="",
+        suggested_scene="home setting",
+    )
+
+
+def _build_edit_prompt(prompt: str, negative_prompt: str, style_strength: float) -> str:
+    return f"""
 Based on the reference product image, create a new image following these requirements:
 
 CRITICAL RULES:
@@ -161,70 +156,118 @@ MUST AVOID:
 
 Generate a professional, high-quality image of the SAME product with the new styling."""
 
-        # 配置生成参数
+
+def _request_labels(config: Any) -> tuple:
+    """指标标签: (请求类型, 分辨率)"""
+    if "IMAGE" not in (getattr(config, "response_modalities", None) or []):
+        return "analysis", "-"
+    return "generate", getattr(getattr(config, "image_config", None), "image_size", None) or "1K"
+
+
+@contextmanager
+def _observe_call(model: str, config: Any):
+    """单次 API 调用: 追踪 span + 在途数 / 调用次数 / 延迟指标"""
+    kind, resolution = _request_labels(config)
+    outcome = "ok"
+    start = time.monotonic()
+    metrics.API_IN_FLIGHT.inc(model=model)
+    try:
+        with tracing.span("api_call", model=model):
+            yield
+    except Exception as e:
+        outcome = error_label(e)
+        raise
+    finally:
+        metrics.API_IN_FLIGHT.dec(model=model)
+        metrics.API_REQUESTS.inc(model=model, kind=kind, outcome=outcome)
+        metrics.API_LATENCY.observe(time.monotonic() - start, model=model, resolution=resolution)
+
+
+class _BaseGeminiClient:
+    """同步/异步客户端共享部分: 配置构建与响应解析"""
+
+    def __init__(self, api_key: str, model: str = "gemini-3-pro-image-preview", max_retries: Optional[int] = None,
+                 analysis_cache: Any = None, rate_limiter: Any = None, hedger: Any = None,
+                 backend: Any = None, include_thinking: bool = False, keep_raw_response: bool = False):
+        self.api_key = api_key
+        self.model = model
+        self.max_retries = max_retries  # 覆盖重试策略中的最大尝试次数
+        self.include_thinking = include_thinking  # 保留 Thinking 草图 (默认跳过, 不占内存)
+        self.keep_raw_response = keep_raw_response  # 保留完整响应 (含所有内联图片字节), 仅调试时开启
+        if backend is None and Config.FAKE_GEMINI:
+            from fake_gemini import default_backend  # 仅压测 / 演练时加载
+            backend = default_backend(Config.FAKE_GEMINI)
+        if backend is None:
+            # 单次请求超时 (毫秒); 否则挂起的请求不受重试总时长 total_budget 约束
+            backend = genai.Client(api_key=api_key,
+                                   http_options=types.HttpOptions(timeout=Config.API_TIMEOUT * 1000))
+        self.client = backend  # backend: 替换 SDK 客户端
+        self.analysis_cache = analysis_cache  # 可选: AnalysisCache
+        self.rate_limiter = rate_limiter  # 可选: RateLimiter (调用 API 前排队取令牌)
+        self.hedger = hedger  # 可选: Hedger (慢请求发出对冲请求)
+        
+        # 模型能力
+        self.is_pro = "pro" in model.lower()
+        self.supports_4k = self.is_pro
+        self.supports_thinking = self.is_pro
+
+    def _analysis_cache_key(self, ref: PreparedReference) -> Optional[str]:
+        if self.analysis_cache is None:
+            return None
+        return self.analysis_cache.make_key(ref.data, ANALYSIS_MODEL, ANALYSIS_PROMPT_VERSION)
+
+    def _analysis_request(self, ref: PreparedReference) -> dict:
+        return dict(
+            model=ANALYSIS_MODEL,
+            contents=[types.Part.from_bytes(data=ref.data, mime_type=ref.mime_type), ANALYSIS_PROMPT],
+            config=types.GenerateContentConfig(response_modalities=["TEXT"]),
+        )
+
+    def _image_request(self, contents: list, aspect_ratio: str, resolution: str) -> dict:
         image_config_params = {"aspect_ratio": aspect_ratio}
         
         # Pro 模型支持更高分辨率
         if self.is_pro and resolution in ["2K", "4K"]:
             image_config_params["image_size"] = resolution
         
-        def call_api():
-            cfg = types.GenerateContentConfig(
+        return dict(
+            model=self.model,
+            contents=contents,
+            config=types.GenerateContentConfig(
                 response_modalities=["IMAGE", "TEXT"],
                 image_config=types.ImageConfig(**image_config_params),
-            )
-            return self.client.models.generate_content(
-                model=self.model,
-                contents=[types.Part.from_bytes(data=img_data, mime_type="image/png"), full_prompt],
-                config=cfg,
-            )
-        
-        resp = self._retry(call_api)
-        
-        # 提取图片
-        result_img, thinking_imgs = self._extract_images(resp)
-        
-        if result_img is None:
-            raise RuntimeError("模型未返回图片，请检查输入或稍后重试")
-        
-        return ImageResult(image=result_img, raw_response=resp, thinking_images=thinking_imgs)
+            ),
+        )
 
-    def generate_text_to_image(
-        self,
-        prompt: str,
-        aspect_ratio: str = "1:1",
-        resolution: str = "1K",
-    ) -> ImageResult:
-        """
-        纯文本生成图片 (无参考图)
-        """
-        image_config_params = {"aspect_ratio": aspect_ratio}
-        if self.is_pro and resolution in ["2K", "4K"]:
-            image_config_params["image_size"] = resolution
-        
-        def call_api():
-            cfg = types.GenerateContentConfig(
-                response_modalities=["IMAGE", "TEXT"],
-                image_config=types.ImageConfig(**image_config_params),
-            )
-            return self.client.models.generate_content(
-                model=self.model,
-                contents=[prompt],
-                config=cfg,
-            )
-        
-        resp = self._retry(call_api)
-        result_img, thinking_imgs = self._extract_images(resp)
-        
-        if result_img is None:
-            raise RuntimeError("模型未返回图片")
-        
-        return ImageResult(image=result_img, raw_response=resp, thinking_images=thinking_imgs)
+    def _edit_request(self, reference: PreparedReference, prompt: str, negative_prompt: str,
+                      aspect_ratio: str, resolution: str, style_strength: float) -> dict:
+        full_prompt = _build_edit_prompt(prompt, negative_prompt, style_strength)
+        contents = [types.Part.from_bytes(data=reference.data, mime_type=reference.mime_type), full_prompt]
+        return self._image_request(contents, aspect_ratio, resolution)
+
+    def _retry_policy(self, model: str) -> RetryPolicy:
+        return RetryPolicy.for_model(model).with_attempts(self.max_retries)
+
+    def _count_image(self, request: dict, ok: bool, hedged: bool = False):
+        _, resolution = _request_labels(request.get("config"))
+        metrics.IMAGES.inc(model=self.model, resolution=resolution, status="ok" if ok else "failed")
+        if hedged:
+            metrics.HEDGED.inc(model=self.model)
+
+    def _to_result(self, resp: Any, error_msg: str, attempts: int = 1) -> ImageResult:
+        with tracing.span("extract") as attrs:
+            final, thinking = self._extract_images(resp)
+            attrs["thinking"] = len(thinking)
+        if final is None:
+            raise RuntimeError(error_msg)
+        return ImageResult(data=final.data, mime_type=final.mime_type,
+                           raw_response=resp if self.keep_raw_response else None, thinking=thinking,
+                           attempts=attempts, model=self.model)
 
     def _extract_images(self, resp: Any) -> tuple:
         """
-        从响应中提取图片
-        返回: (最终图片, Thinking过程图片列表)
+        从响应中提取图片 (只取编码字节, 不解码像素)
+        返回: (最终图片, Thinking过程图片列表), 均为 EncodedImage; 未开启 include_thinking 时草图列表为空
         """
         final_image = None
         thinking_images = []
@@ -234,21 +277,10 @@ Generate a professional, high-quality image of the SAME product with the new sty
             for part in getattr(resp, "parts", []) or []:
                 # 检查是否是 thinking 阶段的图片
                 is_thought = getattr(part, "thought", False)
+                if is_thought and not self.include_thinking:
+                    continue
                 
-                # 尝试获取图片
-                img = None
-                inline = getattr(part, "inline_data", None)
-                if inline and getattr(inline, "data", None):
-                    try:
-                        img = Image.open(io.BytesIO(inline.data)).convert("RGB")
-                    except Exception:
-                        pass
-                elif hasattr(part, "as_image"):
-                    try:
-                        img = part.as_image().convert("RGB")
-                    except Exception:
-                        pass
-                
+                img = _part_image(part)
                 if img:
                     if is_thought:
                         thinking_images.append(img)
@@ -264,18 +296,181 @@ Generate a professional, high-quality image of the SAME product with the new sty
                         if not content:
                             continue
                         for part in getattr(content, "parts", []) or []:
-                            inline = getattr(part, "inline_data", None)
-                            if inline and getattr(inline, "data", None):
-                                try:
-                                    final_image = Image.open(io.BytesIO(inline.data)).convert("RGB")
-                                except Exception:
-                                    pass
-                            elif hasattr(part, "as_image"):
-                                try:
-                                    final_image = part.as_image().convert("RGB")
-                                except Exception:
-                                    pass
+                            final_image = _part_image(part) or final_image
         except Exception:
             pass
         
         return final_image, thinking_images
+
+
+class GeminiClient(_BaseGeminiClient):
+    """Gemini AI 客户端 - Nano Banana 系列"""
+
+    def _call(self, func, *args, **kwargs):
+        """单次调用 (先取限流令牌)"""
+        model = kwargs.get("model", self.model)
+        with ExitStack() as stack:
+            if self.rate_limiter is not None:
+                with tracing.span("rate_limit_wait", model=model):
+                    stack.enter_context(self.rate_limiter.slot(self.api_key, model))
+            with _observe_call(model, kwargs.get("config")):
+                return func(*args, **kwargs)
+
+    def _retry(self, func, **kwargs):
+        """带重试的调用, 返回 (响应, 尝试次数)"""
+        policy = self._retry_policy(kwargs.get("model", self.model))
+        return call_with_retry(self._call, policy, func, **kwargs)
+
+    def _generate(self, request: dict, error_msg: str) -> ImageResult:
+        """执行生成请求 (Pro 模型开启对冲时, 慢请求会再发一份)"""
+        def call() -> ImageResult:
+            resp, attempts = self._retry(self.client.models.generate_content, **request)
+            return self._to_result(resp, error_msg, attempts)
+        
+        try:
+            if self.hedger is None or not self.hedger.enabled_for(self.model):
+                result = call()
+            else:
+                result, hedged = self.hedger.run(self.api_key, self.model, call)
+                result.hedged = hedged
+        except Exception:
+            self._count_image(request, ok=False)
+            raise
+        self._count_image(request, ok=True, hedged=result.hedged)
+        return result
+
+    def analyze_image(self, image: Union[Image.Image, PreparedReference]) -> ProductAnalysis:
+        """分析产品图片"""
+        try:
+            ref = as_reference(image)
+            cache_key = self._analysis_cache_key(ref)
+            if cache_key:
+                cached = self.analysis_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+            resp, _ = self._retry(self.client.models.generate_content, **self._analysis_request(ref))
+            analysis = _parse_analysis(resp)
+            if cache_key:
+                self.analysis_cache.put(cache_key, analysis)
+            return analysis
+        except Exception:
+            return _default_analysis()
+
+    def generate_image(
+        self,
+        reference: Union[Image.Image, PreparedReference],
+        prompt: str,
+        negative_prompt: str = "",
+        aspect_ratio: str = "1:1",
+        resolution: str = "1K",
+        style_strength: float = 0.3,
+    ) -> ImageResult:
+        """
+        生成图片
+        
+        Args:
+            reference: 参考图片 (批量调用时传入 PreparedReference, 避免重复编码)
+            prompt: 生成提示词
+            negative_prompt: 负向提示词
+            aspect_ratio: 宽高比 (1:1, 4:3, 16:9 等)
+            resolution: 分辨率 (1K, 2K, 4K) - 仅 Pro 支持 2K/4K
+            style_strength: 风格强度
+        """
+        ref = as_reference(reference)
+        request = self._edit_request(ref, prompt, negative_prompt, aspect_ratio, resolution, style_strength)
+        return self._generate(request, "模型未返回图片，请检查输入或稍后重试")
+
+    def generate_text_to_image(
+        self,
+        prompt: str,
+        aspect_ratio: str = "1:1",
+        resolution: str = "1K",
+    ) -> ImageResult:
+        """
+        纯文本生成图片 (无参考图)
+        """
+        request = self._image_request([prompt], aspect_ratio, resolution)
+        return self._generate(request, "模型未返回图片")
+
+
+class AsyncGeminiClient(_BaseGeminiClient):
+    """
+    Gemini AI 异步客户端 - 接口与 GeminiClient 一致, 方法均为协程
+    
+    基于 SDK 的 client.aio, 单个事件循环即可同时保持大量在途请求。
+    """
+
+    async def _call(self, func, *args, **kwargs):
+        """单次调用 (先取限流令牌)"""
+        model = kwargs.get("model", self.model)
+        async with AsyncExitStack() as stack:
+            if self.rate_limiter is not None:
+                with tracing.span("rate_limit_wait", model=model):
+                    await stack.enter_async_context(self.rate_limiter.aslot(self.api_key, model))
+            with _observe_call(model, kwargs.get("config")):
+                return await func(*args, **kwargs)
+
+    async def _retry(self, func, **kwargs):
+        """带重试的异步调用, 返回 (响应, 尝试次数)"""
+        policy = self._retry_policy(kwargs.get("model", self.model))
+        return await acall_with_retry(self._call, policy, func, **kwargs)
+
+    async def _generate(self, request: dict, error_msg: str) -> ImageResult:
+        """执行生成请求 (开启对冲时, 输掉的请求会被取消)"""
+        async def call() -> ImageResult:
+            resp, attempts = await self._retry(self.client.aio.models.generate_content, **request)
+            # 图片解码是 CPU 密集操作, 放到线程里避免阻塞事件循环
+            return await asyncio.to_thread(self._to_result, resp, error_msg, attempts)
+        
+        try:
+            if self.hedger is None or not self.hedger.enabled_for(self.model):
+                result = await call()
+            else:
+                result, hedged = await self.hedger.arun(self.api_key, self.model, call)
+                result.hedged = hedged
+        except Exception:
+            self._count_image(request, ok=False)
+            raise
+        self._count_image(request, ok=True, hedged=result.hedged)
+        return result
+
+    async def analyze_image(self, image: Union[Image.Image, PreparedReference]) -> ProductAnalysis:
+        """分析产品图片"""
+        try:
+            ref = await asyncio.to_thread(as_reference, image)
+            cache_key = self._analysis_cache_key(ref)
+            if cache_key:
+                cached = await asyncio.to_thread(self.analysis_cache.get, cache_key)
+                if cached is not None:
+                    return cached
+            resp, _ = await self._retry(self.client.aio.models.generate_content, **self._analysis_request(ref))
+            analysis = _parse_analysis(resp)
+            if cache_key:
+                await asyncio.to_thread(self.analysis_cache.put, cache_key, analysis)
+            return analysis
+        except Exception:
+            return _default_analysis()
+
+    async def generate_image(
+        self,
+        reference: Union[Image.Image, PreparedReference],
+        prompt: str,
+        negative_prompt: str = "",
+        aspect_ratio: str = "1:1",
+        resolution: str = "1K",
+        style_strength: float = 0.3,
+    ) -> ImageResult:
+        """生成图片 (参数同 GeminiClient.generate_image)"""
+        ref = await asyncio.to_thread(as_reference, reference)
+        request = self._edit_request(ref, prompt, negative_prompt, aspect_ratio, resolution, style_strength)
+        return await self._generate(request, "模型未返回图片，请检查输入或稍后重试")
+
+    async def generate_text_to_image(
+        self,
+        prompt: str,
+        aspect_ratio: str = "1:1",
+        resolution: str = "1K",
+    ) -> ImageResult:
+        """纯文本生成图片 (无参考图)"""
+        request = self._image_request([prompt], aspect_ratio, resolution)
+        return await self._generate(request, "模型未返回图片")
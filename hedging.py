@@ -0,0 +1,157 @@
+"""
+TEMU 智能出图系统 V8.0
+对冲请求 (Hedged Requests) - 压低长尾延迟
+核心作者: 企鹅
+
+请求超过该模型近期延迟的某个分位数仍未返回时, 再发一个相同的请求,
+先返回的结果胜出, 另一个被取消 (异步) 或忽略 (同步, 无法中断)。
+每个 API Key 同时在途的对冲请求数有上限, 防止把额度翻倍。
+"""
+import asyncio
+import hashlib
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+import tracing
+from config import Config
+
+
+class LatencyTracker:
+    """按模型统计最近 N 次成功调用的延迟"""
+
+    def __init__(self, window: Optional[int] = None, min_samples: Optional[int] = None):
+        self.window = window or Config.HEDGE_WINDOW
+        self.min_samples = min_samples if min_samples is not None else Config.HEDGE_MIN_SAMPLES
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def record(self, model: str, seconds: float):
+        with self._lock:
+            self._samples[model].append(seconds)
+
+    def percentile(self, model: str, q: float) -> Optional[float]:
+        """样本不足时返回 None"""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        idx = min(len(samples) - 1, int(q * len(samples)))
+        return samples[idx]
+
+
+class HedgeBudget:
+    """每个 API Key 同时在途的对冲请求上限"""
+
+    def __init__(self, max_inflight: Optional[int] = None):
+        self.max_inflight = max_inflight if max_inflight is not None else Config.HEDGE_MAX_INFLIGHT
+        self._inflight: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+    def try_acquire(self, api_key: str) -> bool:
+        key = self._key(api_key)
+        with self._lock:
+            if self._inflight[key] >= self.max_inflight:
+                return False
+            self._inflight[key] += 1
+            return True
+
+    def release(self, api_key: str):
+        key = self._key(api_key)
+        with self._lock:
+            self._inflight[key] = max(0, self._inflight[key] - 1)
+
+
+class Hedger:
+    """对冲执行器 (进程内单例, 由各客户端共享)"""
+
+    def __init__(self, latency: Optional[LatencyTracker] = None, budget: Optional[HedgeBudget] = None,
+                 percentile: Optional[float] = None):
+        self.latency = latency or LatencyTracker()
+        self.budget = budget or HedgeBudget()
+        self.percentile = percentile if percentile is not None else Config.HEDGE_PERCENTILE
+        self._pool = ThreadPoolExecutor(max_workers=Config.HEDGE_POOL_SIZE, thread_name_prefix="hedge")
+
+    @staticmethod
+    def enabled_for(model: str) -> bool:
+        return Config.HEDGE_ENABLED and Config.MODEL_CAPABILITIES.get(model, {}).get("hedge", False)
+
+    def _timed(self, model: str, func: Callable[[], Any]) -> Any:
+        start = time.monotonic()
+        result = func()
+        self.latency.record(model, time.monotonic() - start)  # 输掉的请求也记录, 反映真实长尾
+        return result
+
+    def run(self, api_key: str, model: str, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        同步执行, 必要时发出对冲请求
+
+        Returns:
+            (结果, 是否发出了对冲请求)
+        """
+        threshold = self.latency.percentile(model, self.percentile)
+        if threshold is None:
+            return self._timed(model, func), False
+
+        primary = self._pool.submit(tracing.propagate(self._timed), model, func)
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self.budget.try_acquire(api_key):
+            return primary.result(), False
+
+        hedge = self._pool.submit(tracing.propagate(self._timed), model, func)
+        hedge.add_done_callback(lambda _: self.budget.release(api_key))
+        return self._first_success([primary, hedge]), True
+
+    @staticmethod
+    def _first_success(futures: "list[Future]") -> Any:
+        pending = set(futures)
+        last_error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    for other in pending:
+                        other.cancel()  # 已开始执行的同步请求无法中断, 结果将被忽略
+                    return fut.result()
+                last_error = fut.exception()
+        raise last_error
+
+    async def arun(self, api_key: str, model: str,
+                   func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """异步版本: 输掉的请求会被真正取消"""
+        async def timed():
+            start = time.monotonic()
+            result = await func()
+            self.latency.record(model, time.monotonic() - start)
+            return result
+
+        threshold = self.latency.percentile(model, self.percentile)
+        if threshold is None:
+            return await timed(), False
+
+        primary = asyncio.ensure_future(timed())
+        done, _ = await asyncio.wait({primary}, timeout=threshold)
+        if done or not self.budget.try_acquire(api_key):
+            return await primary, False
+
+        hedge = asyncio.ensure_future(timed())
+        try:
+            pending = {primary, hedge}
+            last_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        for other in pending:
+                            other.cancel()
+                        return task.result(), True
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            self.budget.release(api_key)
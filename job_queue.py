@@ -0,0 +1,387 @@
+"""
+TEMU 智能出图系统 V8.0
+后台生成任务队列
+核心作者: 企鹅
+
+生成任务提交到进程内的后台线程池执行, 与 Streamlit 脚本的执行解耦:
+控件交互、刷新页面、断开 websocket 都不会中断或重复已提交的任务。
+任务状态以 JSON 持久化在 <数据目录>/jobs/ 下, 页面轮询读取;
+进程重启后未完成的任务 (使用团队共享 Key 的) 会从断点继续。
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+import tracing
+from analytics import GenerationRecord
+from config import Config
+from gemini_client import GeminiClient
+from model_router import RoutedClient
+from pipeline import BatchSpec, build_tasks, build_variables, clean_inputs, run_tasks
+from reference import PreparedReference
+from result_store import ResultHandle, ResultStore, ZipExport
+
+# 任务状态
+QUEUED = "queued"
+ANALYZING = "analyzing"
+GENERATING = "generating"
+DONE = "done"
+FAILED = "failed"
+
+FINISHED_STATES = (DONE, FAILED)
+
+
+@dataclass
+class Job:
+    """生成任务 (可 JSON 序列化)"""
+    job_id: str
+    user_id: str
+    params: Dict[str, Any]
+    own_key: bool = False
+    status: str = QUEUED
+    message: str = ""
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    batch_id: str = ""
+    analysis: Optional[Dict[str, Any]] = None
+    items: List[Dict[str, Any]] = field(default_factory=list)  # 每张图: label / filename / size / status / error / attempts / model
+    charged: int = 0  # 已计入配额的张数
+    reservation: str = ""  # 预留额度 ID (团队 Key)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    @property
+    def total(self) -> int:
+        return len(self.items)
+
+    @property
+    def done_count(self) -> int:
+        return sum(1 for it in self.items if it["status"] in ("done", "failed"))
+
+    @property
+    def success_count(self) -> int:
+        return sum(1 for it in self.items if it["status"] == "done")
+
+    def handle(self, item: Dict[str, Any]) -> ResultHandle:
+        return ResultHandle(self.batch_id, item["filename"], item.get("size", 0))
+
+    def handles(self) -> List[ResultHandle]:
+        return [self.handle(it) for it in self.items if it["status"] == "done"]
+
+    def fallback_items(self) -> List[Dict[str, Any]]:
+        """由备用模型生成的图片"""
+        return [it for it in self.items
+                if it["status"] == "done" and it.get("model") and it["model"] != self.params["model_id"]]
+
+    def errors(self) -> List[str]:
+        return [f"{it['label']}: {it['error']}" for it in self.items if it["status"] == "failed"]
+
+
+class JobManager:
+    """进程内任务队列 (由 st.cache_resource 持有单例)"""
+
+    def __init__(self, tracker, store: ResultStore, analysis_cache=None, rate_limiter=None, hedger=None,
+                 router=None, analytics=None, max_workers: Optional[int] = None,
+                 client_factory: Optional[Callable[[str, str], Any]] = None, jobs_dir: Optional[Path] = None):
+        Config.ensure_data_dir()
+        self.tracker = tracker
+        self.store = store
+        self.analysis_cache = analysis_cache
+        self.rate_limiter = rate_limiter
+        self.hedger = hedger
+        self.router = router
+        self.analytics = analytics
+        self.client_factory = client_factory or self._default_client
+        # 每个服务进程使用独立的任务目录, 避免重启时重复续跑同一任务
+        self.jobs_dir = Path(jobs_dir) if jobs_dir else Config._data_dir / "jobs"
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.traces_dir = self.jobs_dir / "traces"
+        self.traces_dir.mkdir(exist_ok=True)
+        self._profile_next = False
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or Config.JOB_WORKERS,
+                                        thread_name_prefix="job")
+        self._lock = threading.RLock()
+        self._jobs: Dict[str, Job] = {}
+        self._export_lock = threading.Lock()
+        metrics.JOBS.set_function(self._queue_depth)
+        self._recover()
+
+    def _default_client(self, api_key: str, model: str):
+        def make(m: str):
+            return GeminiClient(api_key, m, analysis_cache=self.analysis_cache,
+                                rate_limiter=self.rate_limiter, hedger=self.hedger)
+        if self.router is not None:
+            return RoutedClient(self.router, make, model)
+        return make(model)
+
+    # ==================== 持久化 ====================
+    def _path(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.json"
+
+    def _save(self, job: Job):
+        path = self._path(job.job_id)
+        tmp = path.with_name(f".{path.name}.tmp")
+        with self._lock:
+            job.updated_at = time.time()
+            tmp.write_text(json.dumps(asdict(job), ensure_ascii=False))
+            os.replace(tmp, path)
+
+    def _update(self, job: Job, **changes):
+        with self._lock:
+            for k, v in changes.items():
+                setattr(job, k, v)
+        self._save(job)
+
+    def _recover(self):
+        """进程重启后恢复未完成的任务"""
+        for path in self.jobs_dir.glob("*.json"):
+            try:
+                job = Job(**json.loads(path.read_text()))
+            except Exception:
+                continue
+            if job.finished:
+                continue
+            self._jobs[job.job_id] = job
+            api_key = Config.get_api_key()
+            if job.own_key or not api_key:
+                # 个人 Key 不落盘, 无法续跑
+                self._update(job, status=FAILED, message="服务重启, 任务已中断, 请重新提交")
+                self._settle(job)
+                continue
+            self._pool.submit(self._execute, job.job_id, api_key)
+
+    # ==================== 接口 ====================
+    def submit(self, user_id: str, api_key: str, params: Dict[str, Any], own_key: bool = False) -> str:
+        """
+        提交任务, 立即返回任务 ID
+        
+        Raises:
+            QuotaExceeded: 使用团队 Key 且剩余额度不足以预留整批
+        """
+        job = Job(
+            job_id=uuid.uuid4().hex[:16],
+            user_id=user_id,
+            params=params,
+            own_key=own_key,
+            batch_id=self.store.new_batch_id(),
+        )
+        job.items = [
+            {"label": t.label, "filename": t.filename, "status": "pending", "error": "", "attempts": 0}
+            for t in build_tasks(params["selected"], params["counts"], params.get("custom_prompts"))
+        ]
+        if not own_key and self.tracker is not None:
+            # 先整批预留, 结束时按成功张数结算
+            job.reservation = self.tracker.reserve(user_id, job.total)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        self._save(job)
+        self._pool.submit(self._execute, job.job_id, api_key)
+        return job.job_id
+
+    def _queue_depth(self) -> Dict[tuple, int]:
+        """未完成任务数 (按状态), 供指标抓取"""
+        depth = {(status,): 0 for status in (QUEUED, ANALYZING, GENERATING)}
+        with self._lock:
+            for job in self._jobs.values():
+                if not job.finished:
+                    depth[(job.status,)] = depth.get((job.status,), 0) + 1
+        return depth
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        try:
+            return Job(**json.loads(self._path(job_id).read_text()))
+        except Exception:
+            return None
+
+    def export_path(self, job_id: str) -> Optional[Path]:
+        """
+        下载用 ZIP 的路径 (调用方按块读取, 不整体载入内存)
+
+        任务结束时已生成; 缺失时 (如过期前被删除) 按任务顺序从磁盘结果重建。
+        """
+        job = self.get(job_id)
+        if job is None or not job.finished or not job.success_count:
+            return None
+        path = self.store.export_path(job.batch_id)
+        if not path.exists():
+            self._build_export(job)
+        return path
+
+    def _build_export(self, job: Job, readme: str = "") -> Path:
+        """按任务顺序 (而非完成顺序) 打包已完成的图片"""
+        with self._export_lock:
+            export = ZipExport(self.store.export_path(job.batch_id))
+            try:
+                for h in job.handles():
+                    if self.store.exists(h):
+                        export.add_file(self.store.path(h), h.filename)
+                if readme:
+                    export.add_text("README.txt", readme)
+                return export.finish()
+            finally:
+                export.close()
+
+    # ==================== 追踪 ====================
+    def profile_next(self):
+        """下一个开始执行的任务采集 cProfile (管理员按需开启)"""
+        self._profile_next = True
+
+    def trace(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads((self.traces_dir / f"{job_id}.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def profile_path(self, job_id: str) -> Optional[Path]:
+        path = self.traces_dir / f"{job_id}.prof"
+        return path if path.exists() else None
+
+    def _save_trace(self, trace: tracing.Trace):
+        try:
+            trace.save(self.traces_dir / f"{trace.trace_id}.json")
+            if trace.profile:
+                trace.save_profile(self.traces_dir / f"{trace.trace_id}.prof")
+        except OSError:
+            pass  # 追踪失败不影响任务
+
+    def gc(self):
+        """清理过期任务记录 (与结果保留时长一致)"""
+        cutoff = time.time() - Config.RESULT_TTL_HOURS * 3600
+        for path in self.traces_dir.iterdir():
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                continue
+        for path in self.jobs_dir.glob("*.json"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    job_id = path.stem
+                    path.unlink()
+                    with self._lock:
+                        self._jobs.pop(job_id, None)
+            except FileNotFoundError:
+                continue
+
+    # ==================== 执行 ====================
+    def _execute(self, job_id: str, api_key: str):
+        job = self._jobs[job_id]
+        profile, self._profile_next = self._profile_next, False
+        trace = tracing.Trace("job", job_id, profile=profile) if Config.TRACE_ENABLED or profile else None
+        try:
+            with tracing.activate(trace, "job", model=job.params["model_id"], images=job.total) if trace \
+                    else nullcontext():
+                self._run(job, api_key)
+        finally:
+            metrics.JOBS_FINISHED.inc(status=job.status)
+            if trace is not None:
+                self._save_trace(trace)
+            self.store.gc()
+            self.gc()
+
+    def _run(self, job: Job, api_key: str):
+        job_id = job.job_id
+        params = job.params
+        try:
+            inputs = clean_inputs(params)
+            upload_path = self.store.upload_path(params["upload_keys"][0])
+            if not upload_path.exists():
+                raise RuntimeError("原图已过期，请重新上传后生成")
+            # 参考图只解码/缩放/编码一次, 分析与所有生成请求共用
+            with tracing.span("reference_encode"):
+                reference = PreparedReference.from_file(upload_path)
+            client = self.client_factory(api_key, params["model_id"])
+
+            self._update(job, status=ANALYZING)
+            try:
+                with tracing.span("analysis"):
+                    analysis = client.analyze_image(reference)
+                self._update(job, analysis=asdict(analysis), status=GENERATING)
+            except Exception:
+                analysis = None
+                self._update(job, status=GENERATING, message="分析失败，使用默认参数")
+
+            tasks = build_tasks(params["selected"], params["counts"], params.get("custom_prompts"))
+            pending = []
+            for t in tasks:
+                item = job.items[t.index]
+                if not (item["status"] == "done" and self.store.exists(job.handle(item))):
+                    pending.append(t)  # 重启续跑时跳过已完成的图片
+
+            spec = BatchSpec(
+                reference=reference,
+                negative_prompt=inputs.negative_prompt,
+                aspect_ratio=params["aspect_ratio"],
+                resolution=params["resolution"],
+                style_strength=params["strength"],
+                variables=build_variables(params, inputs, analysis),
+            )
+
+            def on_done(outcome, done, total):
+                item = job.items[outcome.task.index]
+                if outcome.ok:
+                    with self._lock:
+                        item.update(status="done", error="", attempts=outcome.attempts, model=outcome.model,
+                                    filename=outcome.filename,  # 扩展名随模型返回的格式
+                                    size=outcome.handle.size)
+                else:
+                    with self._lock:
+                        item.update(status="failed", error=str(outcome.error)[:200], attempts=outcome.attempts)
+                self._save(job)
+                self._record(outcome, params)
+
+            run_tasks(client, pending, spec, max_workers=Config.MAX_CONCURRENCY, on_done=on_done,
+                      store=self.store, batch_id=job.batch_id)
+
+            self._settle(job)
+            if job.success_count:
+                # 图片 ZIP_STORED 直接拷贝, 最后按任务顺序打包一次即可
+                with tracing.span("zip_build", files=job.success_count):
+                    self._build_export(job, f"TEMU智能出图 V8.0\n作者:{Config.APP_AUTHOR}\n日期:{date.today()}\n商品:{inputs.product_name}\n数量:{job.success_count}张\n模型:{params['model_id']}\n分辨率:{params['resolution']}")
+            self._update(job, status=DONE if job.success_count else FAILED,
+                         message=job.message if job.success_count else "全部生成失败")
+        except Exception as e:
+            self._update(job, status=FAILED, message=str(e)[:200])
+            self._settle(job)
+
+    def _record(self, outcome, params: Dict[str, Any]):
+        if self.analytics is None:
+            return
+        try:
+            self.analytics.record(GenerationRecord(
+                model=outcome.model or params["model_id"],
+                resolution=outcome.resolution or params["resolution"],  # 降级时为备用模型的分辨率
+                aspect_ratio=params["aspect_ratio"],
+                template=outcome.task.template_id,
+                latency=outcome.latency,
+                retries=max(0, outcome.attempts - 1),
+                bytes=outcome.size,
+                success=outcome.ok,
+            ))
+        except Exception:
+            pass  # 统计失败不影响生成
+
+    def _settle(self, job: Job):
+        """按成功张数结算预留额度, 其余退回 (重启续跑时只补差额)"""
+        delta = job.success_count - job.charged
+        if not job.own_key and self.tracker is not None:
+            if job.reservation:
+                self.tracker.commit(job.reservation, delta, user_id=job.user_id)
+            elif delta > 0:
+                self.tracker.add_usage(job.user_id, delta)
+        self._update(job, charged=job.success_count, reservation="")
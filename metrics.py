@@ -0,0 +1,284 @@
+"""
+TEMU 智能出图系统 V8.0
+运行指标 (Prometheus 文本格式)
+核心作者: 企鹅
+
+进程内指标注册表, 由 GeminiClient / UsageTracker / JobManager 直接更新,
+在独立端口 (Config.METRICS_PORT) 以 Prometheus 文本格式暴露:
+    GET /metrics
+
+不依赖 prometheus_client; 每个进程 (网页端 / 任务接口) 各自暴露自己的指标。
+"""
+import os
+import resource
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from analytics import LATENCY_BUCKETS
+from config import Config
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: 标签应为 {self.labelnames}, 实际为 {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增计数"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Counter 只能增加")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """当前值; 可用 set_function 在抓取时计算"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], Union[float, Dict[LabelValues, float]]]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, func: Callable[[], Union[float, Dict[LabelValues, float]]]):
+        """
+        抓取时调用 func 取值
+
+        无标签时返回数值; 有标签时返回 {标签值元组: 数值}
+        """
+        self._function = func
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                return []  # 取值失败时本次不输出, 不影响其他指标
+            items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    """分桶统计"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    counts[i] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v), self._sums[k]) for k, v in self._counts.items())
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for upper, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_format_value(upper)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标重复注册: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# ==================== 指标定义 ====================
+# Gemini API (GeminiClient)
+API_REQUESTS = counter("temu_api_requests_total", "Gemini API 调用次数 (每次尝试)", ["model", "kind", "outcome"])
+API_IN_FLIGHT = gauge("temu_api_in_flight", "在途的 Gemini API 调用", ["model"])
+API_LATENCY = histogram("temu_api_latency_seconds", "单次 Gemini API 调用耗时", ["model", "resolution"])
+API_RETRIES = counter("temu_api_retries_total", "重试次数 (按触发重试的错误)", ["model", "reason"])
+IMAGES = counter("temu_images_total", "生成图片数 (含重试后的最终结果)", ["model", "resolution", "status"])
+HEDGED = counter("temu_hedged_requests_total", "发出对冲请求的生成次数", ["model"])
+
+# 额度 (UsageTracker)
+QUOTA_CONSUMED = counter("temu_quota_consumed_total", "计入每日额度的图片数")
+QUOTA_RESERVATIONS = counter("temu_quota_reservations_total", "额度预留次数", ["outcome"])
+QUOTA_USED_TODAY = gauge("temu_quota_used_today", "今日已用额度 (所有用户)")
+QUOTA_RESERVED_TODAY = gauge("temu_quota_reserved_today", "今日未结算的预留额度")
+QUOTA_USERS_TODAY = gauge("temu_quota_users_today", "今日有用量的用户数")
+
+# 任务队列 (JobManager)
+JOBS = gauge("temu_jobs", "未完成的后台任务数", ["status"])
+JOBS_FINISHED = counter("temu_jobs_finished_total", "已结束的后台任务数", ["status"])
+
+# 进程
+_START_TIME = time.time()
+PROCESS_RSS = gauge("process_resident_memory_bytes", "常驻内存 (字节)")
+PROCESS_MAX_RSS = gauge("process_max_resident_memory_bytes", "峰值常驻内存 (字节)")
+PROCESS_CPU = gauge("process_cpu_seconds_total", "进程 CPU 时间 (秒)")
+PROCESS_THREADS = gauge("process_threads", "线程数")
+PROCESS_START = gauge("process_start_time_seconds", "进程启动时间 (Unix 时间戳)")
+
+
+def _rss() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return _max_rss()
+
+
+def _max_rss() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux 单位为 KB
+
+
+PROCESS_RSS.set_function(_rss)
+PROCESS_MAX_RSS.set_function(_max_rss)
+PROCESS_CPU.set_function(time.process_time)
+PROCESS_THREADS.set_function(threading.active_count)
+PROCESS_START.set_function(lambda: _START_TIME)
+
+
+# ==================== HTTP ====================
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_server(port: Optional[int] = None, host: str = "0.0.0.0") -> Optional[ThreadingHTTPServer]:
+    """
+    在后台线程启动 /metrics (每个进程只启动一次)
+
+    端口被占用时返回 None, 不影响主服务。
+    """
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port if port is not None else Config.METRICS_PORT), MetricsHandler)
+        except OSError:
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server
@@ -0,0 +1,168 @@
+"""
+TEMU 智能出图系统 V8.0
+模型路由 - 基于延迟 SLO 的自动降级与恢复
+核心作者: 企鹅
+
+按模型统计滚动窗口内的延迟与错误率。主模型 (Pro) 超出
+MODEL_CAPABILITIES[model]["slo"] 时, 新请求改发到备用模型 (1K),
+期间每隔 SLO_PROBE_INTERVAL 放一个探测请求到主模型,
+连续 SLO_RECOVERY_PROBES 次达标后自动切回。
+每个结果都会标记实际生成它的模型。
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from config import Config
+from gemini_client import ImageResult
+from retry_policy import RetryError, classify, RetryPolicy
+
+
+def _is_overload(e: Exception) -> bool:
+    """只把限流/超时/服务端错误计入错误率, 提示词被拒等不算"""
+    err = e.last_error if isinstance(e, RetryError) else e
+    retryable, _ = classify(err, RetryPolicy())
+    return retryable
+
+
+class ModelHealth:
+    """每个模型最近一段时间的延迟与成败"""
+
+    def __init__(self, window_seconds: Optional[float] = None):
+        self.window_seconds = window_seconds or Config.SLO_WINDOW_SECONDS
+        self._events: Dict[str, Deque[Tuple[float, float, bool]]] = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def record(self, model: str, latency: float, ok: bool):
+        now = time.time()
+        with self._lock:
+            events = self._events[model]
+            events.append((now, latency, ok))
+            while events and events[0][0] < now - self.window_seconds:
+                events.popleft()
+
+    def reset(self, model: str):
+        """清空模型的窗口 (恢复后不再用降级前的样本判断)"""
+        with self._lock:
+            self._events.pop(model, None)
+
+    def stats(self, model: str) -> Dict[str, float]:
+        now = time.time()
+        with self._lock:
+            events = [e for e in self._events.get(model, ()) if e[0] >= now - self.window_seconds]
+        latencies = sorted(lat for _, lat, ok in events if ok)
+        errors = sum(1 for _, _, ok in events if not ok)
+        return {
+            "samples": len(events),
+            "p95_latency": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else 0.0,
+            "error_rate": errors / len(events) if events else 0.0,
+        }
+
+
+class ModelRouter:
+    """降级状态机 (进程内单例)"""
+
+    def __init__(self, health: Optional[ModelHealth] = None):
+        self.health = health or ModelHealth()
+        self._lock = threading.Lock()
+        self._degraded: Dict[str, bool] = defaultdict(bool)
+        self._last_probe: Dict[str, float] = defaultdict(float)
+        self._good_probes: Dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def slo(model: str) -> Optional[Dict[str, Any]]:
+        return Config.MODEL_CAPABILITIES.get(model, {}).get("slo")
+
+    def is_degraded(self, model: str) -> bool:
+        return self._degraded[model]
+
+    def choose(self, model: str, resolution: str) -> Tuple[str, str, bool]:
+        """
+        选择本次请求实际使用的模型
+
+        Returns:
+            (模型, 分辨率, 是否为探测请求)
+        """
+        slo = self.slo(model)
+        if not slo:
+            return model, resolution, False
+        with self._lock:
+            if not self._degraded[model]:
+                return model, resolution, False
+            now = time.time()
+            if now - self._last_probe[model] >= Config.SLO_PROBE_INTERVAL:
+                self._last_probe[model] = now
+                return model, resolution, True
+        return slo["fallback"], slo.get("fallback_resolution", "1K"), False
+
+    def observe(self, model: str, latency: float, ok: bool, probe: bool = False):
+        self.health.record(model, latency, ok)
+        slo = self.slo(model)
+        if not slo:
+            return
+        with self._lock:
+            if self._degraded[model]:
+                if not probe:
+                    return
+                if ok and latency <= slo["p95_latency"]:
+                    self._good_probes[model] += 1
+                    if self._good_probes[model] >= Config.SLO_RECOVERY_PROBES:
+                        self._degraded[model] = False
+                        self._good_probes[model] = 0
+                        self.health.reset(model)  # 否则下一次请求仍读到导致降级的样本, 立即再次降级
+                else:
+                    self._good_probes[model] = 0
+                return
+            stats = self.health.stats(model)
+            if stats["samples"] < Config.SLO_MIN_SAMPLES:
+                return
+            if stats["p95_latency"] > slo["p95_latency"] or stats["error_rate"] > slo["max_error_rate"]:
+                self._degraded[model] = True
+                self._last_probe[model] = time.time()
+                self._good_probes[model] = 0
+
+
+class RoutedClient:
+    """
+    GeminiClient 的路由包装, 接口相同
+
+    client_factory(model) 返回该模型的 GeminiClient。
+    """
+
+    def __init__(self, router: ModelRouter, client_factory: Callable[[str], Any], model: str):
+        self.router = router
+        self.model = model
+        self._factory = client_factory
+        self._clients: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _client(self, model: str):
+        with self._lock:
+            if model not in self._clients:
+                self._clients[model] = self._factory(model)
+            return self._clients[model]
+
+    def analyze_image(self, image):
+        return self._client(self.model).analyze_image(image)
+
+    def generate_image(self, reference, prompt: str, negative_prompt: str = "", aspect_ratio: str = "1:1",
+                       resolution: str = "1K", style_strength: float = 0.3) -> ImageResult:
+        model, resolution, probe = self.router.choose(self.model, resolution)
+        start = time.monotonic()
+        try:
+            result = self._client(model).generate_image(
+                reference=reference,
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                aspect_ratio=aspect_ratio,
+                resolution=resolution,
+                style_strength=style_strength,
+            )
+        except Exception as e:
+            if _is_overload(e):
+                self.router.observe(model, time.monotonic() - start, False, probe)
+            raise
+        self.router.observe(model, time.monotonic() - start, True, probe)
+        result.resolution = resolution
+        return result
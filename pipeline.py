@@ -0,0 +1,306 @@
+"""
+TEMU 智能出图系统 V8.0
+批量生成引擎 - 有界并发
+核心作者: 企鹅
+
+把 (模板, 序号) 展开为独立任务, 用线程池并发调用模型,
+按完成顺序回调进度, 最终结果按任务顺序返回。
+"""
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import tracing
+from config import Config
+from gemini_client import ProductAnalysis
+from prompts import PROMPT_TEMPLATES, TEMPLATE_INFO, get_template_prompt
+from result_store import ResultHandle, ResultStore
+from rules import build_negative_prompt, get_rules
+
+# 模型输出格式 -> 文件扩展名 (结果原样落盘, 不重新编码)
+IMAGE_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp", "image/gif": ".gif"}
+
+
+def image_extension(mime_type: str) -> str:
+    return IMAGE_EXTENSIONS.get((mime_type or "").lower(), ".png")
+
+
+@dataclass
+class GenerationTask:
+    """单张图片生成任务"""
+    index: int              # 在批次中的顺序
+    template_id: str
+    template_name: str
+    seq: int                # 该模板下的第几张 (从 1 开始)
+    count: int              # 该模板的总张数
+    prompt_template: str
+
+    @property
+    def label(self) -> str:
+        return f"{self.template_name}-{self.seq}"
+
+    @property
+    def stem(self) -> str:
+        return f"{self.template_id}_{self.template_name}_{self.seq}"
+
+    @property
+    def filename(self) -> str:
+        """生成前的预期文件名; 实际扩展名随模型返回的格式, 见 filename_for"""
+        return self.filename_for("image/png")
+
+    def filename_for(self, mime_type: str) -> str:
+        return self.stem + image_extension(mime_type)
+
+
+@dataclass
+class BatchSpec:
+    """一个批次内所有任务共享的生成参数"""
+    reference: Any
+    negative_prompt: str
+    aspect_ratio: str
+    resolution: str
+    style_strength: float
+    variables: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class TaskOutcome:
+    """任务结果"""
+    task: GenerationTask
+    filename: str = ""
+    data: Optional[bytes] = None  # 模型返回的原始编码字节
+    mime_type: str = ""
+    handle: Optional[ResultHandle] = None  # 写入 ResultStore 后只保留句柄
+    error: Optional[Exception] = None
+    attempts: int = 0  # 实际请求次数 (含重试)
+    model: str = ""  # 实际生成的模型 (降级时与请求的模型不同)
+    resolution: str = ""  # 实际生成的分辨率 (降级时为备用模型的分辨率)
+    latency: float = 0.0  # 生成耗时 (秒, 含重试)
+    size: int = 0  # 输出字节数
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and (self.data is not None or self.handle is not None)
+
+
+@dataclass
+class CleanInputs:
+    """经规则清洗后的商品信息"""
+    product_name: str
+    material: str
+    negative_prompt: str
+
+
+def clean_inputs(params: Dict[str, Any]) -> CleanInputs:
+    """
+    按规则清洗商品名称/材质并构建负向提示词
+
+    Raises:
+        ValueError: 命中绝对禁用规则
+    """
+    rules = get_rules()
+    clean_name, _ = rules.apply_replacements(params["product_name"])
+    clean_material, _ = rules.apply_replacements(params.get("material", ""))
+    
+    if rules.is_banned(f"{clean_name} {clean_material}"):
+        raise ValueError("检测到禁用内容")
+    
+    final_excludes = list(params.get("excludes", []))
+    extra = params.get("extra", "")
+    if extra.strip():
+        final_excludes.extend([x.strip() for x in extra.split(",") if x.strip()])
+    return CleanInputs(clean_name, clean_material, build_negative_prompt(final_excludes))
+
+
+def build_variables(params: Dict[str, Any], inputs: CleanInputs,
+                    analysis: Optional[ProductAnalysis]) -> Dict[str, str]:
+    """组合提示词模板变量 (analysis 为空时使用默认值)"""
+    if analysis is not None:
+        final_material = inputs.material or analysis.material_guess
+        selling_points = "\n".join([f"- {p}" for p in analysis.key_features])
+        scene = analysis.suggested_scene or "home setting"
+    else:
+        final_material = inputs.material
+        selling_points = "- Premium quality"
+        scene = "home setting"
+    
+    return {
+        "product_name": inputs.product_name,
+        "product_type": params["product_type"].split()[-1],
+        "material": final_material or "high-quality material",
+        "selling_points": selling_points,
+        "scene": scene,
+        "detail_focus": "texture and craftsmanship",
+        "dimensions": "standard size",
+        "title": inputs.product_name.upper()[:30],
+        "style_prompt": params["style_prompt"],
+    }
+
+
+def _split(value: Any) -> List[str]:
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v.strip() for v in str(value or "").split(",") if v.strip()]
+
+
+def parse_templates(row: Dict[str, Any]) -> Tuple[List[str], Dict[str, int]]:
+    """解析 templates / counts 列"""
+    templates = row.get("templates") or ""
+    if isinstance(templates, dict):
+        selected, counts = list(templates), {str(k): int(v) for k, v in templates.items()}
+    else:
+        extra_counts = [int(c) for c in _split(row.get("counts"))]
+        selected, counts = [], {}
+        for i, item in enumerate(_split(templates)):
+            tid, _, n = item.partition(":")
+            tid = tid.strip()
+            selected.append(tid)
+            counts[tid] = int(n) if n else (extra_counts[i] if i < len(extra_counts) else 1)
+    for tid in selected:
+        if tid not in PROMPT_TEMPLATES:
+            raise ValueError(f"未知模板: {tid}")
+        if counts[tid] < 1:
+            raise ValueError(f"模板 {tid} 数量无效")
+    if not selected:
+        raise ValueError("未指定模板")
+    return selected, counts
+
+
+def build_params(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    简化的请求参数 (命令行清单行 / HTTP 请求体) -> 与网页端相同的生成参数
+
+    Raises:
+        ValueError: 缺少商品名称, 或模板/宽高比/分辨率无效
+    """
+    if not str(row.get("product_name") or "").strip():
+        raise ValueError("缺少商品名称")
+    selected, counts = parse_templates(row)
+    aspect_ratio = row.get("aspect_ratio") or "1:1"
+    if aspect_ratio not in Config.ASPECT_RATIOS.values():
+        raise ValueError(f"不支持的宽高比 {aspect_ratio}")
+    model_id = row.get("model") or Config.DEFAULT_MODEL
+    resolution = row.get("resolution") or "1K"
+    if resolution not in Config.MODEL_CAPABILITIES.get(model_id, {}).get("resolutions", ["1K"]):
+        raise ValueError(f"{model_id} 不支持分辨率 {resolution}")
+    style = row.get("style") or "📷 产品摄影"
+    style_prompt = Config.STYLE_PRESETS.get(style) or next(
+        (v for k, v in Config.STYLE_PRESETS.items() if k.split()[-1] == style), style)
+    return {
+        "product_name": str(row["product_name"]).strip(),
+        "product_type": row.get("product_type") or "其他",
+        "material": row.get("material") or "",
+        "model_id": model_id,
+        "aspect_ratio": aspect_ratio,
+        "resolution": resolution,
+        "strength": float(row.get("strength") or 0.3),
+        "style_prompt": style_prompt,
+        "excludes": list(Config.EXCLUDE_PRESETS["🛡️ 标准"]),
+        "extra": ",".join(_split(row.get("excludes"))),
+        "selected": selected,
+        "counts": counts,
+        "custom_prompts": {},
+    }
+
+
+def build_tasks(selected: List[str], counts: Dict[str, int],
+                custom_prompts: Optional[Dict[str, str]] = None) -> List[GenerationTask]:
+    """按模板选择顺序展开任务列表"""
+    custom_prompts = custom_prompts or {}
+    tasks = []
+    for tid in selected:
+        count = counts.get(tid, 1)
+        prompt_tpl = custom_prompts.get(tid) or get_template_prompt(tid)
+        _, name, _ = TEMPLATE_INFO.get(tid, ("", tid, ""))
+        for k in range(count):
+            tasks.append(GenerationTask(
+                index=len(tasks),
+                template_id=tid,
+                template_name=name,
+                seq=k + 1,
+                count=count,
+                prompt_template=prompt_tpl,
+            ))
+    return tasks
+
+
+def _run_one(client, task: GenerationTask, spec: BatchSpec,
+             store: Optional[ResultStore] = None, batch_id: str = "") -> TaskOutcome:
+    """执行单个任务 (在工作线程中运行)"""
+    start = time.monotonic()
+    with tracing.span("task", template=task.template_id, seq=task.seq) as attrs:
+        try:
+            prompt = task.prompt_template.format(**spec.variables)
+            result = client.generate_image(
+                reference=spec.reference,
+                prompt=prompt,
+                negative_prompt=spec.negative_prompt,
+                aspect_ratio=spec.aspect_ratio,
+                resolution=spec.resolution,
+                style_strength=spec.style_strength,
+            )
+            latency = time.monotonic() - start
+            attrs.update(model=result.model, attempts=result.attempts)
+            # 模型返回的字节即最终产物, 不解码/重新编码
+            data, filename = result.data, task.filename_for(result.mime_type)
+            resolution = result.resolution or spec.resolution
+            if store is not None:
+                with tracing.span("result_write", bytes=len(data)):
+                    handle = store.put_result(batch_id, filename, data)
+                return TaskOutcome(task=task, filename=filename, handle=handle, mime_type=result.mime_type,
+                                   attempts=result.attempts, model=result.model, resolution=resolution,
+                                   latency=latency, size=len(data))
+            return TaskOutcome(task=task, filename=filename, data=data, mime_type=result.mime_type,
+                               attempts=result.attempts, model=result.model, resolution=resolution,
+                               latency=latency, size=len(data))
+        except Exception as e:
+            attrs["error"] = str(e)[:100]
+            return TaskOutcome(task=task, filename=task.filename, error=e, attempts=getattr(e, "attempts", 1),
+                               model=getattr(client, "model", ""), latency=time.monotonic() - start)
+
+
+def run_tasks(
+    client,
+    tasks: List[GenerationTask],
+    spec: BatchSpec,
+    max_workers: int = 4,
+    on_done: Optional[Callable[[TaskOutcome, int, int], None]] = None,
+    store: Optional[ResultStore] = None,
+    batch_id: str = "",
+) -> List[TaskOutcome]:
+    """
+    并发执行任务
+
+    Args:
+        client: GeminiClient (需线程安全)
+        tasks: 任务列表
+        spec: 共享生成参数
+        max_workers: 最大并发数
+        on_done: 每完成一个任务在调用线程中回调 (outcome, 已完成数, 总数)
+        store: 传入时结果直接写盘, outcome 只带句柄不带字节/图片
+        batch_id: 写盘使用的批次 ID
+
+    Returns:
+        按任务顺序排列的结果列表
+    """
+    total = len(tasks)
+    outcomes: List[Optional[TaskOutcome]] = [None] * total
+    if not tasks:
+        return []
+
+    workers = max(1, min(max_workers, total))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gen") as pool:
+        run_one = tracing.propagate(_run_one)
+        futures = {pool.submit(run_one, client, t, spec, store, batch_id): i for i, t in enumerate(tasks)}
+        done = 0
+        for fut in as_completed(futures):
+            outcome = fut.result()
+            outcomes[futures[fut]] = outcome
+            done += 1
+            if on_done:
+                on_done(outcome, done, total)
+
+    return outcomes
@@ -0,0 +1,159 @@
+"""
+TEMU 智能出图系统 V8.0
+全局限流 - 令牌桶 + 在途并发上限
+核心作者: 企鹅
+
+同一 API Key + 模型共享一个令牌桶 (每分钟请求数) 和一个在途请求上限,
+状态保存在数据目录下的 SQLite 中, 所有会话、线程和进程共用。
+请求在调用 API 之前排队等待令牌, 而不是一起撞上 429 再一起退避。
+在途租约带过期时间, 进程崩溃后遗留的租约会自动回收。
+"""
+import asyncio
+import hashlib
+import random
+import sqlite3
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from config import Config
+
+
+class RateLimitTimeout(RuntimeError):
+    """等待令牌超时"""
+
+
+class RateLimiter:
+    """跨进程令牌桶限流器"""
+
+    def __init__(self, path: Optional[Path] = None):
+        Config.ensure_data_dir()
+        self.path = Path(path) if path else Config._data_dir / "ratelimit.db"
+        self._init_db()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                " id TEXT PRIMARY KEY, key TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_leases_key ON leases (key, expires)")
+
+    @staticmethod
+    def bucket_key(api_key: str, model: str) -> str:
+        return f"{hashlib.sha256(api_key.encode()).hexdigest()[:16]}:{model}"
+
+    @staticmethod
+    def limits(model: str) -> Dict[str, float]:
+        caps = Config.MODEL_CAPABILITIES.get(model, {})
+        return {
+            "rpm": caps.get("rpm", Config.DEFAULT_RPM),
+            "max_concurrent": caps.get("max_concurrent", Config.DEFAULT_MAX_CONCURRENT),
+        }
+
+    def try_acquire(self, api_key: str, model: str) -> Tuple[Optional[str], float]:
+        """
+        尝试获取一个令牌和在途名额
+
+        Returns:
+            (租约 ID, 0) 成功; (None, 建议等待秒数) 失败
+        """
+        limits = self.limits(model)
+        rate = limits["rpm"] / 60.0
+        capacity = max(1.0, limits["rpm"] / 60.0 * Config.RATE_LIMIT_BURST_SECONDS)
+        key = self.bucket_key(api_key, model)
+        now = time.time()
+
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM leases WHERE expires < ?", (now,))
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                inflight = conn.execute("SELECT COUNT(*) FROM leases WHERE key = ?", (key,)).fetchone()[0]
+
+                lease_id = None
+                if tokens >= 1 and inflight < limits["max_concurrent"]:
+                    tokens -= 1
+                    lease_id = uuid.uuid4().hex
+                    conn.execute(
+                        "INSERT INTO leases (id, key, expires) VALUES (?, ?, ?)",
+                        (lease_id, key, now + Config.API_TIMEOUT + 60),
+                    )
+                conn.execute(
+                    "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?)"
+                    " ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    (key, tokens, now),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        if lease_id:
+            return lease_id, 0.0
+        wait = (1 - tokens) / rate if tokens < 1 else 0.5  # 无令牌按补充速度等待, 否则等在途请求完成
+        return None, wait
+
+    def _backoff(self, wait: float) -> float:
+        # 随机抖动, 避免所有等待者同时醒来
+        return min(max(wait, 0.05), 2.0) * random.uniform(0.5, 1.5)
+
+    def acquire(self, api_key: str, model: str, timeout: Optional[float] = None) -> str:
+        """阻塞等待直到获得租约"""
+        deadline = time.monotonic() + (timeout if timeout is not None else Config.API_TIMEOUT)
+        while True:
+            lease_id, wait = self.try_acquire(api_key, model)
+            if lease_id:
+                return lease_id
+            if time.monotonic() >= deadline:
+                raise RateLimitTimeout(f"限流等待超时: {model}")
+            time.sleep(self._backoff(wait))
+
+    async def acquire_async(self, api_key: str, model: str, timeout: Optional[float] = None) -> str:
+        deadline = time.monotonic() + (timeout if timeout is not None else Config.API_TIMEOUT)
+        while True:
+            lease_id, wait = await asyncio.to_thread(self.try_acquire, api_key, model)
+            if lease_id:
+                return lease_id
+            if time.monotonic() >= deadline:
+                raise RateLimitTimeout(f"限流等待超时: {model}")
+            await asyncio.sleep(self._backoff(wait))
+
+    def release(self, lease_id: str):
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+        except Exception:
+            pass  # 租约会按过期时间自动回收
+
+    @contextmanager
+    def slot(self, api_key: str, model: str):
+        lease_id = self.acquire(api_key, model)
+        try:
+            yield
+        finally:
+            self.release(lease_id)
+
+    @asynccontextmanager
+    async def aslot(self, api_key: str, model: str):
+        lease_id = await self.acquire_async(api_key, model)
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self.release, lease_id)
@@ -0,0 +1,127 @@
+"""
+TEMU 智能出图系统 V8.0
+参考图预处理 - 一次解码, 一次缩放, 一次编码
+核心作者: 企鹅
+
+同一批次内的分析与所有生成请求共用一个 PreparedReference,
+避免每次调用都 copy + LANCZOS 缩放 + PNG 重新编码。
+JPEG 上传通过 Pillow draft 模式按 1/2~1/8 比例直接缩小解码,
+超大原图不会被完整解码到内存。
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple, Union
+
+from PIL import Image
+
+from config import Config
+
+MAX_REFERENCE_SIDE = 1024
+
+# 请求编码: 名称 -> MIME 类型
+REFERENCE_FORMATS = {
+    "jpeg": "image/jpeg",           # 高质量 JPEG (4:4:4), 照片首选
+    "webp": "image/webp",           # 有损 WebP
+    "webp_lossless": "image/webp",  # 无损 WebP
+    "png": "image/png",             # 普通 PNG (不开 optimize)
+}
+
+
+def _downscale(img: Image.Image, max_side: int) -> Image.Image:
+    """缩放到最长边不超过 max_side, 再统一为 RGB (透明区域铺白底)"""
+    has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+    if img.mode not in ("RGB", "RGBA", "L", "LA"):
+        # 调色板 / 16 位等模式无法用 LANCZOS 缩放, 先转成可缩放的模式
+        img = img.convert("RGBA" if has_alpha else "RGB")
+    if img.width > max_side or img.height > max_side:
+        scale = max_side / max(img.width, img.height)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        # reducing_gap: 先用 reduce() 做整数倍快速缩小, 再 LANCZOS 精修;
+        # 缩放在转换前完成, 大图不会产生一份全尺寸的 RGB 副本
+        img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if img.mode in ("RGBA", "LA"):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def encode_reference(img: Image.Image, fmt: Optional[str] = None,
+                     quality: Optional[int] = None) -> Tuple[bytes, str]:
+    """按配置的请求编码压缩, 返回 (字节, MIME 类型)"""
+    fmt = (fmt or Config.REFERENCE_FORMAT).lower()
+    quality = quality if quality is not None else Config.REFERENCE_QUALITY
+    if fmt not in REFERENCE_FORMATS:
+        raise ValueError(f"不支持的参考图编码: {fmt}")
+    
+    buf = io.BytesIO()
+    if fmt == "jpeg":
+        img.save(buf, format="JPEG", quality=quality, subsampling=0)
+    elif fmt == "webp":
+        img.save(buf, format="WEBP", quality=quality, method=4)
+    elif fmt == "webp_lossless":
+        # 无损模式下 quality 表示压缩力度
+        img.save(buf, format="WEBP", lossless=True, quality=quality, method=4)
+    else:
+        img.save(buf, format="PNG")
+    return buf.getvalue(), REFERENCE_FORMATS[fmt]
+
+
+@dataclass(frozen=True)
+class PreparedReference:
+    """已缩放并编码好的参考图, 可在批次内的所有调用间共享"""
+    data: bytes
+    mime_type: str
+    size: Tuple[int, int]
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(self.data).hexdigest()
+
+    @classmethod
+    def from_file(cls, fp: Any, max_side: int = MAX_REFERENCE_SIDE, fmt: Optional[str] = None,
+                  quality: Optional[int] = None) -> "PreparedReference":
+        """
+        从文件路径 / 文件对象 / 上传对象构建
+
+        使用 draft 解码: JPEG 直接以缩小后的尺寸解码, 不会完整解码大图。
+        fmt / quality 默认取 Config.REFERENCE_FORMAT / REFERENCE_QUALITY。
+        """
+        if hasattr(fp, "seek"):
+            fp.seek(0)
+        with Image.open(fp) as src:
+            src.draft("RGB", (max_side, max_side))
+            img = _downscale(src, max_side)
+        return cls._from_downscaled(img, fmt, quality)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, max_side: int = MAX_REFERENCE_SIDE, fmt: Optional[str] = None,
+                   quality: Optional[int] = None) -> "PreparedReference":
+        return cls.from_file(io.BytesIO(data), max_side, fmt, quality)
+
+    @classmethod
+    def from_image(cls, image: Image.Image, max_side: int = MAX_REFERENCE_SIDE, fmt: Optional[str] = None,
+                   quality: Optional[int] = None) -> "PreparedReference":
+        """从已解码的 PIL 图片构建"""
+        return cls._from_downscaled(_downscale(image, max_side), fmt, quality)
+
+    @classmethod
+    def _from_downscaled(cls, img: Image.Image, fmt: Optional[str],
+                         quality: Optional[int]) -> "PreparedReference":
+        data, mime_type = encode_reference(img, fmt, quality)
+        return cls(data=data, mime_type=mime_type, size=img.size)
+
+    def to_image(self) -> Image.Image:
+        """解码为 PIL 图片 (仅预览时使用)"""
+        return Image.open(io.BytesIO(self.data))
+
+
+def as_reference(reference: Union[Image.Image, PreparedReference]) -> PreparedReference:
+    """兼容旧接口: 传入 PIL 图片时现场预处理"""
+    if isinstance(reference, PreparedReference):
+        return reference
+    return PreparedReference.from_image(reference)
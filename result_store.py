@@ -0,0 +1,167 @@
+"""
+TEMU 智能出图系统 V8.0
+生成结果存储 - 写盘一次, 会话中只保存轻量句柄
+核心作者: 企鹅
+
+目录结构 (位于数据目录下):
+    results/<batch_id>/<文件名>   生成结果
+    results/<batch_id>/.export.zip  打包下载 (按任务顺序, 与结果一起过期清理)
+    uploads/<sha256>.bin          上传原图 (供重新生成使用)
+
+超过 RESULT_TTL_HOURS 的批次与上传会被定期清理。
+ZipExport 直接写入磁盘, 下载时按块读取, 导出内存占用与批次大小无关。
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+
+from config import Config
+
+
+@dataclass(frozen=True)
+class ResultHandle:
+    """指向磁盘上一张结果图的轻量句柄"""
+    batch_id: str
+    filename: str
+    size: int
+
+
+class ResultStore:
+    """磁盘结果存储"""
+
+    GC_INTERVAL = 600  # 两次清理之间的最小间隔 (秒)
+
+    def __init__(self, root: Optional[Path] = None, ttl_hours: Optional[int] = None):
+        Config.ensure_data_dir()
+        self.root = Path(root) if root else Config._data_dir
+        self.results_dir = self.root / "results"
+        self.uploads_dir = self.root / "uploads"
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        self.uploads_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = (ttl_hours if ttl_hours is not None else Config.RESULT_TTL_HOURS) * 3600
+        self._gc_lock = threading.Lock()
+        self._last_gc = 0.0
+
+    # ==================== 写入 ====================
+    @staticmethod
+    def new_batch_id() -> str:
+        return f"{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:6]}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def put_result(self, batch_id: str, filename: str, data: bytes) -> ResultHandle:
+        batch_dir = self.results_dir / batch_id
+        batch_dir.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(batch_dir / filename, data)
+        return ResultHandle(batch_id=batch_id, filename=filename, size=len(data))
+
+    def put_upload(self, data: bytes) -> str:
+        """保存上传原图, 返回内容哈希 (已存在则只刷新时间戳)"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.upload_path(digest)
+        if path.exists():
+            path.touch()
+        else:
+            self._write_atomic(path, data)
+        return digest
+
+    # ==================== 读取 ====================
+    def path(self, handle: ResultHandle) -> Path:
+        return self.results_dir / handle.batch_id / handle.filename
+
+    def exists(self, handle: ResultHandle) -> bool:
+        return self.path(handle).exists()
+
+    def read_bytes(self, handle: ResultHandle) -> bytes:
+        return self.path(handle).read_bytes()
+
+    def load_image(self, handle: ResultHandle) -> Image.Image:
+        """按需解码 (用于需要像素的场景, 展示时直接传路径即可)"""
+        return Image.open(self.path(handle))
+
+    def export_path(self, batch_id: str) -> Path:
+        return self.results_dir / batch_id / ".export.zip"
+
+    def upload_path(self, digest: str) -> Path:
+        return self.uploads_dir / f"{digest}.bin"
+
+    # ==================== 清理 ====================
+    def gc(self, force: bool = False) -> int:
+        """删除过期的批次和上传, 返回删除条目数"""
+        now = time.time()
+        with self._gc_lock:
+            if not force and now - self._last_gc < self.GC_INTERVAL:
+                return 0
+            self._last_gc = now
+
+        cutoff = now - self.ttl_seconds
+        removed = 0
+        for entry in list(self.results_dir.iterdir()) + list(self.uploads_dir.iterdir()):
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                if entry.is_dir():
+                    shutil.rmtree(entry, ignore_errors=True)
+                else:
+                    entry.unlink()
+                removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+
+class ZipExport:
+    """
+    写入磁盘的 ZIP 导出
+
+    先写临时文件, finish() 后原子替换为 path; 未 finish 就 close 时删除临时文件。
+    图片条目使用 ZIP_STORED: PNG / JPEG 本身已压缩, 再 deflate 只浪费 CPU。
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex[:6]}.tmp")
+        self._zip: Optional[zipfile.ZipFile] = zipfile.ZipFile(self._tmp, "w", zipfile.ZIP_STORED)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add_file(self, path: Path, arcname: str):
+        """从磁盘流式拷贝一张图片 (不压缩)"""
+        with self._lock:
+            self._zip.write(path, arcname, compress_type=zipfile.ZIP_STORED)
+            self.count += 1
+
+    def add_text(self, arcname: str, text: str):
+        with self._lock:
+            self._zip.writestr(arcname, text.encode(), compress_type=zipfile.ZIP_DEFLATED)
+
+    def finish(self) -> Path:
+        """写入中央目录并替换为正式文件, 之后不能再追加"""
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+                self._zip = None
+                os.replace(self._tmp, self.path)
+        return self.path
+
+    def close(self):
+        """放弃未完成的导出"""
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+                self._zip = None
+                self._tmp.unlink(missing_ok=True)
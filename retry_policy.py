@@ -0,0 +1,170 @@
+"""
+TEMU 智能出图系统 V8.0
+重试策略 - 按错误类型分类, 遵循 Retry-After, 去相关抖动退避
+核心作者: 企鹅
+
+- 按 SDK 异常类型和 HTTP 状态码判断是否可重试, 不再匹配错误字符串
+- 服务端给出 Retry-After / RetryInfo 时至少等待该时长
+- 退避使用 decorrelated jitter: sleep = min(cap, uniform(base, prev * 3))
+- 单次调用 (含所有重试和等待) 有总时间预算
+- 每个模型可在 Config.MODEL_CAPABILITIES[model]["retry"] 中单独配置
+"""
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, FrozenSet, Optional, Tuple
+
+import httpx
+from google.genai import errors as genai_errors
+
+import metrics
+import tracing
+from config import Config
+
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """重试策略"""
+    max_attempts: int = 4
+    base_delay: float = 1.0       # 秒
+    max_delay: float = 30.0       # 单次等待上限
+    total_budget: float = 600.0   # 单次调用总时间上限 (含重试等待)
+    retry_statuses: FrozenSet[int] = field(default=RETRYABLE_STATUS)
+
+    @classmethod
+    def for_model(cls, model: str, **overrides) -> "RetryPolicy":
+        params = dict(Config.RETRY_DEFAULTS)
+        params.update(Config.MODEL_CAPABILITIES.get(model, {}).get("retry", {}))
+        params.update(Config.RETRY_OVERRIDES)
+        params.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**params)
+
+    def with_attempts(self, max_attempts: Optional[int]) -> "RetryPolicy":
+        return self if max_attempts is None else replace(self, max_attempts=max_attempts)
+
+    def next_delay(self, prev_delay: float, retry_after: Optional[float]) -> float:
+        delay = min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, prev_delay * 3)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class RetryError(RuntimeError):
+    """重试耗尽 (保留最后一次异常和尝试次数)"""
+
+    def __init__(self, last_error: Exception, attempts: int):
+        super().__init__(str(last_error))
+        self.last_error = last_error
+        self.attempts = attempts
+
+
+# ==================== 错误分类 ====================
+def _parse_retry_after(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value.rstrip("s")))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """从响应头 Retry-After 或 google.rpc.RetryInfo 中读取建议等待时间"""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        try:
+            delay = _parse_retry_after(headers.get("retry-after"))
+            if delay is not None:
+                return delay
+        except Exception:
+            pass
+    try:
+        details = getattr(e, "details", None) or {}
+        for item in details.get("error", details).get("details") or []:
+            if str(item.get("@type", "")).endswith("RetryInfo"):
+                return _parse_retry_after(item.get("retryDelay"))
+    except (AttributeError, TypeError):
+        pass
+    return None
+
+
+def error_label(e: Exception) -> str:
+    """指标标签: HTTP 状态码或异常类型"""
+    return str(getattr(e, "code", None) or type(e).__name__)
+
+
+def classify(e: Exception, policy: RetryPolicy) -> Tuple[bool, Optional[float]]:
+    """
+    判断异常是否可重试
+
+    Returns:
+        (是否可重试, 服务端建议等待秒数)
+    """
+    if isinstance(e, genai_errors.APIError):
+        return e.code in policy.retry_statuses, _retry_after(e)
+    if isinstance(e, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)):
+        return True, None
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True, None
+    return False, None
+
+
+# ==================== 执行 ====================
+def call_with_retry(func: Callable, policy: RetryPolicy, *args, **kwargs) -> Tuple[Any, int]:
+    """
+    按策略重试调用
+
+    Returns:
+        (返回值, 尝试次数)
+
+    Raises:
+        RetryError: 不可重试 / 次数耗尽 / 超出时间预算
+    """
+    start = time.monotonic()
+    delay = policy.base_delay
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return func(*args, **kwargs), attempt
+        except Exception as e:
+            retryable, retry_after = classify(e, policy)
+            delay = policy.next_delay(delay, retry_after)
+            if (not retryable or attempt >= policy.max_attempts
+                    or time.monotonic() - start + delay > policy.total_budget):
+                raise RetryError(e, attempt) from e
+            metrics.API_RETRIES.inc(model=kwargs.get("model", ""), reason=error_label(e))
+            with tracing.span("retry_wait", attempt=attempt, delay=round(delay, 2), error=type(e).__name__):
+                time.sleep(delay)
+
+
+async def acall_with_retry(func: Callable, policy: RetryPolicy, *args, **kwargs) -> Tuple[Any, int]:
+    """call_with_retry 的异步版本 (func 为协程函数)"""
+    start = time.monotonic()
+    delay = policy.base_delay
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return await func(*args, **kwargs), attempt
+        except Exception as e:
+            retryable, retry_after = classify(e, policy)
+            delay = policy.next_delay(delay, retry_after)
+            if (not retryable or attempt >= policy.max_attempts
+                    or time.monotonic() - start + delay > policy.total_budget):
+                raise RetryError(e, attempt) from e
+            metrics.API_RETRIES.inc(model=kwargs.get("model", ""), reason=error_label(e))
+            with tracing.span("retry_wait", attempt=attempt, delay=round(delay, 2), error=type(e).__name__):
+                await asyncio.sleep(delay)
@@ -2,9 +2,25 @@
 TEMU 智能出图系统 V8.0
 规则引擎
 核心作者: 企鹅
+
+替换规则和禁用规则各自预编译为一个合并正则 (每条规则一个命名分组),
+每个字符串只扫描一遍; 禁用规则命中时再逐条确认 (多条规则可能重叠)。
+规则从外部文件 (Config.RULES_FILE, JSON) 加载, 文件修改后自动重新编译;
+文件不存在或格式错误时使用内置默认规则 / 保留上一版。
+
+注意: 替换在一遍扫描中完成, 一条规则的替换结果不会再被其他规则匹配;
+同一位置多条规则都能匹配时, 排在前面的规则生效。规则中不要使用编号反向引用 (\\1)。
 """
+import json
+import os
 import re
-from typing import List, Tuple, Dict
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import Config
 
 
 REPLACE_RULES: Dict[str, str] = {
@@ -27,26 +43,146 @@ NEGATIVE_BASE: List[str] = [
 ]
 
 
+@dataclass
+class ScreenResult:
+    """单条文本的筛查结果"""
+    text: str
+    cleaned: str
+    replacements: List[Tuple[str, str]] = field(default_factory=list)  # 命中的 (规则, 替换为)
+    bans: List[str] = field(default_factory=list)  # 命中的禁用规则
+
+    @property
+    def banned(self) -> bool:
+        return bool(self.bans)
+
+
+def _combine(patterns: List[str]) -> Optional["re.Pattern[str]"]:
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?P<r{i}>{p})" for i, p in enumerate(patterns)), re.IGNORECASE)
+
+
+class RuleSet:
+    """预编译的规则集"""
+
+    def __init__(self, replace_rules: Dict[str, str], ban_patterns: List[str],
+                 negative_base: Optional[List[str]] = None):
+        self.replace_rules = dict(replace_rules)
+        self.ban_patterns = list(ban_patterns)
+        self.negative_base = list(negative_base if negative_base is not None else NEGATIVE_BASE)
+        self._replace_items = list(self.replace_rules.items())
+        self._replace_re = _combine([p for p, _ in self._replace_items])
+        self._ban_re = _combine(self.ban_patterns)
+        self._ban_each = [re.compile(p, re.IGNORECASE) for p in self.ban_patterns]
+        # 替换 + 禁用规则合并, 用于快速跳过未命中任何规则的文本 (大多数文本)
+        self._any_re = _combine([p for p, _ in self._replace_items] + self.ban_patterns)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RuleSet":
+        return cls(
+            data.get("replace", REPLACE_RULES),
+            data.get("ban", BAN_PATTERNS),
+            data.get("negative_base", NEGATIVE_BASE),
+        )
+
+    def apply_replacements(self, text: str) -> Tuple[str, List[Tuple[str, str]]]:
+        if not text or self._replace_re is None:
+            return text, []
+        hits = set()
+
+        def repl(m: "re.Match[str]") -> str:
+            idx = int(m.lastgroup[1:])
+            hits.add(idx)
+            return self._replace_items[idx][1]
+
+        result = self._replace_re.sub(repl, text)
+        return result, [self._replace_items[i] for i in sorted(hits)]
+
+    def check_absolute_bans(self, text: str) -> List[str]:
+        if not self.is_banned(text):
+            return []
+        # 合并正则每处只报告一条规则, 重叠的命中 (如 "www.com") 需逐条检查
+        return [p for p, r in zip(self.ban_patterns, self._ban_each) if r.search(text)]
+
+    def is_banned(self, text: str) -> bool:
+        """只判断是否命中, 找到第一处即返回"""
+        return bool(text) and self._ban_re is not None and self._ban_re.search(text) is not None
+
+    def screen(self, text: str) -> ScreenResult:
+        if not text or self._any_re is None or self._any_re.search(text) is None:
+            return ScreenResult(text, text)
+        cleaned, replacements = self.apply_replacements(text)
+        return ScreenResult(text, cleaned, replacements, self.check_absolute_bans(cleaned))
+
+    def screen_batch(self, texts: Iterable[str]) -> List[ScreenResult]:
+        """批量筛查 (先替换, 再对替换后的文本检查禁用规则)"""
+        return [self.screen(t) for t in texts]
+
+
+DEFAULT_RULES = RuleSet(REPLACE_RULES, BAN_PATTERNS, NEGATIVE_BASE)
+
+
+class RulesLoader:
+    """从规则文件加载, 文件变化时自动重新编译"""
+
+    def __init__(self, path: Optional[Path] = None, check_interval: Optional[float] = None):
+        self.path = Path(path) if path else Path(Config.RULES_FILE)
+        self.check_interval = check_interval if check_interval is not None else Config.RULES_RELOAD_INTERVAL
+        self._rules = DEFAULT_RULES
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.last_error = ""
+
+    def get(self) -> RuleSet:
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return self._rules
+        with self._lock:
+            if now - self._checked >= self.check_interval:
+                self._checked = now
+                self._reload()
+        return self._rules
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            if self._mtime is not None:
+                self._rules, self._mtime = DEFAULT_RULES, None  # 文件被删除, 回到默认规则
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            self._rules = RuleSet.from_dict(json.loads(self.path.read_text(encoding="utf-8")))
+            self.last_error = ""
+        except (ValueError, re.error, AttributeError) as e:
+            self.last_error = f"{self.path.name}: {e}"  # 保留上一版规则
+        self._mtime = mtime
+
+
+_loader = RulesLoader()
+
+
+def get_rules() -> RuleSet:
+    """当前生效的规则集"""
+    return _loader.get()
+
+
 def apply_replacements(text: str) -> Tuple[str, List[Tuple[str, str]]]:
-    if not text:
-        return text, []
-    result, logs = text, []
-    for pattern, repl in REPLACE_RULES.items():
-        new = re.sub(pattern, repl, result, flags=re.IGNORECASE)
-        if new != result:
-            logs.append((pattern, repl))
-            result = new
-    return result, logs
+    return get_rules().apply_replacements(text)
 
 
 def check_absolute_bans(text: str) -> List[str]:
-    if not text:
-        return []
-    return [p for p in BAN_PATTERNS if re.search(p, text, flags=re.IGNORECASE)]
+    return get_rules().check_absolute_bans(text)
+
+
+def screen_batch(texts: Iterable[str]) -> List[ScreenResult]:
+    return get_rules().screen_batch(texts)
 
 
 def build_negative_prompt(exclude_items: List[str], strict_mode: bool = True) -> str:
-    negatives = list(NEGATIVE_BASE)
+    negatives = list(get_rules().negative_base)
     for item in exclude_items or []:
         if item and item.strip():
             negatives.append(f"no {item.strip()}")
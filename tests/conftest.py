@@ -0,0 +1,61 @@
+"""
+TEMU 智能出图系统 V8.0
+测试公共夹具 - 全部基于模拟 Gemini 服务, 不调用真实 API
+核心作者: 企鹅
+
+运行: python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 须在导入 config 之前设置: 数据目录指向临时目录, 不使用环境中的模拟服务配置
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="temu_test_")
+os.environ.pop("FAKE_GEMINI", None)
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import pytest  # noqa: E402
+
+from config import Config  # noqa: E402
+from fake_gemini import FakeGeminiBackend  # noqa: E402
+from gemini_client import GeminiClient  # noqa: E402
+
+PRO_MODEL = "gemini-3-pro-image-preview"
+FLASH_MODEL = "gemini-2.5-flash-image"
+
+# 无延迟的模拟服务; 各测试按需追加错误注入
+INSTANT = "latency=fixed:0;analysis_latency=fixed:0;retry_after=0"
+
+
+@pytest.fixture
+def fast_retry(monkeypatch):
+    """重试等待缩短到毫秒级 (仍走真实的重试/分类逻辑)"""
+    monkeypatch.setattr(Config, "RETRY_OVERRIDES", {"base_delay": 0.001, "max_delay": 0.005})
+    return Config.RETRY_OVERRIDES
+
+
+@pytest.fixture
+def fake_backend():
+    """按配置串构建模拟服务: fake_backend("rate_503=0.5")"""
+    def make(spec: str = "") -> FakeGeminiBackend:
+        return FakeGeminiBackend.from_spec(f"{INSTANT};{spec}")
+    return make
+
+
+@pytest.fixture
+def fake_client():
+    """使用模拟服务的 GeminiClient"""
+    def make(backend: FakeGeminiBackend, model: str = PRO_MODEL, **kwargs) -> GeminiClient:
+        return GeminiClient("test-key", model, backend=backend, **kwargs)
+    return make
+
+
+@pytest.fixture
+def reference():
+    from PIL import Image
+    from reference import PreparedReference
+    return PreparedReference.from_image(Image.new("RGB", (64, 64), (200, 60, 40)))
@@ -0,0 +1,97 @@
+"""
+TEMU 智能出图系统 V8.0
+命令行批量出图测试 - 断点续跑只补生成缺失 / 失败的图片
+核心作者: 企鹅
+"""
+import csv
+import functools
+import json
+
+import pytest
+from PIL import Image
+
+import bulk_generate
+from config import Config
+from gemini_client import GeminiClient
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "RATE_LIMIT_ENABLED", False)
+    Image.new("RGB", (64, 64), (200, 60, 40)).save(tmp_path / "bottle.png")
+    manifest = tmp_path / "manifest.csv"
+    with manifest.open("w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["sku", "image", "product_name", "templates", "model"])
+        writer.writerow(["A1", "bottle.png", "Water Bottle", "C1:2,C3:1", "gemini-2.5-flash-image"])
+        writer.writerow(["B2", "bottle.png", "Ceramic Mug", "C1:1", "gemini-2.5-flash-image"])
+    return manifest, tmp_path / "out"
+
+
+@pytest.fixture
+def run(monkeypatch, workspace):
+    """用给定的模拟服务运行一次命令行, 返回 (退出码, 生成请求数)"""
+    manifest, out = workspace
+
+    def run_once(backend, *extra):
+        monkeypatch.setattr(bulk_generate, "GeminiClient", functools.partial(GeminiClient, backend=backend))
+        code = bulk_generate.main([str(manifest), "-o", str(out), "--api-key", "test-key",
+                                   "--jobs", "2", "--concurrency", "2", *extra])
+        return code, backend.stats()["images"]
+    return run_once
+
+
+def _records(out):
+    with (out / "results.csv").open(encoding="utf-8-sig") as f:
+        return list(csv.DictReader(f))
+
+
+def test_full_run_writes_results(run, workspace, fake_backend):
+    _, out = workspace
+    assert run(fake_backend()) == (0, 4)
+    records = _records(out)
+    assert [r["sku"] for r in records] == ["A1", "A1", "A1", "B2"]
+    assert all(r["status"] == "done" for r in records)
+    assert all((out / r["file"]).exists() for r in records)
+
+
+def test_resume_regenerates_only_missing_files(run, workspace, fake_backend):
+    _, out = workspace
+    assert run(fake_backend()) == (0, 4)
+    assert run(fake_backend()) == (0, 0)  # 全部已完成, 不再请求
+
+    missing = out / _records(out)[1]["file"]
+    missing.unlink()
+    assert run(fake_backend()) == (0, 1)
+    assert missing.exists()
+    assert len(_records(out)) == 4
+
+
+def test_resume_retries_failed_images(run, workspace, fake_backend, fast_retry, monkeypatch):
+    _, out = workspace
+    monkeypatch.setitem(Config.RETRY_OVERRIDES, "max_attempts", 1)
+    code, _ = run(fake_backend("rate_503=0.5;seed=1"))
+    records = _records(out)
+    failed = sum(r["status"] == "failed" for r in records)
+    assert code == 1 and 0 < failed < 4
+
+    assert run(fake_backend()) == (0, failed)
+    assert all(r["status"] == "done" for r in _records(out))
+
+
+def test_restart_ignores_checkpoint(run, fake_backend):
+    assert run(fake_backend()) == (0, 4)
+    assert run(fake_backend(), "--restart") == (0, 4)
+
+
+def test_checkpoint_ignores_truncated_last_line(run, workspace, fake_backend):
+    _, out = workspace
+    assert run(fake_backend()) == (0, 4)
+    checkpoint = out / "checkpoint.jsonl"
+    lines = checkpoint.read_text(encoding="utf-8").splitlines()
+    # 中断时最后一行只写了一半
+    checkpoint.write_text("\n".join(lines[:-1]) + "\n" + lines[-1][:10], encoding="utf-8")
+    lost = json.loads(lines[-1])
+    assert run(fake_backend()) == (0, 1)
+    assert (out / lost["sku"] / lost["file"]).exists()
+    assert run(fake_backend()) == (0, 0)
@@ -0,0 +1,87 @@
+"""
+TEMU 智能出图系统 V8.0
+对冲请求测试 - 触发阈值 / 每个 API Key 的在途上限
+核心作者: 企鹅
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from config import Config
+from conftest import FLASH_MODEL, PRO_MODEL
+from hedging import HedgeBudget, Hedger, LatencyTracker
+
+
+def _primed_hedger(model: str, max_inflight: int, latency: float = 0.01) -> Hedger:
+    """近期延迟都很短的对冲器: 之后的慢请求会超过阈值"""
+    tracker = LatencyTracker(window=50, min_samples=5)
+    for _ in range(10):
+        tracker.record(model, latency)
+    return Hedger(latency=tracker, budget=HedgeBudget(max_inflight=max_inflight), percentile=0.9)
+
+
+def _wait_idle(backend, timeout: float = 5.0):
+    """等输掉的对冲请求结束 (同步请求无法中断, 会在后台跑完)"""
+    deadline = time.monotonic() + timeout
+    while backend.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def hedging_on(monkeypatch):
+    monkeypatch.setattr(Config, "HEDGE_ENABLED", True)
+
+
+def test_no_hedge_without_enough_samples(fake_backend, fake_client, reference, hedging_on):
+    backend = fake_backend("latency=fixed:0.05")
+    hedger = Hedger(latency=LatencyTracker(min_samples=5), budget=HedgeBudget(max_inflight=5))
+    result = fake_client(backend, hedger=hedger).generate_image(reference, "a bottle")
+    assert result.hedged is False
+    assert backend.stats()["calls"] == 1
+
+
+def test_slow_request_is_hedged(fake_backend, fake_client, reference, hedging_on):
+    backend = fake_backend("latency=fixed:0.2")
+    hedger = _primed_hedger(PRO_MODEL, max_inflight=1)
+    result = fake_client(backend, hedger=hedger).generate_image(reference, "a bottle")
+    assert result.hedged is True
+    _wait_idle(backend)
+    assert backend.stats()["calls"] == 2
+    assert hedger.budget.try_acquire("test-key")  # 对冲结束后名额已归还
+
+
+def test_hedge_budget_caps_concurrent_hedges(fake_backend, fake_client, reference, hedging_on):
+    backend = fake_backend("latency=fixed:0.3")
+    hedger = _primed_hedger(PRO_MODEL, max_inflight=1)
+    client = fake_client(backend, hedger=hedger)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: client.generate_image(reference, "a bottle"), range(4)))
+    _wait_idle(backend)
+    assert sum(r.hedged for r in results) == 1
+    assert backend.stats()["calls"] == 5
+
+
+def test_zero_budget_never_hedges(fake_backend, fake_client, reference, hedging_on):
+    backend = fake_backend("latency=fixed:0.1")
+    hedger = _primed_hedger(PRO_MODEL, max_inflight=0)
+    result = fake_client(backend, hedger=hedger).generate_image(reference, "a bottle")
+    assert result.hedged is False
+    assert backend.stats()["calls"] == 1
+
+
+def test_models_without_hedge_flag_are_not_hedged(fake_backend, fake_client, reference, hedging_on):
+    backend = fake_backend("latency=fixed:0.1")
+    hedger = _primed_hedger(FLASH_MODEL, max_inflight=5)
+    result = fake_client(backend, FLASH_MODEL, hedger=hedger).generate_image(reference, "a bottle")
+    assert result.hedged is False
+    assert backend.stats()["calls"] == 1
+
+
+def test_budget_is_per_api_key():
+    budget = HedgeBudget(max_inflight=1)
+    assert budget.try_acquire("key-a")
+    assert not budget.try_acquire("key-a")
+    assert budget.try_acquire("key-b")
+    budget.release("key-a")
+    assert budget.try_acquire("key-a")
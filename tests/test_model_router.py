@@ -0,0 +1,88 @@
+"""
+TEMU 智能出图系统 V8.0
+模型路由测试 - 超出 SLO 降级 / 探测恢复 / 恢复后保持
+核心作者: 企鹅
+"""
+import pytest
+
+from config import Config
+from conftest import FLASH_MODEL, PRO_MODEL
+from model_router import ModelRouter, RoutedClient
+from retry_policy import RetryError
+
+SLOW = "fixed:0.06"
+FAST = "fixed:0"
+
+
+@pytest.fixture
+def routed(monkeypatch, fake_backend, fake_client):
+    """Pro 的 p95 SLO 缩小到 30ms, 模拟服务延迟可随时切换"""
+    slo = Config.MODEL_CAPABILITIES[PRO_MODEL]["slo"]
+    monkeypatch.setitem(slo, "p95_latency", 0.03)
+    monkeypatch.setattr(Config, "SLO_MIN_SAMPLES", 5)
+    monkeypatch.setattr(Config, "SLO_RECOVERY_PROBES", 2)
+    monkeypatch.setattr(Config, "SLO_PROBE_INTERVAL", 3600)
+    backend = fake_backend(f"latency={SLOW}")
+    router = ModelRouter()
+    client = RoutedClient(router, lambda model: fake_client(backend, model), PRO_MODEL)
+    return router, client, backend
+
+
+def _degrade(router, client, reference):
+    for _ in range(Config.SLO_MIN_SAMPLES):
+        client.generate_image(reference, "a bottle", resolution="2K")
+    assert router.is_degraded(PRO_MODEL)
+
+
+def test_breaching_slo_falls_back(routed, reference):
+    router, client, backend = routed
+    _degrade(router, client, reference)
+    result = client.generate_image(reference, "a bottle", resolution="2K")
+    assert result.model == FLASH_MODEL
+    assert result.resolution == "1K"
+
+
+def test_within_slo_stays_on_primary(routed, reference):
+    router, client, backend = routed
+    backend.config.latency = FAST
+    for _ in range(10):
+        result = client.generate_image(reference, "a bottle", resolution="2K")
+        assert result.model == PRO_MODEL
+        assert result.resolution == "2K"
+    assert not router.is_degraded(PRO_MODEL)
+
+
+def test_recovery_sticks_after_good_probes(routed, monkeypatch, reference):
+    router, client, backend = routed
+    _degrade(router, client, reference)
+    backend.config.latency = FAST
+    monkeypatch.setattr(Config, "SLO_PROBE_INTERVAL", 0)  # 每个请求都作为探测
+    for _ in range(Config.SLO_RECOVERY_PROBES):
+        assert client.generate_image(reference, "a bottle").model == PRO_MODEL
+    assert not router.is_degraded(PRO_MODEL)
+
+    # 降级前的慢样本已清空, 恢复后的正常请求不会立即再次降级
+    monkeypatch.setattr(Config, "SLO_PROBE_INTERVAL", 3600)
+    for _ in range(Config.SLO_MIN_SAMPLES * 2):
+        assert client.generate_image(reference, "a bottle").model == PRO_MODEL
+    assert not router.is_degraded(PRO_MODEL)
+
+
+def test_slow_probe_keeps_fallback(routed, monkeypatch, reference):
+    router, client, backend = routed
+    _degrade(router, client, reference)
+    monkeypatch.setattr(Config, "SLO_PROBE_INTERVAL", 0)
+    for _ in range(3):
+        client.generate_image(reference, "a bottle")
+    assert router.is_degraded(PRO_MODEL)
+
+
+def test_overload_errors_count_towards_error_rate(routed, fast_retry, reference):
+    router, client, backend = routed
+    backend.config.latency = FAST
+    backend.config.rate_503 = 1.0
+    for _ in range(Config.SLO_MIN_SAMPLES):
+        with pytest.raises(RetryError):
+            client.generate_image(reference, "a bottle")
+    assert router.is_degraded(PRO_MODEL)
+    assert router.health.stats(PRO_MODEL)["error_rate"] == 1.0
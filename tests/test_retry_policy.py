@@ -0,0 +1,97 @@
+"""
+TEMU 智能出图系统 V8.0
+重试策略测试 - 错误分类 / Retry-After / 次数上限
+核心作者: 企鹅
+"""
+import httpx
+import pytest
+
+from config import Config
+from conftest import FLASH_MODEL, PRO_MODEL
+from fake_gemini import _api_error
+from retry_policy import RetryError, RetryPolicy, call_with_retry, classify
+
+
+# ==================== 错误分类 ====================
+def test_classify_uses_status_codes_not_messages():
+    policy = RetryPolicy()
+    assert classify(_api_error(503, "UNAVAILABLE", "overloaded"), policy) == (True, None)
+    assert classify(_api_error(500, "INTERNAL", "boom"), policy)[0] is True
+    # 错误信息里带 "timeout" 也不重试: 只看状态码
+    assert classify(_api_error(400, "INVALID_ARGUMENT", "timeout in prompt"), policy)[0] is False
+    assert classify(_api_error(403, "PERMISSION_DENIED", "bad key"), policy)[0] is False
+    assert classify(ValueError("503 unavailable"), policy) == (False, None)
+
+
+def test_classify_network_errors_are_retryable():
+    policy = RetryPolicy()
+    assert classify(httpx.ConnectTimeout("slow"), policy)[0] is True
+    assert classify(ConnectionResetError(), policy)[0] is True
+    assert classify(TimeoutError(), policy)[0] is True
+
+
+def test_classify_reads_retry_info_from_429(fake_backend, fake_client, reference, fast_retry):
+    backend = fake_backend("rate_429=1;retry_after=7")
+    with pytest.raises(RetryError) as info:
+        fake_client(backend, max_retries=1).generate_image(reference, "a bottle")
+    retryable, retry_after = classify(info.value.last_error, RetryPolicy())
+    assert retryable is True
+    assert retry_after == 7.0
+
+
+def test_next_delay_honours_retry_after():
+    policy = RetryPolicy(base_delay=0.01, max_delay=0.02)
+    assert policy.next_delay(0.01, None) <= 0.02
+    assert policy.next_delay(0.01, 5.0) == 5.0
+
+
+# ==================== 执行 ====================
+def test_transient_errors_are_retried_until_success(fake_backend, fake_client, reference, fast_retry):
+    backend = fake_backend("rate_503=0.5;seed=3")
+    client = fake_client(backend, max_retries=20)
+    results = [client.generate_image(reference, "a bottle") for _ in range(10)]
+    stats = backend.stats()
+    assert stats["images"] == 10
+    assert stats["error_503"] > 0
+    assert sum(r.attempts for r in results) == stats["calls"]
+
+
+def test_retries_stop_at_max_attempts(fake_backend, fake_client, reference, fast_retry):
+    backend = fake_backend("rate_429=1")
+    with pytest.raises(RetryError) as info:
+        fake_client(backend, max_retries=3).generate_image(reference, "a bottle")
+    assert info.value.attempts == 3
+    assert info.value.last_error.code == 429
+    assert backend.stats()["error_429"] == 3
+
+
+def test_non_retryable_error_fails_on_first_attempt():
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise _api_error(400, "INVALID_ARGUMENT", "bad request")
+
+    with pytest.raises(RetryError) as info:
+        call_with_retry(bad_request, RetryPolicy(base_delay=0.001))
+    assert info.value.attempts == 1
+    assert len(calls) == 1
+
+
+def test_total_budget_limits_retries():
+    def overloaded():
+        raise _api_error(503, "UNAVAILABLE", "overloaded")
+
+    policy = RetryPolicy(max_attempts=100, base_delay=0.05, max_delay=0.05, total_budget=0.12)
+    with pytest.raises(RetryError) as info:
+        call_with_retry(overloaded, policy)
+    assert 1 < info.value.attempts < 5
+
+
+def test_env_overrides_win_over_model_settings(monkeypatch):
+    monkeypatch.setattr(Config, "RETRY_OVERRIDES", {"max_attempts": 2})
+    assert RetryPolicy.for_model(PRO_MODEL).max_attempts == 2
+    assert RetryPolicy.for_model(FLASH_MODEL).max_attempts == 2
+    monkeypatch.setattr(Config, "RETRY_OVERRIDES", {})
+    assert RetryPolicy.for_model(PRO_MODEL).max_attempts == 4
+    assert RetryPolicy.for_model(FLASH_MODEL).max_attempts == 5
@@ -0,0 +1,74 @@
+"""
+TEMU 智能出图系统 V8.0
+规则引擎测试 - 单遍扫描与逐条正则的结果一致 (含重叠的禁用规则)
+核心作者: 企鹅
+"""
+import random
+import re
+
+import pytest
+
+from rules import BAN_PATTERNS, DEFAULT_RULES, REPLACE_RULES, RuleSet
+
+WORDS = ["Stainless", "Steel", "Water", "Bottle", "Ceramic", "Mug", "Bamboo", "Cotton", "Tote", "LED", "Lamp"]
+SPICE = ["Gold", "silver", "Diamond", "PLATINUM"]
+BANNED = ["www.shop", "best.com deal", "scan QR here", "temu exclusive", "http://x",
+          "www.com", "https://www.temu.com"]  # 后两条重叠命中多条禁用规则
+
+
+def legacy_screen(text: str):
+    """旧版实现: 每条规则单独 re.sub / re.search"""
+    result, logs = text, []
+    for pattern, repl in REPLACE_RULES.items():
+        new = re.sub(pattern, repl, result, flags=re.IGNORECASE)
+        if new != result:
+            logs.append((pattern, repl))
+            result = new
+    bans = [p for p in BAN_PATTERNS if re.search(p, result, flags=re.IGNORECASE)]
+    return result, logs, bans
+
+
+def synthetic_texts(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        words = rng.sample(WORDS, rng.randint(2, 6))
+        if rng.random() < 0.3:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(SPICE))
+        if rng.random() < 0.3:
+            words.append(rng.choice(BANNED))
+        texts.append(" ".join(words))
+    return texts
+
+
+def test_screen_batch_matches_legacy():
+    texts = synthetic_texts(2000) + BANNED + SPICE + ["", "plain text"]
+    for text, result in zip(texts, DEFAULT_RULES.screen_batch(texts)):
+        assert (result.cleaned, result.replacements, result.bans) == legacy_screen(text), text
+
+
+@pytest.mark.parametrize("text", ["www.com", "visit https://www.temu.com now", "WWW.COM"])
+def test_overlapping_bans_are_all_reported(text):
+    expected = [p for p in BAN_PATTERNS if re.search(p, text, flags=re.IGNORECASE)]
+    assert len(expected) > 1
+    assert DEFAULT_RULES.check_absolute_bans(text) == expected
+    assert DEFAULT_RULES.is_banned(text)
+
+
+def test_custom_overlapping_patterns():
+    rules = RuleSet({}, [r"foo", r"foo\s*bar", r"bar"])
+    assert rules.check_absolute_bans("FOO bar") == [r"foo", r"foo\s*bar", r"bar"]
+    assert rules.check_absolute_bans("bar") == [r"bar"]
+    assert rules.check_absolute_bans("baz") == []
+
+
+def test_replacement_output_is_not_rescanned():
+    rules = RuleSet({"a": "b", "b": "c"}, [])
+    assert rules.apply_replacements("ab") == ("bc", [("a", "b"), ("b", "c")])
+
+
+def test_empty_rules():
+    rules = RuleSet({}, [])
+    result = rules.screen("anything")
+    assert result.cleaned == "anything"
+    assert not result.banned
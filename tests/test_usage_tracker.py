@@ -0,0 +1,105 @@
+"""
+TEMU 智能出图系统 V8.0
+额度预留测试 - reserve / commit / refund, 多线程与多实例
+核心作者: 企鹅
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from config import Config
+from usage_tracker import QuotaExceeded, UsageTracker
+
+USER = "user-a"
+
+
+@pytest.fixture
+def tracker(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "DAILY_LIMIT", 10)
+    trackers = []
+
+    def make() -> UsageTracker:
+        t = UsageTracker(path=tmp_path / "usage.db", flush_interval=3600)
+        trackers.append(t)
+        return t
+
+    yield make
+    for t in trackers:
+        t.close()
+
+
+def test_reserve_commit_refund(tracker):
+    t = tracker()
+    rid = t.reserve(USER, 6)
+    assert t.get_reserved(USER) == 6
+    assert t.check_quota(USER, using_own_key=False) == (True, 4)
+
+    with pytest.raises(QuotaExceeded) as info:
+        t.reserve(USER, 5)
+    assert info.value.remaining == 4
+
+    t.commit(rid, 4)  # 成功 4 张, 其余 2 张退回
+    assert t.get_usage(USER) == 4
+    assert t.get_reserved(USER) == 0
+
+    rid = t.reserve(USER, 6)
+    t.refund(rid)
+    assert t.get_usage(USER) == 4
+    assert t.get_reserved(USER) == 0
+    assert t.check_quota(USER, using_own_key=False) == (True, 6)
+
+
+def test_commit_is_idempotent(tracker):
+    t = tracker()
+    rid = t.reserve(USER, 3)
+    t.commit(rid, 3)
+    t.commit(rid, 3)  # 预留已结算, 不重复计数
+    assert t.get_usage(USER) == 3
+
+
+def test_expired_reservation_is_released(tracker):
+    t = tracker()
+    rid = t.reserve(USER, 8, ttl=-1)
+    assert t.reserve(USER, 10)  # 过期预留不占额度
+    t.commit(rid, 2, user_id=USER)  # 过期后结算仍按成功张数计入
+    assert t.get_usage(USER) == 2
+
+
+def test_add_usage_counts_against_reservations(tracker):
+    t = tracker()
+    t.add_usage(USER, 7)
+    with pytest.raises(QuotaExceeded) as info:
+        t.reserve(USER, 4)
+    assert info.value.remaining == 3
+
+
+def test_concurrent_reservations_never_exceed_limit(tracker):
+    t = tracker()
+
+    def try_reserve(_):
+        try:
+            return t.reserve(USER, 2)
+        except QuotaExceeded:
+            return None
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        granted = [rid for rid in pool.map(try_reserve, range(16)) if rid]
+    assert len(granted) == 5
+    assert t.get_reserved(USER) == 10
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda rid: t.commit(rid, 1), granted))
+    assert t.get_usage(USER) == 5
+    assert t.get_reserved(USER) == 0
+
+
+def test_instances_share_the_database(tracker):
+    a, b = tracker(), tracker()
+    rid = a.reserve(USER, 6)
+    with pytest.raises(QuotaExceeded):
+        b.reserve(USER, 5)
+    b.commit(rid, 6)  # 另一个进程/副本结算同一预留
+    a.flush()
+    assert a.get_usage(USER) == 6
+    assert b.get_usage(USER) == 6
+    assert a.get_reserved(USER) == 0
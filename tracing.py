@@ -0,0 +1,188 @@
+"""
+TEMU 智能出图系统 V8.0
+任务追踪 - 按阶段记录耗时
+核心作者: 企鹅
+
+每个生成任务一条 Trace, 各阶段 (参考图编码 / 分析 / 限流排队 / API 调用 / 重试等待 /
+提取图片 / 写盘 / ZIP) 记录为嵌套的 span, 任务结束后导出为 JSON,
+管理员面板可查看。未处于任务追踪中时 span() 不做任何记录。
+
+当前 span 通过 contextvars 传递; 提交到线程池的函数需用 propagate() 包装,
+工作线程中的 span 才能挂到同一条 Trace 下。
+
+可选 cProfile: Trace(profile=True) 时, 追踪范围内的每个线程各自采集, 导出时合并。
+Python 3.12+ 的 cProfile 基于进程全局的 sys.monitoring, 同一时刻只能启用一个:
+只在任务主线程采集, 结果包含同一时段所有线程 (含其他并发任务), 见 PROFILE_SCOPE。
+"""
+import contextvars
+import cProfile
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# "thread": 按线程采集, 只含本任务; "process": 全进程采集, 可能混入其他并发任务
+PROFILE_SCOPE = "thread" if sys.version_info < (3, 12) else "process"
+
+_current: contextvars.ContextVar[Optional[Tuple["Trace", Optional[int]]]] = contextvars.ContextVar(
+    "trace_span", default=None)
+
+
+class Trace:
+    """一个任务的全部 span (线程安全)"""
+
+    def __init__(self, name: str, trace_id: str = "", profile: bool = False):
+        self.name = name
+        self.trace_id = trace_id
+        self.profile = profile
+        self.started_at = time.time()
+        self._t0 = time.monotonic()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.spans: List[Dict[str, Any]] = []
+        self._profiles: List[cProfile.Profile] = []
+
+    def _new_id(self) -> int:
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def _add(self, record: Dict[str, Any]):
+        with self._lock:
+            self.spans.append(record)
+
+    def _add_profile(self, prof: cProfile.Profile):
+        with self._lock:
+            self._profiles.append(prof)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start"])
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": round(time.monotonic() - self._t0, 4),
+            "profile_scope": PROFILE_SCOPE if self.profile else None,
+            "spans": spans,
+        }
+
+    def save(self, path: Path):
+        path.write_text(json.dumps(self.to_dict(), ensure_ascii=False))
+
+    def save_profile(self, path: Path) -> bool:
+        """合并各线程的 cProfile 结果并写入 .prof (可用 snakeviz / pstats 查看)"""
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return False
+        stats = pstats.Stats(profiles[0])
+        for prof in profiles[1:]:
+            stats.add(prof)
+        stats.dump_stats(str(path))
+        return True
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Dict[str, Any]]:
+    """
+    记录一个阶段的耗时
+
+    返回的 dict 为该 span 的属性, 可在阶段内补充 (如响应大小)。
+    """
+    current = _current.get()
+    if current is None:
+        yield attrs
+        return
+    trace, parent = current
+    record = {"id": trace._new_id(), "parent": parent, "name": name,
+              "thread": threading.current_thread().name, "attrs": attrs}
+    token = _current.set((trace, record["id"]))
+    start = time.monotonic()
+    try:
+        yield attrs
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        record["start"] = round(start - trace._t0, 4)
+        record["duration"] = round(time.monotonic() - start, 4)
+        trace._add(record)
+
+
+@contextmanager
+def _profiled(trace: Trace, worker: bool = False):
+    if not trace.profile or (worker and PROFILE_SCOPE == "process"):
+        yield  # 全进程采集时工作线程已被主线程的 profiler 覆盖
+        return
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        yield  # 已有其他 profiler 在运行 (如 3.12+ 下另一个任务正在采集)
+        return
+    try:
+        yield
+    finally:
+        prof.disable()
+        trace._add_profile(prof)
+
+
+@contextmanager
+def activate(trace: Trace, root: str = "job", **attrs) -> Iterator[Trace]:
+    """在当前线程开始追踪, 范围内的 span 都记入 trace"""
+    token = _current.set((trace, None))
+    try:
+        with _profiled(trace), span(root, **attrs):
+            yield trace
+    finally:
+        _current.reset(token)
+
+
+def propagate(func: Callable) -> Callable:
+    """包装提交到线程池的函数, 使其中的 span 挂到提交者所在的 Trace 下"""
+    current = _current.get()
+    if current is None:
+        return func
+
+    def run(*args, **kwargs):
+        token = _current.set(current)
+        try:
+            with _profiled(current[0], worker=True):
+                return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+# ==================== 查看 ====================
+def summarize(trace: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """按阶段汇总 (并发阶段的合计耗时可能超过任务总耗时)"""
+    stages: Dict[str, List[float]] = {}
+    for s in trace.get("spans", []):
+        stages.setdefault(s["name"], []).append(s["duration"])
+    rows = []
+    for name, durations in stages.items():
+        durations.sort()
+        rows.append({
+            "stage": name,
+            "count": len(durations),
+            "total": round(sum(durations), 3),
+            "p50": durations[len(durations) // 2],
+            "max": durations[-1],
+            "errors": sum(1 for s in trace["spans"] if s["name"] == name and s.get("error")),
+        })
+    return sorted(rows, key=lambda r: r["total"], reverse=True)
+
+
+def profile_text(path: Path, limit: int = 30, sort: str = "cumulative") -> str:
+    """.prof 文件的前 limit 行统计"""
+    buf = io.StringIO()
+    pstats.Stats(str(path), stream=buf).strip_dirs().sort_stats(sort).print_stats(limit)
+    return buf.getvalue()
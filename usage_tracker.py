@@ -2,53 +2,222 @@
 TEMU 智能出图系统 V8.0
 使用量追踪
 核心作者: 企鹅
+
+计数保存在数据目录下的 SQLite (WAL 模式) 中, 每个 (日期, 用户) 一行,
+累加用 UPSERT 原子完成, 多线程、多进程、多副本共享同一数据文件时也不会丢计数。
+首次启动时自动导入旧版 usage.json。
+
+读写走内存计数表 (write-behind): 页面每次刷新查询配额不再访问磁盘,
+新增计数记为增量, 每隔 USAGE_FLUSH_INTERVAL 秒、累计 USAGE_FLUSH_MAX_PENDING 次
+或进程退出时批量写入数据库, 写入后重新读取当天计数以同步其他进程的变化。
+
+批量生成使用预留 (reserve / commit / refund): 提交时在一个数据库事务内
+检查额度并预留 N 张, 结束时按成功张数扣减、其余退回。多个批次可完全并行,
+额度仍然严格不超。预留带过期时间, 进程崩溃遗留的预留会自动释放。
 """
+import atexit
 import json
 import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import Dict, Tuple
-import threading
+from typing import Dict, Iterator, Optional, Tuple
 
+import metrics
 from config import Config
 
+RETENTION_DAYS = 7
+
+Key = Tuple[str, str]  # (日期, 用户)
+
+
+class QuotaExceeded(RuntimeError):
+    """剩余额度不足以预留"""
+
+    def __init__(self, remaining: int):
+        super().__init__(f"额度不足 (剩余 {remaining} 张)")
+        self.remaining = remaining
+
 
 class UsageTracker:
-    _lock = threading.Lock()
     
-    def __init__(self):
+    def __init__(self, path: Optional[Path] = None, flush_interval: Optional[float] = None,
+                 max_pending: Optional[int] = None):
         Config.ensure_data_dir()
-        self._ensure_file()
+        self.path = Path(path) if path else Config._data_dir / "usage.db"
+        self.flush_interval = flush_interval if flush_interval is not None else Config.USAGE_FLUSH_INTERVAL
+        self.max_pending = max_pending if max_pending is not None else Config.USAGE_FLUSH_MAX_PENDING
+        self._init_db()
+        self._migrate_json()
+        
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._counts: Dict[Key, int] = {}  # 当天计数 (含未写盘的增量)
+        self._reserved: Dict[Key, int] = {}  # 当天未结算的预留
+        self._loaded_day = ""
+        self._pending: Dict[Key, int] = defaultdict(int)
+        self._pending_ops = 0
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="usage-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+        self._register_metrics()
+    
+    def _register_metrics(self):
+        metrics.QUOTA_USED_TODAY.set_function(lambda: self.today_totals()[0])
+        metrics.QUOTA_RESERVED_TODAY.set_function(lambda: self.today_totals()[1])
+        metrics.QUOTA_USERS_TODAY.set_function(lambda: self.today_totals()[2])
     
     @property
     def usage_file(self) -> Path:
+        """旧版 JSON 存储 (仅用于迁移)"""
         return Config._usage_file
     
-    def _ensure_file(self):
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
         try:
-            if self.usage_file and not self.usage_file.exists():
-                self.usage_file.write_text("{}")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            yield conn
+        finally:
+            conn.close()
+    
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                " day TEXT NOT NULL, user_id TEXT NOT NULL, count INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (day, user_id)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS reservations ("
+                " id TEXT PRIMARY KEY, day TEXT NOT NULL, user_id TEXT NOT NULL,"
+                " count INTEGER NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_reservations_user ON reservations (day, user_id)")
+    
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    
+    def _migrate_json(self):
+        """导入旧版 usage.json, 导入后重命名为 usage.json.migrated"""
+        src = self.usage_file
+        if not src or not src.exists():
+            return
+        try:
+            content = src.read_text()
+            data = json.loads(content) if content.strip() else {}
+            rows = [(day, uid, int(n)) for day, users in data.items() for uid, n in users.items()]
+            with self._transaction() as conn:
+                conn.executemany(
+                    "INSERT INTO usage (day, user_id, count) VALUES (?, ?, ?)"
+                    " ON CONFLICT(day, user_id) DO UPDATE SET count = max(count, excluded.count)",
+                    rows,
+                )
+            src.replace(src.with_name(src.name + ".migrated"))
         except Exception:
             pass
     
-    def _load(self) -> Dict:
-        with self._lock:
-            try:
-                if self.usage_file and self.usage_file.exists():
-                    content = self.usage_file.read_text()
-                    return json.loads(content) if content.strip() else {}
-            except Exception:
-                pass
-            return {}
+    # ==================== 内存计数 / 写盘 ====================
+    def _load_day(self, day: str):
+        """从数据库读取某天的全部计数和预留, 叠加尚未写盘的增量 (需持有 _lock)"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT user_id, count FROM usage WHERE day = ?", (day,)).fetchall()
+            reserved = conn.execute(
+                "SELECT user_id, SUM(count) FROM reservations WHERE day = ? AND expires >= ? GROUP BY user_id",
+                (day, time.time()),
+            ).fetchall()
+        self._reserved = {(day, uid): n for uid, n in reserved}
+        counts = {(day, uid): n for uid, n in rows}
+        for key, delta in self._pending.items():
+            if key[0] == day:
+                counts[key] = counts.get(key, 0) + delta
+        self._counts = counts
+        self._loaded_day = day
     
-    def _save(self, data: Dict):
+    @staticmethod
+    def _read_user(conn: sqlite3.Connection, day: str, user_id: str) -> Tuple[int, int]:
+        """事务内读取某用户当天的 (已用, 未过期预留)"""
+        row = conn.execute("SELECT count FROM usage WHERE day = ? AND user_id = ?", (day, user_id)).fetchone()
+        reserved = conn.execute(
+            "SELECT COALESCE(SUM(count), 0) FROM reservations WHERE day = ? AND user_id = ? AND expires >= ?",
+            (day, user_id, time.time()),
+        ).fetchone()[0]
+        return (row[0] if row else 0), reserved
+
+    def _set_user(self, day: str, user_id: str, used: int, reserved: int):
+        """
+        用事务内读到的数据库值覆盖内存计数 (叠加尚未写盘的增量)
+
+        不按差值累加: 事务提交后、取得 _lock 前, flush / _load_day 可能已重新读到本次写入。
+        """
         with self._lock:
+            if self._loaded_day != day:
+                return
+            key = (day, user_id)
+            self._reserved[key] = reserved
+            self._counts[key] = used + self._pending.get(key, 0)
+
+    def _ensure_day(self, day: str):
+        if self._loaded_day != day:
+            self._load_day(day)
+    
+    def flush(self):
+        """把内存中的增量写入数据库, 并重新读取当天计数"""
+        with self._flush_lock:
+            with self._lock:
+                batch = dict(self._pending)
+                self._pending.clear()
+                self._pending_ops = 0
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception:
+                    # 写盘失败, 增量放回下次再写
+                    with self._lock:
+                        for key, n in batch.items():
+                            self._pending[key] += n
+                    return
+            # 同步其他进程/副本写入的计数
             try:
-                if self.usage_file:
-                    self.usage_file.write_text(json.dumps(data, indent=2))
+                with self._lock:
+                    self._load_day(date.today().isoformat())
             except Exception:
                 pass
     
+    def _write(self, batch: Dict[Key, int]):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO usage (day, user_id, count) VALUES (?, ?, ?)"
+                " ON CONFLICT(day, user_id) DO UPDATE SET count = count + excluded.count",
+                [(day, uid, n) for (day, uid), n in batch.items()],
+            )
+            conn.execute("DELETE FROM usage WHERE day < ?",
+                         ((date.today() - timedelta(days=RETENTION_DAYS)).isoformat(),))
+    
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+    
+    def close(self):
+        """停止后台写盘并写入剩余增量"""
+        self._stop.set()
+        self.flush()
+    
     def get_user_id(self, session_state) -> str:
         if "user_id" not in session_state:
             unique = f"{id(session_state)}_{datetime.now().isoformat()}"
@@ -56,40 +225,126 @@ class UsageTracker:
         return session_state.user_id
     
     def get_usage(self, user_id: str) -> int:
-        data = self._load()
-        return data.get(date.today().isoformat(), {}).get(user_id, 0)
+        day = date.today().isoformat()
+        with self._lock:
+            self._ensure_day(day)
+            return self._counts.get((day, user_id), 0)
     
     def add_usage(self, user_id: str, count: int = 1):
-        data = self._load()
-        today = date.today().isoformat()
-        if today not in data:
-            data[today] = {}
-            cutoff = (date.today() - timedelta(days=7)).isoformat()
-            for k in list(data.keys()):
-                if k < cutoff:
-                    del data[k]
-        data[today][user_id] = data[today].get(user_id, 0) + count
-        self._save(data)
+        key = (date.today().isoformat(), user_id)
+        metrics.QUOTA_CONSUMED.inc(count)
+        with self._lock:
+            self._ensure_day(key[0])
+            self._counts[key] = self._counts.get(key, 0) + count
+            self._pending[key] += count
+            self._pending_ops += 1
+            full = self._pending_ops >= self.max_pending
+        if full:
+            self.flush()
+    
+    def get_reserved(self, user_id: str) -> int:
+        day = date.today().isoformat()
+        with self._lock:
+            self._ensure_day(day)
+            return self._reserved.get((day, user_id), 0)
     
     def check_quota(self, user_id: str, using_own_key: bool) -> Tuple[bool, int]:
         if using_own_key:
             return True, Config.DAILY_LIMIT_WITH_OWN_KEY
-        used = self.get_usage(user_id)
+        used = self.get_usage(user_id) + self.get_reserved(user_id)
         remaining = Config.DAILY_LIMIT - used
         return remaining > 0, max(0, remaining)
     
+    # ==================== 预留 ====================
+    def reserve(self, user_id: str, count: int, ttl: Optional[float] = None) -> str:
+        """
+        原子地预留 count 张额度
+        
+        Returns:
+            预留 ID (用于 commit / refund)
+        
+        Raises:
+            QuotaExceeded: 已用 + 已预留 + count 超过每日额度
+        """
+        self.flush()  # 本进程未写盘的计数先落库, 保证检查准确
+        day = date.today().isoformat()
+        now = time.time()
+        reservation_id = uuid.uuid4().hex
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM reservations WHERE expires < ?", (now,))
+            used, reserved = self._read_user(conn, day, user_id)
+            remaining = Config.DAILY_LIMIT - used - reserved
+            if count > remaining:
+                metrics.QUOTA_RESERVATIONS.inc(outcome="rejected")
+                raise QuotaExceeded(max(0, remaining))
+            conn.execute(
+                "INSERT INTO reservations (id, day, user_id, count, expires) VALUES (?, ?, ?, ?, ?)",
+                (reservation_id, day, user_id, count,
+                 now + (ttl if ttl is not None else Config.QUOTA_RESERVATION_TTL)),
+            )
+        self._set_user(day, user_id, used, reserved + count)
+        metrics.QUOTA_RESERVATIONS.inc(outcome="ok")
+        return reservation_id
+    
+    def commit(self, reservation_id: str, used: int, user_id: Optional[str] = None):
+        """
+        结算预留: 计入 used 张, 其余退回
+        
+        预留已过期被回收时, 若给出 user_id 则仍按 used 计入当天用量。
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT day, user_id, count FROM reservations WHERE id = ?",
+                               (reservation_id,)).fetchone()
+            conn.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+            if row is not None:
+                day, user_id, _ = row
+            elif user_id is not None:
+                day = date.today().isoformat()
+            else:
+                return
+            if used > 0:
+                conn.execute(
+                    "INSERT INTO usage (day, user_id, count) VALUES (?, ?, ?)"
+                    " ON CONFLICT(day, user_id) DO UPDATE SET count = count + excluded.count",
+                    (day, user_id, used),
+                )
+            db_used, db_reserved = self._read_user(conn, day, user_id)
+        if used > 0:
+            metrics.QUOTA_CONSUMED.inc(used)  # 事务提交后再计数, 回滚时不计入
+        self._set_user(day, user_id, db_used, db_reserved)
+    
+    def refund(self, reservation_id: str):
+        """整体退回预留"""
+        self.commit(reservation_id, 0)
+    
+    def today_totals(self) -> Tuple[int, int, int]:
+        """(今日已用, 未结算预留, 有用量的用户数), 读内存状态, 供指标抓取"""
+        day = date.today().isoformat()
+        with self._lock:
+            self._ensure_day(day)
+            used = sum(n for (d, _), n in self._counts.items() if d == day)
+            reserved = sum(n for (d, _), n in self._reserved.items() if d == day)
+            users = sum(1 for (d, _), n in self._counts.items() if d == day and n > 0)
+        return used, reserved, users
+    
     def get_stats(self) -> Dict:
-        data = self._load()
-        today_data = data.get(date.today().isoformat(), {})
+        self.flush()
+        with self._connect() as conn:
+            details = conn.execute(
+                "SELECT user_id, count FROM usage WHERE day = ? ORDER BY count DESC",
+                (date.today().isoformat(),),
+            ).fetchall()
         return {
-            "total": sum(today_data.values()),
-            "users": len(today_data),
-            "details": sorted(today_data.items(), key=lambda x: -x[1]),
+            "total": sum(n for _, n in details),
+            "users": len(details),
+            "details": details,
         }
     
     def clear_today(self):
-        data = self._load()
-        today = date.today().isoformat()
-        if today in data:
-            del data[today]
-            self._save(data)
+        day = date.today().isoformat()
+        with self._flush_lock, self._lock:
+            for key in [k for k in self._pending if k[0] == day]:
+                del self._pending[key]
+            with self._connect() as conn:
+                conn.execute("DELETE FROM usage WHERE day = ?", (day,))
+            self._load_day(day)